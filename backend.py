@@ -0,0 +1,211 @@
+from typing import Protocol
+
+from daily_reset import GameClock
+from db import DB, AsyncDB
+
+
+# ================== ИНТЕРФЕЙС ХРАНИЛИЩА ==================
+
+
+class StorageBackend(Protocol):
+    """
+    Всё, что бот и его сервисы вызывают у базы.
+
+    Реализации: AsyncDB над sqlite (db.py) и PostgresDB (db_postgres.py).
+    Все методы асинхронные, кроме is_banned и ban_stats — они читают
+    кэш банов в памяти (его сверяет с базой refresh_bans). connect()
+    вызывается один раз при старте бота, close() — при выключении.
+    """
+
+    daily_attempts: int
+
+    async def connect(self): ...
+
+    async def close(self): ...
+
+    async def pool_stats(self) -> dict: ...
+
+    # ---- пользователи и игра ----
+
+    async def get_user(self, user_id: int) -> dict: ...
+
+    async def update_user_fields(self, user_id: int, **fields): ...
+
+    async def play_attempt(self, user_id: int) -> dict: ...
+
+    async def set_attempts_left(self, user_id: int, attempts_left: int): ...
+
+    async def add_purchased_attempts(self, user_id: int, attempts: int): ...
+
+    async def claim_daily_reset(self, day: str, now: float, lease: float): ...
+
+    async def reset_daily_attempts_batch(self, day: str, after_user_id: int, limit: int) -> tuple: ...
+
+    async def get_top_winners(self, limit: int = 10, offset: int = 0): ...
+
+    async def get_user_rank(self, user_id: int): ...
+
+    # ---- баланс бота и платежи ----
+
+    async def get_bot_stars(self) -> int: ...
+
+    async def add_bot_stars(self, amount: int): ...
+
+    async def apply_payment(
+        self,
+        user_id: int,
+        total_amount: int,
+        currency: str,
+        payload: str,
+        charge_id: str | None,
+        attempts: int = 0,
+        bot_stars: int = 0,
+        task: tuple | None = None,
+    ) -> dict: ...
+
+    async def get_user_payment_totals(self, user_id: int) -> list[dict]: ...
+
+    async def get_period_payment_totals(self, since_day: str, until_day: str) -> list[dict]: ...
+
+    # ---- баны ----
+
+    async def ban_user(self, user_id: int, reason: str = ...): ...
+
+    async def unban_user(self, user_id: int): ...
+
+    async def refresh_bans(self) -> bool: ...
+
+    def is_banned(self, user_id: int) -> bool: ...
+
+    def ban_stats(self) -> dict: ...
+
+    # ---- выводы подарков ----
+
+    async def reserve_withdrawal(
+        self, user_id: int, gift_id: str, cost_stars: int, wins_cost: int, key: str | None = None
+    ) -> dict: ...
+
+    async def mark_withdrawal_sending(self, withdrawal_id: int) -> bool: ...
+
+    async def commit_withdrawal(self, withdrawal_id: int): ...
+
+    async def rollback_withdrawal(self, withdrawal_id: int) -> bool: ...
+
+    async def recover_withdrawals(self, older_than: float) -> dict: ...
+
+    async def withdrawal_stats(self) -> dict: ...
+
+    # ---- рассылки ----
+
+    async def create_broadcast(
+        self, admin_chat_id: int, text: str, owner: str | None = None, lease_until: float = 0
+    ) -> dict: ...
+
+    async def get_broadcasts(self, status: str = "running") -> list[dict]: ...
+
+    async def get_broadcast(self, broadcast_id: int): ...
+
+    async def claim_broadcast(self, broadcast_id: int, owner: str, now: float, lease: float) -> bool: ...
+
+    async def release_broadcast(self, broadcast_id: int, owner: str): ...
+
+    async def save_broadcast_progress(
+        self,
+        broadcast_id: int,
+        last_user_id: int,
+        counters: dict,
+        status: str | None = None,
+        owner: str | None = None,
+        lease_until: float = 0,
+    ) -> bool: ...
+
+    async def set_broadcast_status(self, broadcast_id: int, status: str) -> bool: ...
+
+    async def get_user_ids_after(self, after_user_id: int, limit: int = 500) -> list[int]: ...
+
+    # ---- медиа ----
+
+    async def get_media_file_id(self, key: str): ...
+
+    async def set_media_file_id(self, key: str, file_id: str): ...
+
+    async def delete_media_file_id(self, key: str): ...
+
+    # ---- отложенные задачи ----
+
+    async def schedule_task(self, kind: str, payload: dict, run_at: float) -> int: ...
+
+    async def claim_due_tasks(self, now: float, limit: int, lease: float, max_attempts: int) -> list[dict]: ...
+
+    async def complete_task(self, task_id: int, next_task: tuple | None = None): ...
+
+    async def fail_task(self, task_id: int, error: str, retry_at: float | None): ...
+
+    async def next_task_run_at(self): ...
+
+    # ---- состояния диалогов (FSM) ----
+
+    async def fsm_get(self, key: str, now: float): ...
+
+    async def fsm_set_state(self, key: str, state: str | None, expires_at: float): ...
+
+    async def fsm_set_data(self, key: str, data: dict, expires_at: float): ...
+
+    async def fsm_purge(self, now: float) -> int: ...
+
+    # ---- промокоды ----
+
+    async def create_promo(self, code: str, reward_wins: int, one_time: int): ...
+
+    async def create_promos_batch(self, promos: list[tuple]) -> bool: ...
+
+    async def import_promos_batch(self, promos: list[tuple]) -> int: ...
+
+    async def get_promos_page(self, after_code: str = "", limit: int = 1000) -> list[tuple]: ...
+
+    async def get_promo(self, code: str): ...
+
+    async def redeem_promo(self, user_id: int, code: str) -> dict: ...
+
+
+def create_backend(
+    database_url: str | None,
+    sqlite_path: str,
+    daily_attempts: int = 15,
+    win_chance: float = 0.27,
+    pool_size: int = 4,
+    clock: GameClock | None = None,
+    group_commit: bool = True,
+    commit_batch: int = 16,
+    commit_delay: float = 0.0,
+) -> StorageBackend:
+    """
+    postgresql://... в database_url — PostgreSQL, иначе sqlite по sqlite_path.
+    group_commit, commit_batch, commit_delay — единственный писатель sqlite
+    (см. SQLiteWriter); PostgreSQL пишет из своего пула соединений.
+    """
+    if database_url and database_url.startswith(("postgres://", "postgresql://")):
+        # asyncpg нужен только для PostgreSQL — импортируем по требованию
+        from db_postgres import PostgresDB
+
+        return PostgresDB(
+            database_url,
+            daily_attempts=daily_attempts,
+            win_chance=win_chance,
+            pool_size=pool_size,
+            clock=clock,
+        )
+
+    return AsyncDB(
+        DB(
+            sqlite_path,
+            daily_attempts=daily_attempts,
+            win_chance=win_chance,
+            pool_size=pool_size,
+            clock=clock,
+        ),
+        max_workers=pool_size,
+        group_commit=group_commit,
+        commit_batch=commit_batch,
+        commit_delay=commit_delay,
+    )
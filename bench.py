@@ -0,0 +1,874 @@
+"""
+Нагрузочный тест хранилища. Здесь только замеры: правильность (атомарная
+игра, промокоды, выводы, задачи, миграции, сброс, групповой commit)
+проверяют тесты в tests/ (python -m pytest).
+
+Запускает N одновременных "нажатий" play и параллельно меряет задержку
+event loop (насколько позже планового просыпается таймер).
+Сравнивает прямые вызовы DB в event loop с AsyncDB.
+
+    python bench.py --users 200 --clicks 20 --lock-ms 50
+
+С --dice N отправляет всплеск из N оплаченных бросков кубика и меряет,
+как быстро освобождается хендлер оплаты и сколько результатов в секунду
+доставляет планировщик.
+
+С --webhook N поднимает webhook-приложение бота на localhost (Telegram
+подменён фейковой сессией), отправляет N синтетических апдейтов и меряет
+время обработки каждого запроса.
+
+С --migrate N собирает базу старого формата (без schema_version и
+payment_daily) с N платежами, прогоняет миграции и меряет, как долго
+параллельная запись ждёт блокировку во время пакетного заполнения сумм.
+
+С --reset N сравнивает сброс бесплатных попыток у N пользователей:
+старый ленивый (SELECT + UPDATE + SELECT на первое действие каждого за день,
+меряется на выборке и пересчитывается на N) и пакетный DailyReset.
+
+С --handlers N прогоняет N виртуальных пользователей через хендлеры бота
+(старт, play, профиль, топ, покупка попыток, промокод) без сети и выдаёт
+p50/p95/p99 по действиям, лаг event loop и число SQL на апдейт; падает,
+если нажатия play, отсечённые антиспамом, доходят до базы.
+--json сохраняет результат, --baseline сравнивает с прошлым прогоном:
+
+    python bench.py --handlers 500 --json base.json
+    python bench.py --handlers 500 --baseline base.json --max-regression 0.3
+
+С --writes N сравнивает N изменяющих вызовов из --concurrency задач
+через пул потоков (каждый вызов — свой commit) и через один писатель
+с групповым commit: вызовов и commit в секунду, задержки, ошибки блокировки.
+
+--audit снимает в этом прогоне EXPLAIN QUERY PLAN каждого различного SQL
+и сохраняет отчёт, --audit-baseline падает, если появился полный скан
+или временное B-дерево, которых не было в прошлом отчёте:
+
+    python bench.py --handlers 500 --audit plans.json
+    python bench.py --handlers 500 --audit-baseline plans.json
+"""
+
+import argparse
+import asyncio
+import importlib
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+from datetime import datetime, timedelta
+
+import aiohttp
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiohttp import web
+
+from daily_reset import DailyReset, GameClock
+from db import DB, AsyncDB, ConnectionPool
+from migrations import migrate
+from query_audit import QueryAuditor, compare_reports, format_report
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, round(p / 100 * (len(values) - 1))))
+    return values[k]
+
+
+async def loop_lag_probe(stop: asyncio.Event, samples: list[float], interval: float = 0.005):
+    """
+    Каждые interval секунд засыпает и записывает, на сколько проснулся позже.
+    """
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(interval)
+        samples.append((loop.time() - start - interval) * 1000)
+
+
+def lock_holder(path: str, stop: threading.Event, hold_ms: int):
+    """
+    Имитирует медленный commit: периодически держит write-lock на базе.
+    """
+    conn = sqlite3.connect(path, timeout=30)
+    while not stop.is_set():
+        conn.execute("BEGIN IMMEDIATE")
+        time.sleep(hold_ms / 1000)
+        conn.commit()
+        time.sleep(hold_ms / 1000)
+    conn.close()
+
+
+async def run(mode: str, path: str, users: int, clicks: int, lock_ms: int) -> dict:
+    sync_db = DB(path)
+    adb = AsyncDB(sync_db)
+
+    stop_lock = threading.Event()
+    locker = None
+    if lock_ms:
+        locker = threading.Thread(target=lock_holder, args=(path, stop_lock, lock_ms), daemon=True)
+        locker.start()
+
+    lag: list[float] = []
+    latencies: list[float] = []
+    stop = asyncio.Event()
+    probe = asyncio.create_task(loop_lag_probe(stop, lag))
+
+    async def user_clicks(user_id: int):
+        for _ in range(clicks):
+            t0 = time.perf_counter()
+            if mode == "sync":
+                sync_db.play_attempt(user_id)
+            else:
+                await adb.play_attempt(user_id)
+            latencies.append((time.perf_counter() - t0) * 1000)
+            await asyncio.sleep(0)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(user_clicks(uid) for uid in range(1, users + 1)))
+    elapsed = time.perf_counter() - t0
+
+    stop.set()
+    await probe
+    stop_lock.set()
+    if locker:
+        locker.join()
+    pool = sync_db.pool_stats()
+    await adb.close()
+
+    return {
+        "mode": mode,
+        "plays": len(latencies),
+        "plays_per_sec": len(latencies) / elapsed if elapsed else 0.0,
+        "play_p50_ms": percentile(latencies, 50),
+        "play_p99_ms": percentile(latencies, 99),
+        "loop_lag_mean_ms": statistics.fmean(lag) if lag else 0.0,
+        "loop_lag_max_ms": max(lag) if lag else 0.0,
+        "pool_wait_avg_ms": pool["wait_avg_ms"],
+        "pool_wait_max_ms": pool["wait_max_ms"],
+    }
+
+
+def count_queries(sync_db: DB) -> list[int]:
+    """
+    Подключает счётчик SQL-запросов ко всем соединениям пула.
+    """
+    counter = [0]
+    pool = sync_db.pool
+    pool.close()
+    new_connection = pool._new_connection
+
+    def traced():
+        conn = new_connection()
+        conn.set_trace_callback(lambda _sql: counter.__setitem__(0, counter[0] + 1))
+        return conn
+
+    pool._new_connection = traced
+    return counter
+
+
+# ---- фейковый Telegram ----
+
+
+class FakeSession(BaseSession):
+    """
+    Сессия aiogram без сети: на send_* возвращает правдоподобное сообщение,
+    на остальные методы — True. Считает вызовы API.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.calls: dict[str, int] = {}
+        self._ids = itertools.count(1)
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, *args, **kwargs):
+        yield b""
+
+    async def make_request(self, bot, method, timeout=None):
+        from aiogram.types import Chat, Dice, Message, PhotoSize
+
+        name = type(method).__name__
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if method.__returning__ is not Message:
+            return True if name != "CreateInvoiceLink" else "https://t.me/$bench"
+
+        chat_id = getattr(method, "chat_id", 0)
+        extra = {}
+        if name == "SendPhoto":
+            extra["photo"] = [PhotoSize(file_id=f"photo-{next(self._ids)}", file_unique_id="u", width=1, height=1)]
+        if name == "SendDice":
+            extra["dice"] = Dice(emoji="🎲", value=3)
+        return Message(
+            message_id=next(self._ids),
+            date=datetime.now(),
+            chat=Chat(id=chat_id if isinstance(chat_id, int) else 0, type="private"),
+            **extra,
+        )
+
+
+def synthetic_update(update_id: int, user_id: int, kind: str) -> dict:
+    user = {"id": user_id, "is_bot": False, "first_name": "bench"}
+    chat = {"id": user_id, "type": "private"}
+    if kind == "start" or kind.startswith("/"):
+        text = "/start" if kind == "start" else kind
+        return {
+            "update_id": update_id,
+            "message": {"message_id": update_id, "date": 0, "chat": chat, "from": user, "text": text},
+        }
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": user,
+            "chat_instance": "bench",
+            "data": kind,
+            "message": {"message_id": update_id, "date": 0, "chat": chat, "text": "bench"},
+        },
+    }
+
+
+def load_bot(path: str):
+    """
+    Импортирует bot.py на отдельной базе. Повторный вызов перезагружает модуль,
+    потому что shutdown диспетчера закрывает базу предыдущего прогона.
+    """
+    import sys
+
+    os.environ["DB_PATH"] = path
+    os.environ["WEBHOOK_SECRET"] = "bench-secret"
+    if "bot" in sys.modules:
+        bot_module = importlib.reload(sys.modules["bot"])
+    else:
+        bot_module = importlib.import_module("bot")
+
+    logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+    logging.getLogger("aiohttp.access").setLevel(logging.WARNING)
+    return bot_module
+
+
+def payment_update(update_id: int, user_id: int, payload: str, amount: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "bench"},
+            "successful_payment": {
+                "currency": "XTR",
+                "total_amount": amount,
+                "invoice_payload": payload,
+                "telegram_payment_charge_id": f"bench-{update_id}",
+                "provider_payment_charge_id": "",
+            },
+        },
+    }
+
+
+def pre_checkout_update(update_id: int, user_id: int, payload: str, amount: int) -> dict:
+    return {
+        "update_id": update_id,
+        "pre_checkout_query": {
+            "id": str(update_id),
+            "from": {"id": user_id, "is_bot": False, "first_name": "bench"},
+            "currency": "XTR",
+            "total_amount": amount,
+            "invoice_payload": payload,
+        },
+    }
+
+
+async def bench_dice(path: str, rolls: int) -> dict:
+    from aiogram.types import Update
+
+    bot_module = load_bot(path)
+    session = FakeSession()
+    bot = Bot("42:BENCH", session=session)
+    dp = bot_module.build_dispatcher()
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+
+    latencies: list[float] = []
+
+    async def pay(i: int):
+        update = Update.model_validate(payment_update(i, 1000 + i, "dice_game", 8), context={"bot": bot})
+        t0 = time.perf_counter()
+        await dp.feed_update(bot, update)
+        latencies.append((time.perf_counter() - t0) * 1000)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(pay(i) for i in range(1, rolls + 1)))
+    # каждый бросок — две задачи: бросок и объявление результата
+    while bot_module.scheduler.stats()["done"] < rolls * 2:
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - t0
+    await dp.emit_shutdown(bot=bot, dispatcher=dp)
+
+    return {
+        "rolls": rolls,
+        "handler_p50_ms": percentile(latencies, 50),
+        "handler_p99_ms": percentile(latencies, 99),
+        "total_sec": elapsed,
+        "results_per_sec": rolls / elapsed if elapsed else 0.0,
+        "delay_sec": bot_module.DICE_RESULT_DELAY,
+    }
+
+
+async def bench_webhook(path: str, updates: int, concurrency: int) -> dict:
+    bot_module = load_bot(path)
+
+    session = FakeSession()
+    bot = Bot("42:BENCH", session=session)
+    dp = bot_module.build_dispatcher()
+    # ждём завершения хендлера, чтобы мерить обработку, а не только приём
+    app = bot_module.build_webhook_app(bot, dp, handle_in_background=False)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    url = f"http://127.0.0.1:{port}{bot_module.WEBHOOK_PATH}"
+    headers = {"X-Telegram-Bot-Api-Secret-Token": "bench-secret"}
+
+    kinds = ["play", "play", "play", "profile", "top", "start"]
+    latencies: list[float] = []
+    sem = asyncio.Semaphore(concurrency)
+
+    async def send(http: aiohttp.ClientSession, i: int):
+        payload = synthetic_update(i, 1000 + i % 200, kinds[i % len(kinds)])
+        async with sem:
+            t0 = time.perf_counter()
+            async with http.post(url, json=payload, headers=headers) as resp:
+                await resp.read()
+                assert resp.status == 200, resp.status
+            latencies.append((time.perf_counter() - t0) * 1000)
+
+    t0 = time.perf_counter()
+    async with aiohttp.ClientSession() as http:
+        await asyncio.gather(*(send(http, i) for i in range(1, updates + 1)))
+    elapsed = time.perf_counter() - t0
+    await runner.cleanup()
+
+    return {
+        "updates": updates,
+        "updates_per_sec": updates / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50),
+        "p99_ms": percentile(latencies, 99),
+        "api_calls": sum(session.calls.values()),
+    }
+
+
+def legacy_db(path: str, payments: int):
+    """
+    База в формате до миграций: users и payments без новых колонок и индексов.
+    """
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        """
+        CREATE TABLE users (
+            user_id INTEGER PRIMARY KEY,
+            total_wins INTEGER NOT NULL DEFAULT 0,
+            wins_for_gift INTEGER NOT NULL DEFAULT 0,
+            gifts_count INTEGER NOT NULL DEFAULT 0,
+            daily_attempts_used INTEGER NOT NULL DEFAULT 0,
+            last_attempt_date TEXT
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE payments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            total_amount INTEGER NOT NULL,
+            currency TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        )
+        """
+    )
+    conn.executemany(
+        "INSERT INTO payments (user_id, total_amount, currency, payload, created_at) VALUES (?, ?, 'XTR', ?, ?)",
+        (
+            (i % 1000, 10 + i % 7, ("topup", "buy_attempts_10", "dice_game")[i % 3], f"2024-01-{1 + i % 28:02d}T12:00:00")
+            for i in range(payments)
+        ),
+    )
+    conn.commit()
+    conn.close()
+
+
+def bench_migrate(path: str, payments: int) -> dict:
+    legacy_db(path, payments)
+    pool = ConnectionPool(path, size=2)
+
+    stop = threading.Event()
+    waits: list[float] = []
+
+    def writer():
+        conn = sqlite3.connect(path, timeout=30)
+        i = 0
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            conn.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (10**9 + i,))
+            conn.commit()
+            waits.append((time.perf_counter() - t0) * 1000)
+            i += 1
+            time.sleep(0.001)
+        conn.close()
+
+    thread = threading.Thread(target=writer, daemon=True)
+    thread.start()
+    t0 = time.perf_counter()
+    applied = migrate(pool)
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    thread.join()
+    pool.close()
+
+    backfill = next((m for m in applied if m["version"] == 6), {})
+    return {
+        "payments": payments,
+        "migrations": len(applied),
+        "total_sec": elapsed,
+        "batches": backfill.get("batches", 0),
+        "max_batch_ms": backfill.get("max_batch_ms", 0.0),
+        "writer_max_wait_ms": max(waits) if waits else 0.0,
+    }
+
+
+def fill_users(path: str, users: int, day: str, active_share: float = 0.2):
+    """
+    users пользователей; каждый 1/active_share-й играл в day и потратил попытки.
+    """
+    every = max(1, round(1 / active_share))
+    conn = sqlite3.connect(path)
+    conn.execute(
+        """
+        WITH RECURSIVE ids(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM ids WHERE n < ?)
+        INSERT INTO users (user_id, daily_attempts_used, last_attempt_date)
+        SELECT n, CASE WHEN n % ? = 0 THEN 7 ELSE 0 END, CASE WHEN n % ? = 0 THEN ? ELSE NULL END
+        FROM ids
+        """,
+        (users, every, every, day),
+    )
+    conn.commit()
+    conn.close()
+
+
+def lazy_reset(sync_db: DB, user_id: int, today: str):
+    """
+    Прежний get_user_with_reset: первое действие за день — чтение, UPDATE и перечитывание.
+    """
+    with sync_db.pool.connection() as conn:
+        row = conn.execute("SELECT * FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        if row["last_attempt_date"] != today:
+            conn.execute(
+                "UPDATE users SET daily_attempts_used = 0, last_attempt_date = ? WHERE user_id = ?",
+                (today, user_id),
+            )
+            conn.execute("SELECT * FROM users WHERE user_id = ?", (user_id,)).fetchone()
+
+
+async def bench_reset(tmp: str, users: int, sample: int) -> dict:
+    clock = GameClock()
+    today = clock.today()
+    yesterday = (datetime.fromisoformat(today) - timedelta(days=1)).date().isoformat()
+
+    lazy_path = os.path.join(tmp, "reset_lazy.db")
+    sync_db = DB(lazy_path, clock=clock)
+    fill_users(lazy_path, users, yesterday)
+
+    # ленивый сброс: меряем на выборке, первое действие каждого за день
+    sample = min(sample, users)
+    step = max(1, users // sample)
+    t0 = time.perf_counter()
+    for user_id in range(1, users + 1, step)[:sample]:
+        lazy_reset(sync_db, user_id, today)
+    lazy_per_user = (time.perf_counter() - t0) / sample
+    sync_db.close()
+
+    # пакетный сброс на отдельной базе с теми же данными
+    batch_path = os.path.join(tmp, "reset_batch.db")
+    sync_db = DB(batch_path, clock=clock)
+    fill_users(batch_path, users, yesterday)
+    adb = AsyncDB(sync_db)
+    job = DailyReset(adb, clock)
+    result = await job.run_once()
+    await adb.close()
+
+    return {
+        "users": users,
+        "sample": sample,
+        "lazy_per_user_us": lazy_per_user * 1e6,
+        "lazy_total_sec": lazy_per_user * users,
+        "batch_sec": result["seconds"],
+        "batch_updated": result["users"],
+        "batches": result["batches"],
+        "max_batch_ms": result["max_batch_ms"],
+    }
+
+
+# ---- записи: пул потоков против одного писателя ----
+
+
+async def bench_writes(path: str, ops: int, concurrency: int, group_commit: bool) -> dict:
+    """
+    ops изменяющих вызовов (игра, баланс, FSM, платёж, новый пользователь)
+    из concurrency задач, параллельно читатель крутит топ.
+    Считает транзакции (commit) в секунду и ошибки "database is locked".
+    """
+    sync_db = DB(path, pool_size=8)
+    adb = AsyncDB(sync_db, max_workers=8, group_commit=group_commit)
+
+    latencies: list[float] = []
+    reads: list[float] = []
+    errors: dict[str, int] = {}
+    counter = itertools.count()
+
+    async def one(i: int):
+        uid = 1 + i % 500
+        kind = ("play", "stars", "fsm", "payment", "new_user")[i % 5]
+        t0 = time.perf_counter()
+        try:
+            if kind == "play":
+                await adb.play_attempt(uid)
+            elif kind == "stars":
+                await adb.add_bot_stars(1)
+            elif kind == "fsm":
+                await adb.fsm_set_data(f"bench:{uid}", {"n": i}, time.time() + 60)
+            elif kind == "payment":
+                await adb.apply_payment(uid, 1, "XTR", "bench", f"bench-{i}")
+            else:
+                await adb.get_user(100_000 + i)
+        except sqlite3.OperationalError as e:
+            errors[str(e)] = errors.get(str(e), 0) + 1
+            return
+        latencies.append((time.perf_counter() - t0) * 1000)
+
+    async def worker():
+        for i in iter(lambda: next(counter), None):
+            if i >= ops:
+                return
+            await one(i)
+
+    finished = asyncio.Event()
+
+    async def reader():
+        while not finished.is_set():
+            t0 = time.perf_counter()
+            await adb.get_top_winners(10)
+            reads.append((time.perf_counter() - t0) * 1000)
+
+    lag: list[float] = []
+    stop = asyncio.Event()
+    probe = asyncio.create_task(loop_lag_probe(stop, lag))
+    read_task = asyncio.create_task(reader())
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - t0
+    finished.set()
+    stop.set()
+    await asyncio.gather(probe, read_task)
+
+    writer = (await adb.pool_stats()).get("writer")
+    await adb.close()
+
+    commits = writer["batches"] if writer else len(latencies)
+    return {
+        "mode": "writer" if group_commit else "pool",
+        "ops": len(latencies),
+        "ops_per_sec": len(latencies) / elapsed if elapsed else 0.0,
+        "commits_per_sec": commits / elapsed if elapsed else 0.0,
+        "avg_batch": writer["avg_batch"] if writer else 1.0,
+        "p50_ms": percentile(latencies, 50),
+        "p99_ms": percentile(latencies, 99),
+        "read_p99_ms": percentile(reads, 99) if reads else 0.0,
+        "loop_lag_max_ms": max(lag) if lag else 0.0,
+        "errors": errors,
+    }
+
+
+# ---- сценарий через хендлеры router ----
+
+# действия одного виртуального пользователя: (вид, апдейты)
+def user_script(user_id: int, promo_code: str, ids) -> list[tuple[str, list[dict]]]:
+    payload = "buy_attempts:10"
+    return [
+        ("start", [synthetic_update(next(ids), user_id, "start")]),
+        ("play", [synthetic_update(next(ids), user_id, "play")]),
+        ("profile", [synthetic_update(next(ids), user_id, "profile")]),
+        ("play", [synthetic_update(next(ids), user_id, "play")]),
+        ("top", [synthetic_update(next(ids), user_id, "top")]),
+        (
+            "buy",
+            [
+                pre_checkout_update(next(ids), user_id, payload, 5),
+                payment_update(next(ids), user_id, payload, 5),
+            ],
+        ),
+        ("promo", [synthetic_update(next(ids), user_id, f"/promo {promo_code}")]),
+        ("play", [synthetic_update(next(ids), user_id, "play")]),
+    ]
+
+
+def latency_summary(values: list[float], elapsed: float) -> dict:
+    return {
+        "count": len(values),
+        "per_sec": len(values) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(values, 50),
+        "p95_ms": percentile(values, 95),
+        "p99_ms": percentile(values, 99),
+    }
+
+
+async def bench_handlers(path: str, users: int, concurrency: int, auditor: QueryAuditor | None = None) -> dict:
+    """
+    users виртуальных пользователей, каждый проходит user_script; апдейты
+    идут прямо в dp.feed_update, Telegram подменён FakeSession.
+    С auditor все SQL прогона проходят через аудит планов (только sqlite).
+    """
+    from aiogram.types import Update
+
+    bot_module = load_bot(path)
+    if auditor is not None and hasattr(bot_module.db, "audit"):
+        bot_module.db.audit(auditor)
+    session = FakeSession()
+    bot = Bot("42:BENCH", session=session)
+    dp = bot_module.build_dispatcher()
+    # счётчик — до старта: соединение писателя создаётся при первой записи
+    sync_db = getattr(bot_module.db, "sync", None)
+    queries = count_queries(sync_db) if sync_db is not None else None  # только sqlite
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+
+    codes = await bot_module.promos.generate(users, 1, 1, "BENCH")
+    startup_queries = queries[0] if queries is not None else 0
+
+    ids = itertools.count(1)
+    scripts = [user_script(1000 + i, codes[i], ids) for i in range(users)]
+    latencies: dict[str, list[float]] = {}
+    updates = 0
+    sem = asyncio.Semaphore(concurrency)
+
+    async def run_user(script):
+        nonlocal updates
+        async with sem:
+            for kind, raw_updates in script:
+                t0 = time.perf_counter()
+                for raw in raw_updates:
+                    await dp.feed_update(bot, Update.model_validate(raw, context={"bot": bot}))
+                    updates += 1
+                latencies.setdefault(kind, []).append((time.perf_counter() - t0) * 1000)
+
+    lag: list[float] = []
+    stop = asyncio.Event()
+    probe = asyncio.create_task(loop_lag_probe(stop, lag))
+    t0 = time.perf_counter()
+    await asyncio.gather(*(run_user(script) for script in scripts))
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    await probe
+    throttled = bot_module.play_throttle.stats()["throttled"]
+
+    # всплеск play от одного игрока: отсечённые антиспамом нажатия не должны
+    # доходить до базы (в том числе за состоянием FSM)
+    burst_user = 1000
+    throttled_queries = None
+    for _ in range(bot_module.PLAY_THROTTLE_BURST + 1):
+        await dp.feed_update(bot, Update.model_validate(synthetic_update(next(ids), burst_user, "play"), context={"bot": bot}))
+    if queries is not None:
+        before, throttled_before = queries[0], bot_module.play_throttle.stats()["throttled"]
+        for _ in range(10):
+            await dp.feed_update(bot, Update.model_validate(synthetic_update(next(ids), burst_user, "play"), context={"bot": bot}))
+        if bot_module.play_throttle.stats()["throttled"] - throttled_before == 10:
+            throttled_queries = queries[0] - before
+    await dp.emit_shutdown(bot=bot, dispatcher=dp)
+
+    actions = [value for values in latencies.values() for value in values]
+    return {
+        "meta": {
+            "users": users,
+            "concurrency": concurrency,
+            "backend": type(bot_module.db).__name__,
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+        },
+        "total": {
+            **latency_summary(actions, elapsed),
+            "updates": updates,
+            "updates_per_sec": updates / elapsed if elapsed else 0.0,
+            "seconds": elapsed,
+            "loop_lag_mean_ms": statistics.fmean(lag) if lag else 0.0,
+            "loop_lag_max_ms": max(lag) if lag else 0.0,
+            "queries_per_update": (queries[0] - startup_queries) / updates if queries is not None and updates else None,
+            "api_calls_per_update": sum(session.calls.values()) / updates if updates else 0.0,
+            "play_throttled": throttled,
+            "throttled_play_queries": throttled_queries,
+        },
+        "actions": {kind: latency_summary(values, elapsed) for kind, values in sorted(latencies.items())},
+    }
+
+
+# чем больше — тем хуже; per_sec наоборот
+REGRESSION_METRICS = ["p50_ms", "p95_ms", "p99_ms", "loop_lag_max_ms", "queries_per_update"]
+
+
+def compare_results(current: dict, baseline: dict, threshold: float) -> list[str]:
+    """
+    Метрики, которые ухудшились больше чем на threshold (0.2 — на 20%).
+    """
+    regressions = []
+    sections = [("total", current["total"], baseline.get("total", {}))]
+    sections += [
+        (kind, values, baseline.get("actions", {}).get(kind, {})) for kind, values in current["actions"].items()
+    ]
+    for name, now, before in sections:
+        for metric in REGRESSION_METRICS + ["per_sec"]:
+            new, old = now.get(metric), before.get(metric)
+            if not new or not old:
+                continue
+            change = (old - new) / old if metric == "per_sec" else (new - old) / old
+            if change > threshold:
+                regressions.append(f"{name}.{metric}: {old:.2f} -> {new:.2f} ({change:+.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--clicks", type=int, default=10)
+    parser.add_argument("--lock-ms", type=int, default=0, help="держать write-lock N мс (имитация медленного диска)")
+    parser.add_argument("--dice", type=int, default=0, help="N одновременных оплат кубика")
+    parser.add_argument("--webhook", type=int, default=0, help="N синтетических апдейтов через webhook")
+    parser.add_argument("--concurrency", type=int, default=50, help="одновременных запросов к webhook")
+    parser.add_argument("--migrate", type=int, default=0, help="N платежей в старой базе для миграции")
+    parser.add_argument("--reset", type=int, default=0, help="N пользователей для сравнения сброса попыток")
+    parser.add_argument("--reset-sample", type=int, default=20000, help="выборка для ленивого сброса")
+    parser.add_argument("--writes", type=int, default=0, help="N изменяющих вызовов: пул потоков против одного писателя")
+    parser.add_argument("--handlers", type=int, default=0, help="N виртуальных пользователей через хендлеры бота")
+    parser.add_argument("--json", help="сохранить результат --handlers в JSON")
+    parser.add_argument("--baseline", help="JSON прошлого прогона --handlers для сравнения")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="допустимое ухудшение метрики (0.2 = 20%%)")
+    parser.add_argument("--audit", help="сохранить планы SQL прогона --handlers в JSON")
+    parser.add_argument("--audit-baseline", help="JSON прошлого аудита: новые сканы — ошибка")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ("sync", "async"):
+            path = os.path.join(tmp, f"{mode}.db")
+            res = asyncio.run(run(mode, path, args.users, args.clicks, args.lock_ms))
+            print(
+                f"{res['mode']:>5}: {res['plays']} игр, {res['plays_per_sec']:.0f}/с, "
+                f"p50 {res['play_p50_ms']:.2f} мс, p99 {res['play_p99_ms']:.2f} мс, "
+                f"лаг event loop: средний {res['loop_lag_mean_ms']:.2f} мс, "
+                f"макс {res['loop_lag_max_ms']:.2f} мс, "
+                f"ожидание соединения: среднее {res['pool_wait_avg_ms']:.2f} мс, "
+                f"макс {res['pool_wait_max_ms']:.2f} мс"
+            )
+
+        if args.dice:
+            res = asyncio.run(bench_dice(os.path.join(tmp, "dice.db"), args.dice))
+            print(
+                f"dice: {res['rolls']} оплат, хендлер p50 {res['handler_p50_ms']:.2f} мс, "
+                f"p99 {res['handler_p99_ms']:.2f} мс, все результаты за {res['total_sec']:.2f} с "
+                f"({res['results_per_sec']:.0f}/с, из них {res['delay_sec']} с — анимация кубика)"
+            )
+
+        if args.webhook:
+            res = asyncio.run(bench_webhook(os.path.join(tmp, "webhook.db"), args.webhook, args.concurrency))
+            print(
+                f"webhook: {res['updates']} апдейтов, {res['updates_per_sec']:.0f}/с, "
+                f"p50 {res['p50_ms']:.2f} мс, p99 {res['p99_ms']:.2f} мс, "
+                f"вызовов API: {res['api_calls']}"
+            )
+
+        if args.migrate:
+            res = bench_migrate(os.path.join(tmp, "legacy.db"), args.migrate)
+            print(
+                f"migrate: {res['payments']} платежей, {res['migrations']} миграций за {res['total_sec']:.2f} с, "
+                f"заполнение сумм: {res['batches']} пачек, самая долгая {res['max_batch_ms']:.1f} мс, "
+                f"параллельная запись ждала до {res['writer_max_wait_ms']:.1f} мс"
+            )
+
+        if args.reset:
+            res = asyncio.run(bench_reset(tmp, args.reset, args.reset_sample))
+            print(
+                f"reset: {res['users']} пользователей; ленивый: {res['lazy_per_user_us']:.0f} мкс на первое действие "
+                f"(выборка {res['sample']}), на всех ~{res['lazy_total_sec']:.1f} с записи в горячем пути; "
+                f"пакетный: {res['batch_sec']:.2f} с, обнулено {res['batch_updated']}, {res['batches']} пачек, "
+                f"самая долгая {res['max_batch_ms']:.1f} мс"
+            )
+
+        if args.writes:
+            for group_commit in (False, True):
+                path = os.path.join(tmp, f"writes_{int(group_commit)}.db")
+                res = asyncio.run(bench_writes(path, args.writes, args.concurrency, group_commit))
+                errors = sum(res["errors"].values())
+                print(
+                    f"writes {res['mode']:>6}: {res['ops']} вызовов, {res['ops_per_sec']:.0f}/с, "
+                    f"commit {res['commits_per_sec']:.0f}/с (в среднем {res['avg_batch']:.1f} вызова на commit), "
+                    f"p50 {res['p50_ms']:.2f} мс, p99 {res['p99_ms']:.2f} мс, чтение p99 {res['read_p99_ms']:.2f} мс, "
+                    f"лаг event loop макс {res['loop_lag_max_ms']:.2f} мс, ошибок {errors}"
+                    + (f" {res['errors']}" if errors else "")
+                )
+
+        if args.handlers:
+            auditor = QueryAuditor() if args.audit or args.audit_baseline else None
+            res = asyncio.run(
+                bench_handlers(os.path.join(tmp, "handlers.db"), args.handlers, args.concurrency, auditor)
+            )
+            total = res["total"]
+            queries = total["queries_per_update"]
+            print(
+                f"handlers: {res['meta']['users']} пользователей, {total['updates']} апдейтов "
+                f"за {total['seconds']:.2f} с ({total['updates_per_sec']:.0f}/с), "
+                f"лаг event loop: средний {total['loop_lag_mean_ms']:.2f} мс, макс {total['loop_lag_max_ms']:.2f} мс, "
+                f"SQL на апдейт: {'—' if queries is None else f'{queries:.2f}'}, "
+                f"вызовов API на апдейт: {total['api_calls_per_update']:.2f}, "
+                f"play отсечено антиспамом: {total['play_throttled']}, "
+                f"SQL на 10 отсечённых play: {'—' if total['throttled_play_queries'] is None else total['throttled_play_queries']}"
+            )
+            for kind, summary in res["actions"].items():
+                print(
+                    f"  {kind:>8}: {summary['count']} раз, p50 {summary['p50_ms']:.2f} мс, "
+                    f"p95 {summary['p95_ms']:.2f} мс, p99 {summary['p99_ms']:.2f} мс"
+                )
+
+            if total["throttled_play_queries"]:
+                # бюджет, а не регрессия: отсечённое нажатие обязано стоить 0 SQL
+                print("Отсечённые антиспамом play ходят в базу (кэш FSM выключен?)")
+                raise SystemExit(1)
+
+            if args.json:
+                with open(args.json, "w", encoding="utf-8") as f:
+                    json.dump(res, f, ensure_ascii=False, indent=2)
+            if args.baseline:
+                with open(args.baseline, encoding="utf-8") as f:
+                    regressions = compare_results(res, json.load(f), args.max_regression)
+                if regressions:
+                    print("Регрессии относительно " + args.baseline + ":\n  " + "\n  ".join(regressions))
+                    raise SystemExit(1)
+                print(f"Регрессий относительно {args.baseline} нет")
+
+            if auditor is not None:
+                report = auditor.save(args.audit) if args.audit else auditor.report()
+                print(format_report(report))
+                if args.audit_baseline:
+                    with open(args.audit_baseline, encoding="utf-8") as f:
+                        problems = compare_reports(report, json.load(f))
+                    if problems:
+                        print("Новые сканы относительно " + args.audit_baseline + ":\n  " + "\n  ".join(problems))
+                        raise SystemExit(1)
+                    print(f"Новых сканов относительно {args.audit_baseline} нет")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+import asyncio
+import logging
+import time
+import uuid
+from typing import Callable
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramAPIError,
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramRetryAfter,
+)
+
+
+# ================== РАССЫЛКА ==================
+
+
+class TokenBucket:
+    """
+    Ограничитель скорости: не больше rate событий в секунду,
+    всплеск — до capacity. pause() останавливает выдачу на время RetryAfter.
+    """
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class Broadcaster:
+    """
+    Рассылка сообщения всем пользователям.
+
+    user_id читаются из базы пачками по первичному ключу, сообщения идут
+    через TokenBucket (глобальный лимит Telegram ~30 сообщений/с; каждому
+    чату шлём одно сообщение, так что лимит на чат не достигается).
+    На RetryAfter вся рассылка замирает на указанное время, и сообщение
+    отправляется заново. Забаненные пропускаются.
+
+    После каждой пачки прогресс сохраняется в таблицу broadcasts, поэтому
+    resume() после рестарта продолжает с последнего чекпоинта (пачку,
+    прерванную на середине, получат повторно — не больше page_size сообщений).
+    Админу раз в progress_interval секунд обновляется сообщение с прогрессом.
+
+    Рассылку ведёт один процесс: он арендует её (owner, lease_until) и
+    продлевает аренду на каждом чекпоинте. watch() раз в watch_interval
+    подбирает ничьи рассылки и рассылки упавших процессов. lease должен
+    быть заметно больше времени на одну пачку.
+    """
+
+    def __init__(
+        self,
+        db,
+        is_banned: Callable[[int], bool],
+        rate: float = 25,
+        page_size: int = 100,
+        concurrency: int = 10,
+        progress_interval: float = 5.0,
+        max_retries: int = 5,
+        lease: float = 120.0,
+        watch_interval: float = 30.0,
+    ):
+        self.db = db
+        self.is_banned = is_banned
+        self.bucket = TokenBucket(rate)
+        self.page_size = page_size
+        self.concurrency = concurrency
+        self.progress_interval = progress_interval
+        self.max_retries = max_retries
+        self.lease = lease
+        self.watch_interval = watch_interval
+        self.owner = uuid.uuid4().hex
+
+        self._tasks: dict[int, asyncio.Task] = {}
+        self._live: dict[int, dict] = {}
+        self._watcher: asyncio.Task | None = None
+
+        self.retry_after_hits = 0
+        self.failures = 0
+
+    # ---- запуск / остановка ----
+
+    async def start(self, bot: Bot, admin_chat_id: int, text: str) -> dict:
+        broadcast = await self.db.create_broadcast(admin_chat_id, text, self.owner, time.time() + self.lease)
+        self._spawn(bot, broadcast)
+        return broadcast
+
+    async def resume(self, bot: Bot):
+        """
+        Продолжает рассылки, прерванные рестартом или брошенные другим
+        процессом. Чужую рассылку с живой арендой не трогает.
+        """
+        for broadcast in await self.db.get_broadcasts("running"):
+            if broadcast["id"] in self._tasks:
+                continue
+            if not await self.db.claim_broadcast(broadcast["id"], self.owner, time.time(), self.lease):
+                continue
+            logging.info("Продолжаем рассылку %s с user_id > %s", broadcast["id"], broadcast["last_user_id"])
+            self._spawn(bot, broadcast)
+
+    def watch(self, bot: Bot):
+        """
+        resume() сейчас и дальше раз в watch_interval секунд.
+        """
+        if self._watcher is None:
+            self._watcher = asyncio.create_task(self._watch(bot))
+
+    async def _watch(self, bot: Bot):
+        while True:
+            try:
+                await self.resume(bot)
+            except Exception:
+                logging.exception("Рассылки: не удалось проверить брошенные рассылки")
+            await asyncio.sleep(self.watch_interval)
+
+    async def cancel(self, broadcast_id: int) -> bool:
+        if not await self.db.set_broadcast_status(broadcast_id, "cancelled"):
+            return False
+        task = self._tasks.get(broadcast_id)
+        if task is not None:
+            task.cancel()
+        return True
+
+    async def stop(self):
+        """
+        Останавливает рассылки при выключении. Статус остаётся running,
+        аренда отпускается — рассылки продолжатся с последнего чекпоинта
+        в этом или другом процессе.
+        """
+        if self._watcher is not None:
+            self._watcher.cancel()
+            await asyncio.gather(self._watcher, return_exceptions=True)
+            self._watcher = None
+
+        broadcast_ids = list(self._tasks)
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        for broadcast_id in broadcast_ids:
+            try:
+                await self.db.release_broadcast(broadcast_id, self.owner)
+            except Exception:
+                logging.exception("Рассылки: не удалось отпустить рассылку %s", broadcast_id)
+
+    def _spawn(self, bot: Bot, broadcast: dict):
+        task = asyncio.create_task(self._run(bot, broadcast))
+        self._tasks[broadcast["id"]] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast["id"], None))
+
+    # ---- отправка ----
+
+    async def _send(self, bot: Bot, user_id: int, text: str, counters: dict):
+        if self.is_banned(user_id):
+            counters["skipped"] += 1
+            return
+
+        for _ in range(self.max_retries):
+            await self.bucket.acquire()
+            try:
+                await bot.send_message(user_id, text)
+                counters["sent"] += 1
+                return
+            except TelegramRetryAfter as e:
+                self.retry_after_hits += 1
+                logging.warning("Рассылка: RetryAfter %s с", e.retry_after)
+                self.bucket.pause(e.retry_after)
+            except (TelegramForbiddenError, TelegramBadRequest):
+                # бот заблокирован, чат удалён и т.п. — повтор не поможет
+                counters["blocked"] += 1
+                return
+            except TelegramAPIError as e:
+                logging.warning("Рассылка: не удалось отправить %s: %s", user_id, e)
+                counters["failed"] += 1
+                return
+        counters["failed"] += 1
+
+    async def _run(self, bot: Bot, broadcast: dict):
+        broadcast_id = broadcast["id"]
+        counters = {key: broadcast[key] for key in ("sent", "blocked", "failed", "skipped")}
+        last_user_id = broadcast["last_user_id"]
+        started = time.monotonic()
+        done_at_start = sum(counters.values())
+        self._live[broadcast_id] = {
+            "total": broadcast["total"],
+            "counters": counters,
+            "started": started,
+            "done_at_start": done_at_start,
+        }
+        progress_message = None
+        sem = asyncio.Semaphore(self.concurrency)
+
+        async def send_one(user_id: int):
+            async with sem:
+                await self._send(bot, user_id, broadcast["text"], counters)
+
+        async def report_progress():
+            nonlocal progress_message
+            while True:
+                await asyncio.sleep(self.progress_interval)
+                progress_message = await self._report(bot, broadcast, progress_message)
+
+        reporter = None
+        try:
+            progress_message = await self._report(bot, broadcast, None)
+            reporter = asyncio.create_task(report_progress())
+            while True:
+                user_ids = await self.db.get_user_ids_after(last_user_id, self.page_size)
+                if not user_ids:
+                    break
+
+                await asyncio.gather(*(send_one(user_id) for user_id in user_ids))
+                last_user_id = user_ids[-1]
+                if not await self._checkpoint(broadcast_id, last_user_id, counters):
+                    logging.warning("Рассылка %s отменена или перешла к другому процессу", broadcast_id)
+                    return
+
+            reporter.cancel()
+            if await self._checkpoint(broadcast_id, last_user_id, counters, status="done"):
+                await self._report(bot, broadcast, progress_message, finished=True)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logging.exception("Рассылка %s упала на user_id > %s", broadcast_id, last_user_id)
+            self.failures += 1
+            if reporter is not None:
+                reporter.cancel()
+            # иначе рассылка навсегда осталась бы running и её снова и снова
+            # подбирал бы watch(); админ увидит причину в логах и запустит заново
+            try:
+                if await self._checkpoint(broadcast_id, last_user_id, counters, status="failed"):
+                    await self._report(bot, broadcast, progress_message, failed=True)
+            except Exception:
+                logging.exception("Рассылка %s: не удалось отметить ошибку", broadcast_id)
+        finally:
+            if reporter is not None:
+                reporter.cancel()
+            self._live.pop(broadcast_id, None)
+
+    async def _checkpoint(self, broadcast_id: int, last_user_id: int, counters: dict, status: str | None = None) -> bool:
+        return await self.db.save_broadcast_progress(
+            broadcast_id,
+            last_user_id,
+            counters,
+            status=status,
+            owner=self.owner,
+            lease_until=time.time() + self.lease,
+        )
+
+    # ---- прогресс ----
+
+    def _progress_text(self, broadcast: dict, finished: bool = False, failed: bool = False) -> str:
+        live = self._live[broadcast["id"]]
+        counters = live["counters"]
+        processed = sum(counters.values())
+        elapsed = time.monotonic() - live["started"]
+        speed = (processed - live["done_at_start"]) / elapsed if elapsed > 0 else 0.0
+        title = "✅ Рассылка завершена" if finished else "📣 Рассылка идёт"
+        if failed:
+            title = "❌ Рассылка остановлена из-за ошибки"
+        return (
+            f"{title} (#{broadcast['id']})\n"
+            f"• Обработано: {processed} из ~{live['total']}\n"
+            f"• Доставлено: {counters['sent']}\n"
+            f"• Недоступны (блок / удалён чат): {counters['blocked']}\n"
+            f"• Ошибок: {counters['failed']}\n"
+            f"• Пропущено (бан): {counters['skipped']}\n"
+            f"• Скорость: {speed:.1f} сообщ./с"
+        )
+
+    async def _report(self, bot: Bot, broadcast: dict, message, finished: bool = False, failed: bool = False):
+        text = self._progress_text(broadcast, finished, failed)
+        try:
+            if message is None:
+                return await bot.send_message(broadcast["admin_chat_id"], text)
+            await bot.edit_message_text(text, chat_id=message.chat.id, message_id=message.message_id)
+        except TelegramBadRequest as e:
+            if "not modified" not in str(e):
+                logging.warning("Рассылка: не удалось обновить прогресс: %s", e)
+        except TelegramAPIError as e:
+            logging.warning("Рассылка: не удалось обновить прогресс: %s", e)
+        return message
+
+    def stats(self) -> dict:
+        return {
+            "running": len(self._tasks),
+            "retry_after": self.retry_after_hits,
+            "failures": self.failures,
+            "broadcasts": {
+                broadcast_id: dict(live["counters"], total=live["total"])
+                for broadcast_id, live in self._live.items()
+            },
+        }
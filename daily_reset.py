@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+
+# ================== ИГРОВЫЕ СУТКИ ==================
+
+
+class GameClock:
+    """
+    Игровые сутки: начинаются в hour:00 по часовому поясу tz
+    (None — локальное время сервера). today() — дата текущих суток,
+    её пишут в last_attempt_date.
+    """
+
+    def __init__(self, tz: str | None = None, hour: int = 0):
+        self.tz = ZoneInfo(tz) if tz else None
+        self.hour = hour
+
+    def today(self) -> str:
+        return (datetime.now(self.tz) - timedelta(hours=self.hour)).date().isoformat()
+
+    def next_reset(self, now: float | None = None) -> float:
+        """
+        Unix-время начала следующих суток.
+        """
+        local = datetime.fromtimestamp(time.time() if now is None else now, self.tz)
+        boundary = local.replace(hour=self.hour, minute=0, second=0, microsecond=0)
+        if boundary <= local:
+            boundary += timedelta(days=1)
+        return boundary.timestamp()
+
+
+# ================== СБРОС БЕСПЛАТНЫХ ПОПЫТОК ==================
+
+
+class DailyReset:
+    """
+    Сброс бесплатных попыток всем пользователям в начале игровых суток.
+
+    Идёт пачками по batch_size пользователей (по первичному ключу), каждая
+    пачка — отдельная короткая транзакция; курсор хранится в daily_resets.
+    Сутки забирает один процесс. Если сброс прервался, его можно забрать
+    заново через lease секунд без прогресса — он продолжится с курсора
+    (повторная попытка после ошибки или старт любого процесса).
+    При старте догоняет пропущенный сброс.
+
+    play_attempt по-прежнему сверяет дату сам, так что между границей суток
+    и концом сброса игроки уже играют с новыми попытками.
+    """
+
+    def __init__(self, db, clock: GameClock, batch_size: int = 5000, lease: float = 600):
+        self.db = db
+        self.clock = clock
+        self.batch_size = batch_size
+        self.lease = lease
+
+        self._task: asyncio.Task | None = None
+
+        self.runs = 0
+        self.last: dict = {}
+
+    async def run_once(self) -> dict | None:
+        """
+        Сбрасывает попытки за текущие сутки. None — сброс уже сделан или идёт в другом процессе.
+        """
+        day = self.clock.today()
+        cursor = await self.db.claim_daily_reset(day, time.time(), self.lease)
+        if cursor is None:
+            return None
+
+        started = time.perf_counter()
+        batches = 0
+        users = 0
+        max_batch = 0.0
+        while cursor is not None:
+            batch_started = time.perf_counter()
+            cursor, updated = await self.db.reset_daily_attempts_batch(day, cursor, self.batch_size)
+            max_batch = max(max_batch, time.perf_counter() - batch_started)
+            batches += 1
+            users += updated
+
+        self.runs += 1
+        self.last = {
+            "day": day,
+            "users": users,
+            "batches": batches,
+            "seconds": time.perf_counter() - started,
+            "max_batch_ms": max_batch * 1000,
+        }
+        logging.info("Сброс попыток за %s: %s", day, self.last)
+        return self.last
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+                # небольшой запас, чтобы today() уже показывал новые сутки
+                delay = max(0.0, self.clock.next_reset() - time.time()) + 1
+            except Exception:
+                logging.exception("Не удалось сбросить бесплатные попытки")
+                delay = self.lease + 1  # своя аренда истечёт — продолжим с курсора
+            await asyncio.sleep(delay)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> dict:
+        return {"runs": self.runs, **self.last}
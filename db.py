@@ -0,0 +1,1581 @@
+import asyncio
+import functools
+import json
+import logging
+import queue
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+
+from daily_reset import GameClock
+from metrics import update_stats
+from migrations import migrate, schema_version
+from query_audit import AuditedConnection, QueryAuditor
+
+
+# ================== ПУЛ СОЕДИНЕНИЙ ==================
+
+
+class ConnectionPool:
+    """
+    Пул долгоживущих sqlite-соединений.
+
+    Соединение настраивается один раз при создании (WAL, synchronous=NORMAL,
+    busy_timeout, кэш подготовленных запросов) и дальше переиспользуется,
+    вместо connect/close на каждый метод DB.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        size: int = 4,
+        busy_timeout_ms: int = 5000,
+        cached_statements: int = 256,
+    ):
+        self.path = path
+        self.size = size
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cached_statements = cached_statements
+
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+
+        # метрики
+        self._acquired = 0
+        self._waited = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+        # SQL, выполненные текущим потоком внутри trace() (только после enable_trace)
+        self._tracing = False
+        self._trace_local = threading.local()
+
+        # аудит планов запросов (только после enable_audit)
+        self._auditor: QueryAuditor | None = None
+
+        # общая транзакция писателя в его потоке (см. batch)
+        self._batch_local = threading.local()
+
+    def _new_connection(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout_ms / 1000,
+            check_same_thread=False,  # соединение ходит между потоками пула
+            cached_statements=self.cached_statements,
+            factory=AuditedConnection if self._auditor is not None else sqlite3.Connection,
+        )
+        if self._auditor is not None:
+            conn.auditor = self._auditor
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        if self._tracing:
+            conn.set_trace_callback(self._on_statement)
+        return conn
+
+    # ---- трассировка SQL ----
+
+    def _on_statement(self, sql: str):
+        statements = getattr(self._trace_local, "statements", None)
+        if statements is not None:
+            statements.append(sql)
+
+    def enable_trace(self):
+        """
+        Подключает trace-callback ко всем соединениям пула.
+        Пока не вызван, запросы ничем не замедляются.
+        """
+        with self._lock:
+            self._tracing = True
+            idle = list(self._idle.queue)
+        for conn in idle:
+            conn.set_trace_callback(self._on_statement)
+
+    def enable_audit(self, auditor: QueryAuditor):
+        """
+        Пропускает все запросы пула через auditor. Свободные соединения
+        закрываются и пересоздаются уже с аудитом — включать при старте.
+        """
+        self._auditor = auditor
+        self.close()
+
+    @contextmanager
+    def trace(self):
+        """
+        Собирает SQL, выполненные этим потоком внутри блока.
+        """
+        statements: list[str] = []
+        self._trace_local.statements = statements
+        try:
+            yield statements
+        finally:
+            self._trace_local.statements = None
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_create = self._created < self.size
+            if can_create:
+                self._created += 1
+        if can_create:
+            try:
+                return self._new_connection()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        # все соединения заняты — ждём свободное
+        return self._idle.get()
+
+    @contextmanager
+    def connection(self, immediate: bool = False):
+        """
+        Выдаёт соединение из пула.
+        При выходе без ошибки делает commit, при исключении — rollback.
+        immediate — сразу взять блокировку записи (BEGIN IMMEDIATE).
+        Внутри batch() выдаёт соединение пачки, а блок становится SAVEPOINT.
+        """
+        batch_conn = getattr(self._batch_local, "conn", None)
+        if batch_conn is not None:
+            with self._savepoint(batch_conn):
+                yield batch_conn
+            return
+
+        start = time.perf_counter()
+        conn = self._acquire()
+        waited = time.perf_counter() - start
+
+        with self._lock:
+            self._in_use += 1
+            self._acquired += 1
+            self._wait_total += waited
+            if waited > 0.001:
+                self._waited += 1
+            self._wait_max = max(self._wait_max, waited)
+
+        try:
+            if immediate:
+                conn.execute("BEGIN IMMEDIATE")
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._idle.put(conn)
+
+    @contextmanager
+    def batch(self, conn: sqlite3.Connection):
+        """
+        Одна транзакция на несколько команд: внутри блока connection() в этом
+        потоке выдаёт conn, и каждая команда коммитится вместе со всей пачкой.
+        """
+        conn.execute("BEGIN IMMEDIATE")
+        self._batch_local.conn = conn
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self._batch_local.conn = None
+
+    def rollback(self, conn: sqlite3.Connection):
+        """
+        Откатывает изменения текущего блока connection(): внутри пачки
+        писателя — только до его SAVEPOINT, иначе всю транзакцию.
+        """
+        if getattr(self._batch_local, "conn", None) is conn:
+            conn.execute("ROLLBACK TO command")
+        else:
+            conn.rollback()
+
+    @staticmethod
+    @contextmanager
+    def _savepoint(conn: sqlite3.Connection):
+        # ошибка команды откатывает только её изменения, пачка продолжается
+        conn.execute("SAVEPOINT command")
+        try:
+            yield
+        except BaseException:
+            conn.execute("ROLLBACK TO command")
+            conn.execute("RELEASE command")
+            raise
+        conn.execute("RELEASE command")
+
+    def stats(self) -> dict:
+        with self._lock:
+            acquired = self._acquired
+            return {
+                "size": self.size,
+                "created": self._created,
+                "in_use": self._in_use,
+                "idle": self._idle.qsize(),
+                "acquired": acquired,
+                "waited": self._waited,
+                "wait_avg_ms": self._wait_total / acquired * 1000 if acquired else 0.0,
+                "wait_max_ms": self._wait_max * 1000,
+            }
+
+    def close(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+
+# ================== БАЗА ДАННЫХ ==================
+
+# Одна попытка игры целиком на стороне sqlite:
+# - новый пользователь создаётся сразу с потраченной бесплатной попыткой;
+# - если дата сменилась, бесплатные попытки сбрасываются и тратится первая из них;
+# - иначе тратится бесплатная, а если их нет — купленная;
+# - если попыток нет совсем, WHERE не пропускает UPDATE и RETURNING пустой.
+# Все выражения в SET видят старые значения строки.
+PLAY_ATTEMPT_SQL = """
+INSERT INTO users (user_id, total_wins, wins_for_gift, daily_attempts_used, last_attempt_date, purchased_attempts)
+VALUES (:user_id, :win, :win, 1, :today, 0)
+ON CONFLICT(user_id) DO UPDATE SET
+    daily_attempts_used = CASE
+        WHEN last_attempt_date IS NOT :today THEN 1
+        WHEN daily_attempts_used < :daily THEN daily_attempts_used + 1
+        ELSE daily_attempts_used
+    END,
+    purchased_attempts = CASE
+        WHEN last_attempt_date IS NOT :today OR daily_attempts_used < :daily THEN purchased_attempts
+        ELSE purchased_attempts - 1
+    END,
+    last_attempt_date = :today,
+    total_wins = total_wins + :win,
+    wins_for_gift = wins_for_gift + :win
+WHERE last_attempt_date IS NOT :today
+   OR daily_attempts_used < :daily
+   OR purchased_attempts > 0
+RETURNING *
+"""
+
+
+
+class DB:
+    """
+    Синхронное хранилище на sqlite3.
+    Напрямую из хендлеров не вызывается — только через AsyncDB.
+    """
+
+    # методы, которые пишут в базу: AsyncDB отправляет их единственному писателю.
+    # Новый изменяющий метод нужно добавить сюда, иначе он будет писать из пула читателей
+    WRITES = frozenset(
+        {
+            "create_user",
+            "update_user_fields",
+            "add_bot_stars",
+            "apply_payment",
+            "play_attempt",
+            "apply_gift_redeem",
+            "set_attempts_left",
+            "add_purchased_attempts",
+            "claim_daily_reset",
+            "reset_daily_attempts_batch",
+            "ban_user",
+            "unban_user",
+            "reserve_withdrawal",
+            "mark_withdrawal_sending",
+            "commit_withdrawal",
+            "rollback_withdrawal",
+            "recover_withdrawals",
+            "create_broadcast",
+            "claim_broadcast",
+            "release_broadcast",
+            "save_broadcast_progress",
+            "set_broadcast_status",
+            "set_media_file_id",
+            "delete_media_file_id",
+            "schedule_task",
+            "claim_due_tasks",
+            "complete_task",
+            "fail_task",
+            "fsm_set_state",
+            "fsm_set_data",
+            "fsm_purge",
+            "create_promo",
+            "create_promos_batch",
+            "import_promos_batch",
+            "redeem_promo",
+        }
+    )
+
+    def __init__(
+        self,
+        path: str,
+        daily_attempts: int = 15,
+        win_chance: float = 0.27,
+        pool_size: int = 4,
+        clock: GameClock | None = None,
+    ):
+        self.path = path
+        self.daily_attempts = daily_attempts
+        self.win_chance = win_chance
+        self.clock = clock or GameClock()
+        self.pool = ConnectionPool(path, size=pool_size)
+        self._banned: set[int] = set()
+        self._bans_version = 0
+        self._ban_hits = 0
+        self._ban_misses = 0
+        self._ban_reloads = 0
+        self._init_db()
+        self._load_bans()
+
+    def _init_db(self):
+        """
+        Схема ведётся миграциями (migrations.py): каждая применяется один раз.
+        """
+        migrate(self.pool)
+
+    def get_schema_version(self) -> int:
+        return schema_version(self.pool)
+
+    # ---- служебные методы ----
+
+    def _get_or_create_user_raw(self, conn: sqlite3.Connection, user_id: int) -> sqlite3.Row:
+        cur = conn.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
+        row = cur.fetchone()
+        if row is None:
+            conn.execute(
+                "INSERT OR IGNORE INTO users(user_id, last_attempt_date, purchased_attempts) VALUES (?, NULL, 0)",
+                (user_id,),
+            )
+            cur = conn.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
+            row = cur.fetchone()
+        return row
+
+    def get_user(self, user_id: int) -> dict:
+        """
+        Пользователь как есть. Если last_attempt_date не сегодня,
+        бесплатные попытки уже доступны целиком, даже если сброс до строки не дошёл.
+        """
+        return self.find_user(user_id) or self.create_user(user_id)
+
+    def find_user(self, user_id: int) -> dict | None:
+        with self.pool.connection() as conn:
+            row = conn.execute("SELECT * FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def create_user(self, user_id: int) -> dict:
+        with self.pool.connection() as conn:
+            return dict(self._get_or_create_user_raw(conn, user_id))
+
+    def update_user_fields(self, user_id: int, **fields):
+        if not fields:
+            return
+        with self.pool.connection() as conn:
+            columns = ", ".join(f"{k} = ?" for k in fields.keys())
+            values = list(fields.values()) + [user_id]
+            conn.execute(f"UPDATE users SET {columns} WHERE user_id = ?", values)
+
+    # ---- баланс бота ----
+
+    def get_bot_stars(self) -> int:
+        with self.pool.connection() as conn:
+            cur = conn.execute("SELECT stars FROM bot_balance WHERE id = 1")
+            row = cur.fetchone()
+        return row["stars"]
+
+    def add_bot_stars(self, amount: int):
+        with self.pool.connection() as conn:
+            conn.execute(
+                "UPDATE bot_balance SET stars = stars + ? WHERE id = 1",
+                (amount,),
+            )
+
+    def _insert_payment(
+        self,
+        conn: sqlite3.Connection,
+        user_id: int,
+        total_amount: int,
+        currency: str,
+        payload: str,
+        charge_id: str | None,
+    ) -> bool:
+        """
+        Пишет платёж и обновляет суммы за день.
+        False — платёж с таким charge_id уже есть (повторная доставка).
+        """
+        created_at = datetime.utcnow().isoformat()
+        cur = conn.execute(
+            """
+            INSERT OR IGNORE INTO payments (user_id, total_amount, currency, payload, created_at, charge_id)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (user_id, total_amount, currency, payload, created_at, charge_id),
+        )
+        if cur.rowcount == 0:
+            return False
+        conn.execute(
+            """
+            INSERT INTO payment_daily (day, payload, currency, payments_count, total_amount)
+            VALUES (?, ?, ?, 1, ?)
+            ON CONFLICT(day, payload, currency) DO UPDATE SET
+                payments_count = payments_count + 1,
+                total_amount = total_amount + excluded.total_amount
+            """,
+            (created_at[:10], payload, currency, total_amount),
+        )
+        return True
+
+    def apply_payment(
+        self,
+        user_id: int,
+        total_amount: int,
+        currency: str,
+        payload: str,
+        charge_id: str | None,
+        attempts: int = 0,
+        bot_stars: int = 0,
+        task: tuple | None = None,
+    ) -> dict:
+        """
+        Успешный платёж целиком в одной транзакции: запись в payments,
+        attempts купленных попыток, bot_stars на баланс бота и задача
+        (kind, payload, run_at) в scheduled_tasks. Если платёж с этим
+        charge_id уже есть, ничего не меняет: {"is_new": False}.
+        """
+        with self.pool.connection() as conn:
+            if not self._insert_payment(conn, user_id, total_amount, currency, payload, charge_id):
+                return {"is_new": False, "user": None, "bot_stars": None}
+
+            user = None
+            if attempts:
+                user = dict(
+                    conn.execute(
+                        """
+                        INSERT INTO users (user_id, purchased_attempts) VALUES (?, ?)
+                        ON CONFLICT(user_id) DO UPDATE SET
+                            purchased_attempts = purchased_attempts + excluded.purchased_attempts
+                        RETURNING *
+                        """,
+                        (user_id, attempts),
+                    ).fetchone()
+                )
+            stars = None
+            if bot_stars:
+                stars = conn.execute(
+                    "UPDATE bot_balance SET stars = stars + ? WHERE id = 1 RETURNING stars",
+                    (bot_stars,),
+                ).fetchone()["stars"]
+            if task is not None:
+                self._insert_task(conn, *task)
+        return {"is_new": True, "user": user, "bot_stars": stars}
+
+    def get_user_payment_totals(self, user_id: int) -> list[dict]:
+        """
+        Платежи пользователя по видам: количество и сумма.
+        Идёт по индексу idx_payments_user_payload.
+        """
+        with self.pool.connection() as conn:
+            rows = conn.execute(
+                """
+                SELECT payload, currency, COUNT(*) AS payments_count, SUM(total_amount) AS total_amount
+                FROM payments
+                WHERE user_id = ?
+                GROUP BY payload, currency
+                ORDER BY total_amount DESC
+                """,
+                (user_id,),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_period_payment_totals(self, since_day: str, until_day: str) -> list[dict]:
+        """
+        Суммы платежей по видам за дни [since_day, until_day] (YYYY-MM-DD)
+        из таблицы payment_daily — без скана payments.
+        """
+        with self.pool.connection() as conn:
+            rows = conn.execute(
+                """
+                SELECT payload, currency, SUM(payments_count) AS payments_count,
+                       SUM(total_amount) AS total_amount
+                FROM payment_daily
+                WHERE day BETWEEN ? AND ?
+                GROUP BY payload, currency
+                ORDER BY total_amount DESC
+                """,
+                (since_day, until_day),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    # ---- игровая логика ----
+
+    def play_attempt(self, user_id: int) -> dict:
+        """
+        Делает попытку игры.
+        Учитывает бесплатные и купленные попытки.
+
+        Сброс по дате, списание попытки (сначала бесплатные, потом купленные)
+        и начисление победы делаются одним UPSERT ... RETURNING, поэтому
+        два одновременных нажатия не могут потратить одну попытку дважды
+        или потерять победу.
+        """
+        is_win = random.random() < self.win_chance
+        params = {
+            "user_id": user_id,
+            "today": self.clock.today(),
+            "daily": self.daily_attempts,
+            "win": int(is_win),
+        }
+
+        with self.pool.connection() as conn:
+            rows = conn.execute(PLAY_ATTEMPT_SQL, params).fetchall()
+            if not rows:
+                # попыток нет — UPDATE не сработал, просто читаем пользователя
+                user = dict(self._get_or_create_user_raw(conn, user_id))
+                return {
+                    "no_attempts": True,
+                    "is_win": None,
+                    "attempts_left": 0,
+                    "user": user,
+                }
+
+        user = dict(rows[0])
+        free_left_after = max(0, self.daily_attempts - user["daily_attempts_used"])
+        total_left_after = free_left_after + user["purchased_attempts"]
+
+        return {
+            "no_attempts": False,
+            "is_win": is_win,
+            "attempts_left": total_left_after,
+            "user": user,
+        }
+
+    def apply_gift_redeem(self, user_id: int, wins_cost: int):
+        """
+        Списывает победы за подарок и увеличивает счётчик подарков.
+        """
+        with self.pool.connection() as conn:
+            conn.execute(
+                """
+                UPDATE users
+                SET wins_for_gift = wins_for_gift - ?,
+                    gifts_count = gifts_count + 1
+                WHERE user_id = ?
+                """,
+                (wins_cost, user_id),
+            )
+
+    def get_top_winners(self, limit: int = 10, offset: int = 0):
+        """
+        Возвращает топ игроков по total_wins (идёт по индексу idx_users_top).
+        При равных победах выше меньший user_id, поэтому страницы
+        offset не теряют и не повторяют игроков.
+        """
+        with self.pool.connection() as conn:
+            cur = conn.execute(
+                """
+                SELECT user_id, total_wins, gifts_count
+                FROM users
+                WHERE total_wins > 0
+                ORDER BY total_wins DESC, user_id
+                LIMIT ? OFFSET ?
+                """,
+                (limit, offset),
+            )
+            rows = cur.fetchall()
+        return rows
+
+    def get_user_rank(self, user_id: int):
+        """
+        Место пользователя в топе — то же, что в get_top_winners,
+        или None, если он ещё не выигрывал.
+        """
+        with self.pool.connection() as conn:
+            row = conn.execute(
+                """
+                SELECT u.total_wins,
+                       (SELECT COUNT(*) FROM users
+                        WHERE total_wins > u.total_wins
+                           OR (total_wins = u.total_wins AND user_id < u.user_id)) + 1 AS rank
+                FROM users u
+                WHERE u.user_id = ? AND u.total_wins > 0
+                """,
+                (user_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return {"rank": row["rank"], "total_wins": row["total_wins"]}
+
+    def set_attempts_left(self, user_id: int, attempts_left: int):
+        """
+        Админ-накрутка "бесплатных" попыток.
+        Реализовано через daily_attempts_used.
+        """
+        today = self.clock.today()
+        used = self.daily_attempts - attempts_left  # может быть отрицательным
+        with self.pool.connection() as conn:
+            conn.execute(
+                """
+                UPDATE users
+                SET daily_attempts_used = ?,
+                    last_attempt_date = ?
+                WHERE user_id = ?
+                """,
+                (used, today, user_id),
+            )
+
+    def add_purchased_attempts(self, user_id: int, attempts: int):
+        """
+        Увеличивает количество купленных попыток у пользователя.
+        """
+        with self.pool.connection() as conn:
+            self._get_or_create_user_raw(conn, user_id)
+            conn.execute(
+                "UPDATE users SET purchased_attempts = purchased_attempts + ? WHERE user_id = ?",
+                (attempts, user_id),
+            )
+
+    # ---- сброс бесплатных попыток (DailyReset) ----
+
+    def claim_daily_reset(self, day: str, now: float, lease: float):
+        """
+        Забирает сброс за day. Возвращает курсор (user_id, с которого продолжать)
+        или None — сброс закончен или его ведёт другой процесс.
+        """
+        with self.pool.connection(immediate=True) as conn:
+            row = conn.execute(
+                "SELECT cursor, finished_at, updated_at FROM daily_resets WHERE day = ?",
+                (day,),
+            ).fetchone()
+            if row is None:
+                conn.execute(
+                    "INSERT INTO daily_resets (day, cursor, users, started_at, updated_at) VALUES (?, 0, 0, ?, ?)",
+                    (day, now, now),
+                )
+                return 0
+            if row["finished_at"] is not None or row["updated_at"] > now - lease:
+                return None
+            conn.execute("UPDATE daily_resets SET updated_at = ? WHERE day = ?", (now, day))
+            return row["cursor"]
+
+    def reset_daily_attempts_batch(self, day: str, after_user_id: int, limit: int) -> tuple:
+        """
+        Обнуляет потраченные бесплатные попытки у следующих limit пользователей
+        после after_user_id. Пишет только тех, кто играл до day (у остальных
+        обнулять нечего). Возвращает (новый курсор или None в конце, сколько обновлено).
+        """
+        now = time.time()
+        with self.pool.connection(immediate=True) as conn:
+            upto = conn.execute(
+                "SELECT MAX(user_id) FROM (SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?)",
+                (after_user_id, limit),
+            ).fetchone()[0]
+            if upto is None:
+                conn.execute(
+                    "UPDATE daily_resets SET finished_at = ?, updated_at = ? WHERE day = ?",
+                    (now, now, day),
+                )
+                return None, 0
+
+            updated = conn.execute(
+                """
+                UPDATE users
+                SET daily_attempts_used = 0,
+                    last_attempt_date = ?
+                WHERE user_id > ? AND user_id <= ?
+                  AND daily_attempts_used != 0
+                  AND last_attempt_date IS NOT ?
+                """,
+                (day, after_user_id, upto, day),
+            ).rowcount
+            conn.execute(
+                "UPDATE daily_resets SET cursor = ?, users = users + ?, updated_at = ? WHERE day = ?",
+                (upto, updated, now, day),
+            )
+        return upto, updated
+
+    # ---- БАНЫ ----
+
+    # Баны меняются только через /ban и /unban, поэтому весь список держим
+    # в памяти: загружается при старте, обновляется write-through.
+    # Баны из другого процесса подхватывает refresh_bans: каждое изменение
+    # увеличивает bans_version, и процесс перечитывает список, увидев новую версию.
+
+    def _load_bans(self):
+        with self.pool.connection() as conn:
+            # версию — до списка: бан между двумя запросами перечитаем в следующий раз
+            version = conn.execute("SELECT version FROM bans_version WHERE id = 1").fetchone()[0]
+            rows = conn.execute("SELECT user_id FROM bans").fetchall()
+        self._banned = {row["user_id"] for row in rows}
+        self._bans_version = version
+
+    def refresh_bans(self) -> bool:
+        """
+        Перечитывает баны, если их поменяли после последней загрузки.
+        Обычно это один запрос к однострочной таблице.
+        """
+        with self.pool.connection() as conn:
+            version = conn.execute("SELECT version FROM bans_version WHERE id = 1").fetchone()[0]
+        if version == self._bans_version:
+            return False
+        self._load_bans()
+        self._ban_reloads += 1
+        return True
+
+    def ban_user(self, user_id: int, reason: str = "Без причины"):
+        with self.pool.connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO bans (user_id, reason, banned_at) VALUES (?, ?, ?)",
+                (user_id, reason, datetime.utcnow().isoformat()),
+            )
+            conn.execute("UPDATE bans_version SET version = version + 1 WHERE id = 1")
+        self._banned.add(user_id)
+
+    def unban_user(self, user_id: int):
+        with self.pool.connection() as conn:
+            conn.execute("DELETE FROM bans WHERE user_id = ?", (user_id,))
+            conn.execute("UPDATE bans_version SET version = version + 1 WHERE id = 1")
+        self._banned.discard(user_id)
+
+    def is_banned(self, user_id: int) -> bool:
+        """
+        Проверка по кэшу в памяти, без запроса к базе.
+        hits — пользователь найден в списке банов, misses — не найден.
+        """
+        if user_id in self._banned:
+            self._ban_hits += 1
+            return True
+        self._ban_misses += 1
+        return False
+
+    def ban_stats(self) -> dict:
+        return {
+            "banned": len(self._banned),
+            "hits": self._ban_hits,
+            "misses": self._ban_misses,
+            "reloads": self._ban_reloads,
+        }
+
+    # ---- служебное ----
+
+    def pool_stats(self) -> dict:
+        return self.pool.stats()
+
+    def close(self):
+        self.pool.close()
+
+    # ---- ВЫВОД ПОДАРКОВ ----
+
+    def reserve_withdrawal(
+        self, user_id: int, gift_id: str, cost_stars: int, wins_cost: int, key: str | None = None
+    ) -> dict:
+        """
+        Одной транзакцией списывает cost_stars с баланса бота и wins_cost побед
+        у игрока и создаёт запись вывода в статусе reserved.
+        Возвращает {"id": ..., "status": "reserved"} или {"error": "no_stars" | "no_wins"}.
+        key — ключ идемпотентности: если вывод с таким ключом уже есть,
+        ничего не списывается, а возвращаются его id и текущий статус.
+        Ничего не блокирует дольше самой транзакции — подарок шлётся уже после неё.
+        Параллельных резервов на sqlite нет: у базы один писатель, и выводы
+        идут по одному вместе со всеми остальными записями. Параллельно
+        (с блокировкой одной строки bot_balance до commit) они идут на PostgreSQL.
+        """
+        now = time.time()
+        with self.pool.connection() as conn:
+            # сначала блокировка записи, потом поиск ключа — два повтора
+            # одной задачи не создадут два вывода
+            cur = conn.execute(
+                "UPDATE bot_balance SET stars = stars - ? WHERE id = 1 AND stars >= ?",
+                (cost_stars, cost_stars),
+            )
+            if key is not None:
+                existing = conn.execute(
+                    "SELECT id, status FROM withdrawals WHERE idempotency_key = ?", (key,)
+                ).fetchone()
+                if existing:
+                    self.pool.rollback(conn)
+                    return {"id": existing["id"], "status": existing["status"]}
+            if cur.rowcount == 0:
+                self.pool.rollback(conn)
+                return {"error": "no_stars"}
+
+            if wins_cost:
+                cur = conn.execute(
+                    """
+                    UPDATE users SET wins_for_gift = wins_for_gift - ?
+                    WHERE user_id = ? AND wins_for_gift >= ?
+                    """,
+                    (wins_cost, user_id, wins_cost),
+                )
+                if cur.rowcount == 0:
+                    self.pool.rollback(conn)
+                    return {"error": "no_wins"}
+
+            cur = conn.execute(
+                """
+                INSERT INTO withdrawals
+                    (user_id, gift_id, cost_stars, wins_cost, status, idempotency_key, created_at, updated_at)
+                VALUES (?, ?, ?, ?, 'reserved', ?, ?, ?)
+                """,
+                (user_id, gift_id, cost_stars, wins_cost, key, now, now),
+            )
+            return {"id": cur.lastrowid, "status": "reserved"}
+
+    def mark_withdrawal_sending(self, withdrawal_id: int) -> bool:
+        """
+        reserved -> sending. False — вывод уже отправляет кто-то другой
+        или он завершён: слать подарок нельзя.
+        """
+        with self.pool.connection() as conn:
+            cur = conn.execute(
+                "UPDATE withdrawals SET status = 'sending', updated_at = ? WHERE id = ? AND status = 'reserved'",
+                (time.time(), withdrawal_id),
+            )
+            return cur.rowcount == 1
+
+    def commit_withdrawal(self, withdrawal_id: int):
+        """
+        Подарок ушёл: резерв становится списанием, у игрока +1 подарок
+        (если вывод был за победы).
+        """
+        with self.pool.connection() as conn:
+            row = conn.execute(
+                """
+                UPDATE withdrawals SET status = 'sent', updated_at = ?
+                WHERE id = ? AND status IN ('reserved', 'sending', 'unknown')
+                RETURNING user_id, wins_cost
+                """,
+                (time.time(), withdrawal_id),
+            ).fetchone()
+            if row and row["wins_cost"]:
+                conn.execute(
+                    "UPDATE users SET gifts_count = gifts_count + 1 WHERE user_id = ?",
+                    (row["user_id"],),
+                )
+
+    def _release_withdrawal(self, conn: sqlite3.Connection, withdrawal_id: int, statuses: tuple) -> bool:
+        placeholders = ", ".join("?" for _ in statuses)
+        row = conn.execute(
+            f"""
+            UPDATE withdrawals SET status = 'failed', updated_at = ?
+            WHERE id = ? AND status IN ({placeholders})
+            RETURNING user_id, cost_stars, wins_cost
+            """,
+            (time.time(), withdrawal_id, *statuses),
+        ).fetchone()
+        if row is None:
+            return False
+        conn.execute(
+            "UPDATE bot_balance SET stars = stars + ? WHERE id = 1",
+            (row["cost_stars"],),
+        )
+        if row["wins_cost"]:
+            conn.execute(
+                "UPDATE users SET wins_for_gift = wins_for_gift + ? WHERE user_id = ?",
+                (row["wins_cost"], row["user_id"]),
+            )
+        return True
+
+    def rollback_withdrawal(self, withdrawal_id: int) -> bool:
+        """
+        Подарок не ушёл: возвращаем звёзды боту и победы игроку.
+        """
+        with self.pool.connection() as conn:
+            return self._release_withdrawal(conn, withdrawal_id, ("reserved", "sending", "unknown"))
+
+    def recover_withdrawals(self, older_than: float) -> dict:
+        """
+        Разбор выводов, зависших после падения процесса:
+        - reserved — до отправки не дошли, резерв возвращаем;
+        - sending — неизвестно, ушёл ли подарок, помечаем unknown
+          и оставляем резерв до решения админа.
+        """
+        with self.pool.connection() as conn:
+            stale = conn.execute(
+                """
+                SELECT id FROM withdrawals
+                WHERE status = 'reserved' AND updated_at < ?
+                """,
+                (older_than,),
+            ).fetchall()
+            released = sum(
+                self._release_withdrawal(conn, row["id"], ("reserved",)) for row in stale
+            )
+            unknown = conn.execute(
+                """
+                UPDATE withdrawals SET status = 'unknown', updated_at = ?
+                WHERE status = 'sending' AND updated_at < ?
+                """,
+                (time.time(), older_than),
+            ).rowcount
+        return {"released": released, "unknown": unknown}
+
+    def withdrawal_stats(self) -> dict:
+        with self.pool.connection() as conn:
+            rows = conn.execute(
+                """
+                SELECT status, COUNT(*) AS cnt, SUM(cost_stars) AS stars
+                FROM withdrawals
+                WHERE status IN ('reserved', 'sending', 'unknown')
+                GROUP BY status
+                """
+            ).fetchall()
+        stats = {"reserved": 0, "sending": 0, "unknown": 0, "reserved_stars": 0}
+        for row in rows:
+            stats[row["status"]] = row["cnt"]
+            stats["reserved_stars"] += row["stars"] or 0
+        return stats
+
+    # ---- РАССЫЛКИ ----
+
+    def create_broadcast(
+        self, admin_chat_id: int, text: str, owner: str | None = None, lease_until: float = 0
+    ) -> dict:
+        """
+        owner и lease_until — рассылка сразу принадлежит создавшему её процессу.
+        """
+        now = datetime.utcnow().isoformat()
+        with self.pool.connection() as conn:
+            total = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+            cur = conn.execute(
+                """
+                INSERT INTO broadcasts (admin_chat_id, text, total, owner, lease_until, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (admin_chat_id, text, total, owner, lease_until, now, now),
+            )
+            broadcast_id = cur.lastrowid
+            row = conn.execute("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,)).fetchone()
+        return dict(row)
+
+    def get_broadcasts(self, status: str = "running") -> list[dict]:
+        with self.pool.connection() as conn:
+            rows = conn.execute(
+                "SELECT * FROM broadcasts WHERE status = ? ORDER BY id", (status,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_broadcast(self, broadcast_id: int):
+        with self.pool.connection() as conn:
+            row = conn.execute("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,)).fetchone()
+        return dict(row) if row else None
+
+    def claim_broadcast(self, broadcast_id: int, owner: str, now: float, lease: float) -> bool:
+        """
+        Забирает идущую рассылку себе на lease секунд, если она ничья,
+        уже своя или аренда прежнего владельца истекла (процесс упал).
+        """
+        with self.pool.connection() as conn:
+            cur = conn.execute(
+                """
+                UPDATE broadcasts SET owner = ?, lease_until = ?
+                WHERE id = ? AND status = 'running'
+                  AND (owner IS NULL OR owner = ? OR lease_until < ?)
+                """,
+                (owner, now + lease, broadcast_id, owner, now),
+            )
+            return cur.rowcount > 0
+
+    def release_broadcast(self, broadcast_id: int, owner: str):
+        """
+        Отпускает аренду при выключении — другой процесс подхватит рассылку сразу.
+        """
+        with self.pool.connection() as conn:
+            conn.execute(
+                "UPDATE broadcasts SET lease_until = 0 WHERE id = ? AND owner = ?",
+                (broadcast_id, owner),
+            )
+
+    def save_broadcast_progress(
+        self,
+        broadcast_id: int,
+        last_user_id: int,
+        counters: dict,
+        status: str | None = None,
+        owner: str | None = None,
+        lease_until: float = 0,
+    ) -> bool:
+        """
+        Чекпоинт: все пользователи с user_id <= last_user_id уже обработаны.
+        Заодно продлевает аренду до lease_until. False — рассылку отменили
+        или она уже у другого процесса: продолжать нельзя.
+        """
+        with self.pool.connection() as conn:
+            cur = conn.execute(
+                """
+                UPDATE broadcasts
+                SET last_user_id = ?, sent = ?, blocked = ?, failed = ?, skipped = ?,
+                    status = COALESCE(?, status), lease_until = ?, updated_at = ?
+                WHERE id = ? AND status = 'running' AND owner IS ?
+                """,
+                (
+                    last_user_id,
+                    counters["sent"],
+                    counters["blocked"],
+                    counters["failed"],
+                    counters["skipped"],
+                    status,
+                    lease_until,
+                    datetime.utcnow().isoformat(),
+                    broadcast_id,
+                    owner,
+                ),
+            )
+            return cur.rowcount > 0
+
+    def set_broadcast_status(self, broadcast_id: int, status: str) -> bool:
+        with self.pool.connection() as conn:
+            cur = conn.execute(
+                "UPDATE broadcasts SET status = ?, updated_at = ? WHERE id = ? AND status = 'running'",
+                (status, datetime.utcnow().isoformat(), broadcast_id),
+            )
+            return cur.rowcount > 0
+
+    def get_user_ids_after(self, after_user_id: int, limit: int = 500) -> list[int]:
+        """
+        Следующая пачка user_id по первичному ключу (keyset, без OFFSET).
+        """
+        with self.pool.connection() as conn:
+            rows = conn.execute(
+                "SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?",
+                (after_user_id, limit),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    # ---- МЕДИА ----
+
+    def get_media_file_id(self, key: str):
+        with self.pool.connection() as conn:
+            row = conn.execute(
+                "SELECT file_id FROM media_cache WHERE key = ?", (key,)
+            ).fetchone()
+        return row["file_id"] if row else None
+
+    def set_media_file_id(self, key: str, file_id: str):
+        with self.pool.connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO media_cache (key, file_id, updated_at) VALUES (?, ?, ?)",
+                (key, file_id, datetime.utcnow().isoformat()),
+            )
+
+    def delete_media_file_id(self, key: str):
+        with self.pool.connection() as conn:
+            conn.execute("DELETE FROM media_cache WHERE key = ?", (key,))
+
+    # ---- ОТЛОЖЕННЫЕ ЗАДАЧИ ----
+
+    def _insert_task(self, conn: sqlite3.Connection, kind: str, payload: dict, run_at: float) -> int:
+        cur = conn.execute(
+            "INSERT INTO scheduled_tasks (kind, payload, run_at, created_at) VALUES (?, ?, ?, ?)",
+            (kind, json.dumps(payload), run_at, datetime.utcnow().isoformat()),
+        )
+        return cur.lastrowid
+
+    def schedule_task(self, kind: str, payload: dict, run_at: float) -> int:
+        with self.pool.connection() as conn:
+            return self._insert_task(conn, kind, payload, run_at)
+
+    def claim_due_tasks(self, now: float, limit: int, lease: float, max_attempts: int) -> list[dict]:
+        """
+        Забирает до limit созревших задач и до limit задач с истёкшей арендой
+        (их взял упавший процесс) и помечает их running на lease секунд.
+        У вторых reclaimed=True; если они уже исчерпали max_attempts —
+        становятся failed и не возвращаются.
+
+        Каждая ветка — свой UPDATE ... RETURNING по своему индексу
+        (status, run_at) / (status, locked_until), без сортировки очереди;
+        два воркера не возьмут одну задачу.
+        """
+        params = {"now": now, "limit": limit, "locked_until": now + lease, "max_attempts": max_attempts}
+        with self.pool.connection() as conn:
+            conn.execute(
+                """
+                UPDATE scheduled_tasks
+                SET status = 'failed', last_error = 'аренда истекла, попытки исчерпаны'
+                WHERE status = 'running' AND locked_until < :now AND attempts >= :max_attempts
+                """,
+                params,
+            )
+            due = conn.execute(
+                """
+                UPDATE scheduled_tasks
+                SET status = 'running',
+                    locked_until = :locked_until,
+                    attempts = attempts + 1
+                WHERE id IN (
+                    SELECT id FROM scheduled_tasks
+                    WHERE status = 'pending' AND run_at <= :now
+                    ORDER BY run_at
+                    LIMIT :limit
+                )
+                RETURNING id, kind, payload, attempts
+                """,
+                params,
+            ).fetchall()
+            expired = conn.execute(
+                """
+                UPDATE scheduled_tasks
+                SET locked_until = :locked_until,
+                    attempts = attempts + 1
+                WHERE id IN (
+                    SELECT id FROM scheduled_tasks
+                    WHERE status = 'running' AND locked_until < :now
+                    ORDER BY locked_until
+                    LIMIT :limit
+                )
+                RETURNING id, kind, payload, attempts
+                """,
+                params,
+            ).fetchall()
+        return [
+            {
+                "id": row["id"],
+                "kind": row["kind"],
+                "payload": json.loads(row["payload"]),
+                "attempts": row["attempts"],
+                "reclaimed": reclaimed,
+            }
+            for reclaimed, rows in ((False, due), (True, expired))
+            for row in rows
+        ]
+
+    def complete_task(self, task_id: int, next_task: tuple | None = None):
+        """
+        Удаляет выполненную задачу. next_task=(kind, payload, run_at) —
+        следующий шаг, ставится в той же транзакции.
+        """
+        with self.pool.connection() as conn:
+            conn.execute("DELETE FROM scheduled_tasks WHERE id = ?", (task_id,))
+            if next_task:
+                self._insert_task(conn, *next_task)
+
+    def fail_task(self, task_id: int, error: str, retry_at: float | None):
+        """
+        retry_at=None — больше не пытаемся (status = 'failed').
+        """
+        with self.pool.connection() as conn:
+            conn.execute(
+                """
+                UPDATE scheduled_tasks
+                SET status = CASE WHEN ? IS NULL THEN 'failed' ELSE 'pending' END,
+                    run_at = COALESCE(?, run_at),
+                    last_error = ?
+                WHERE id = ?
+                """,
+                (retry_at, retry_at, error, task_id),
+            )
+
+    def next_task_run_at(self):
+        with self.pool.connection() as conn:
+            row = conn.execute(
+                "SELECT MIN(run_at) AS run_at FROM scheduled_tasks WHERE status = 'pending'"
+            ).fetchone()
+        return row["run_at"]
+
+    # ---- СОСТОЯНИЯ ДИАЛОГОВ (FSM) ----
+
+    def fsm_get(self, key: str, now: float):
+        """
+        Возвращает (state, data) или None, если записи нет или она истекла.
+        """
+        with self.pool.connection() as conn:
+            row = conn.execute(
+                "SELECT state, data FROM fsm_state WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+        if row is None:
+            return None
+        return row["state"], json.loads(row["data"])
+
+    def fsm_set_state(self, key: str, state: str | None, expires_at: float):
+        with self.pool.connection() as conn:
+            if state is None:
+                # состояние сброшено — строка нужна, только если остались данные
+                conn.execute("DELETE FROM fsm_state WHERE key = ? AND data = '{}'", (key,))
+                conn.execute("UPDATE fsm_state SET state = NULL WHERE key = ?", (key,))
+                return
+            conn.execute(
+                """
+                INSERT INTO fsm_state (key, state, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    state = excluded.state,
+                    expires_at = excluded.expires_at,
+                    data = CASE WHEN fsm_state.expires_at > ? THEN fsm_state.data ELSE '{}' END
+                """,
+                (key, state, expires_at, time.time()),
+            )
+
+    def fsm_set_data(self, key: str, data: dict, expires_at: float):
+        with self.pool.connection() as conn:
+            if not data:
+                conn.execute("DELETE FROM fsm_state WHERE key = ? AND state IS NULL", (key,))
+                conn.execute("UPDATE fsm_state SET data = '{}' WHERE key = ?", (key,))
+                return
+            conn.execute(
+                """
+                INSERT INTO fsm_state (key, data, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    data = excluded.data,
+                    expires_at = excluded.expires_at,
+                    state = CASE WHEN fsm_state.expires_at > ? THEN fsm_state.state END
+                """,
+                (key, json.dumps(data, ensure_ascii=False), expires_at, time.time()),
+            )
+
+    def fsm_purge(self, now: float) -> int:
+        with self.pool.connection() as conn:
+            cur = conn.execute("DELETE FROM fsm_state WHERE expires_at <= ?", (now,))
+            return cur.rowcount
+
+    # ---- ПРОМОКОДЫ ----
+
+    def create_promo(self, code: str, reward_wins: int, one_time: int):
+        with self.pool.connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO promo_codes(code, reward_wins, one_time) VALUES (?, ?, ?)",
+                (code, reward_wins, one_time),
+            )
+
+    def create_promos_batch(self, promos: list[tuple]) -> bool:
+        """
+        Вставляет пачку (code, reward_wins, one_time) одной транзакцией.
+        Если хоть один код уже существует — пачка не пишется и вернётся False.
+        """
+        with self.pool.connection() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO promo_codes(code, reward_wins, one_time) VALUES (?, ?, ?)",
+                promos,
+            )
+            if conn.total_changes - before != len(promos):
+                self.pool.rollback(conn)
+                return False
+            return True
+
+    def import_promos_batch(self, promos: list[tuple]) -> int:
+        """
+        Вставляет пачку (code, reward_wins, one_time) одной транзакцией,
+        пропуская уже существующие коды. Возвращает число новых.
+        """
+        with self.pool.connection() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO promo_codes(code, reward_wins, one_time) VALUES (?, ?, ?)",
+                promos,
+            )
+            return conn.total_changes - before
+
+    def get_promos_page(self, after_code: str = "", limit: int = 1000) -> list[tuple]:
+        """
+        Страница активных кодов по возрастанию code (keyset, без OFFSET).
+        """
+        with self.pool.connection() as conn:
+            rows = conn.execute(
+                "SELECT code, reward_wins, one_time FROM promo_codes WHERE code > ? ORDER BY code LIMIT ?",
+                (after_code, limit),
+            ).fetchall()
+        return [tuple(row) for row in rows]
+
+    def get_promo(self, code: str):
+        """
+        Один код по первичному ключу: (reward_wins, one_time) или None.
+        """
+        with self.pool.connection() as conn:
+            row = conn.execute(
+                "SELECT reward_wins, one_time FROM promo_codes WHERE code = ?", (code,)
+            ).fetchone()
+        return (row["reward_wins"], row["one_time"]) if row else None
+
+    def redeem_promo(self, user_id: int, code: str) -> dict:
+        """
+        Активирует промокод одной транзакцией: отмечает использование,
+        начисляет победы и удаляет одноразовый код.
+        Возвращает {"reward", "one_time", "wins_for_gift"} или
+        {"error": "not_found" | "used"}.
+        """
+        with self.pool.connection() as conn:
+            # сначала запись — транзакция сразу берёт блокировку на запись,
+            # и параллельная активация не может вклиниться между проверкой и начислением
+            cur = conn.execute(
+                """
+                INSERT INTO promo_used(user_id, code)
+                SELECT ?, code FROM promo_codes WHERE code = ?
+                ON CONFLICT(user_id, code) DO NOTHING
+                """,
+                (user_id, code),
+            )
+            promo = conn.execute(
+                "SELECT reward_wins, one_time FROM promo_codes WHERE code = ?", (code,)
+            ).fetchone()
+            if cur.rowcount == 0:
+                self.pool.rollback(conn)
+                return {"error": "used" if promo else "not_found"}
+
+            if promo["one_time"]:
+                conn.execute("DELETE FROM promo_codes WHERE code = ?", (code,))
+
+            self._get_or_create_user_raw(conn, user_id)
+            row = conn.execute(
+                "UPDATE users SET wins_for_gift = wins_for_gift + ? WHERE user_id = ? RETURNING wins_for_gift",
+                (promo["reward_wins"], user_id),
+            ).fetchone()
+            return {
+                "reward": promo["reward_wins"],
+                "one_time": promo["one_time"],
+                "wins_for_gift": row["wins_for_gift"],
+            }
+
+
+# ================== ЕДИНСТВЕННЫЙ ПИСАТЕЛЬ ==================
+
+
+class SQLiteWriter:
+    """
+    Единственный писатель в базу с групповым commit.
+
+    Изменяющие методы DB ставятся в очередь; поток писателя забирает из неё
+    до max_batch команд (после первой ждёт следующие ещё до max_delay секунд)
+    и выполняет их одной транзакцией на своём соединении. Каждый блок
+    pool.connection() внутри команды — SAVEPOINT: ошибка откатывает только
+    свою команду. Future вызывающего завершается после COMMIT всей пачки.
+
+    Соединения пула остаются читателям: в WAL они не ждут писателя,
+    а писатели процесса больше не сталкиваются на блокировке sqlite.
+    """
+
+    def __init__(self, pool: ConnectionPool, max_batch: int = 16, max_delay: float = 0.0):
+        self.pool = pool
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread: threading.Thread | None = None
+        self._start_lock = threading.Lock()
+
+        # метрики
+        self.batches = 0
+        self.commands = 0
+        self.failed = 0
+        self.largest = 0
+        self._commit_total = 0.0
+        self._commit_max = 0.0
+
+    def submit(self, func, *args, **kwargs) -> Future:
+        future: Future = Future()
+        self._queue.put((functools.partial(func, *args, **kwargs), future))
+        if self._thread is None:
+            self._start()
+        return future
+
+    def _start(self):
+        # поток и соединение — при первой записи, чтобы подхватить enable_trace/enable_audit
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        conn = self.pool._new_connection()
+        try:
+            while True:
+                batch = self._next_batch()
+                if batch is None:
+                    return
+                self._apply(conn, batch)
+        finally:
+            conn.close()
+
+    def _next_batch(self) -> list | None:
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)  # остановка — после этой пачки
+                break
+            batch.append(item)
+        return batch
+
+    def _apply(self, conn: sqlite3.Connection, batch: list):
+        results = []
+        start = time.perf_counter()
+        try:
+            with self.pool.batch(conn):
+                for call, future in batch:
+                    if not future.set_running_or_notify_cancel():
+                        continue  # вызывающий уже отменил ожидание
+                    try:
+                        results.append((future, call(), None))
+                    except Exception as e:
+                        results.append((future, None, e))
+        except Exception as e:
+            # BEGIN или COMMIT не прошёл — не записалась вся пачка
+            logging.exception("Пачка записи в базу из %s команд не записана", len(batch))
+            self.failed += len(batch)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        elapsed = time.perf_counter() - start
+        self.batches += 1
+        self.commands += len(results)
+        self.largest = max(self.largest, len(results))
+        self._commit_total += elapsed
+        self._commit_max = max(self._commit_max, elapsed)
+        for future, result, error in results:
+            if error is not None:
+                self.failed += 1
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def stop(self):
+        """
+        Дописывает очередь и останавливает поток.
+        """
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def stats(self) -> dict:
+        batches = self.batches
+        return {
+            "batches": batches,
+            "commands": self.commands,
+            "failed": self.failed,
+            "queued": self._queue.qsize(),
+            "avg_batch": self.commands / batches if batches else 0.0,
+            "largest": self.largest,
+            "batch_avg_ms": self._commit_total / batches * 1000 if batches else 0.0,
+            "batch_max_ms": self._commit_max * 1000,
+        }
+
+
+# ================== АСИНХРОННАЯ ОБЁРТКА ==================
+
+
+class AsyncDB:
+    """
+    Асинхронный фасад над DB с теми же методами.
+    Чтения выполняются в выделенном пуле потоков, поэтому медленный
+    commit или блокировка sqlite не останавливают event loop и polling.
+    Записи (DB.WRITES) с group_commit идут через SQLiteWriter пачками
+    по commit_batch команд, без него — в тот же пул потоков.
+
+        db = AsyncDB(DB("bot.db"))
+        result = await db.play_attempt(user_id)
+    """
+
+    def __init__(
+        self,
+        sync_db: DB,
+        max_workers: int = 4,
+        group_commit: bool = True,
+        commit_batch: int = 16,
+        commit_delay: float = 0.0,
+    ):
+        self.sync = sync_db
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="db",
+        )
+        self.writer = SQLiteWriter(sync_db.pool, commit_batch, commit_delay) if group_commit else None
+        self.metrics = None
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.sync, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+        write = self.writer is not None and name in DB.WRITES
+
+        @functools.wraps(attr)
+        async def call(*args, **kwargs):
+            metrics = self.metrics
+            if metrics is None or update_stats.get() is False:
+                return await self._submit(write, attr, *args, **kwargs)
+            result, seconds, statements = await self._submit(write, self._traced, attr, args, kwargs)
+            metrics.db_call(name, seconds, statements)
+            return result
+
+        # кэшируем обёртку, чтобы __getattr__ не вызывался повторно
+        setattr(self, name, call)
+        return call
+
+    def _submit(self, write: bool, func, *args, **kwargs):
+        if write:
+            return asyncio.wrap_future(self.writer.submit(func, *args, **kwargs))
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    def _traced(self, func, args, kwargs):
+        with self.sync.pool.trace() as statements:
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            return result, time.perf_counter() - start, statements
+
+    def instrument(self, metrics):
+        """
+        Включает замеры: время и число SQL каждого вызова, медленные вызовы.
+        """
+        self.sync.pool.enable_trace()
+        self.metrics = metrics
+
+    def audit(self, auditor: QueryAuditor):
+        """
+        Режим профилирования: планы и время каждого SQL (см. QueryAuditor).
+        """
+        self.sync.pool.enable_audit(auditor)
+
+    async def get_user(self, user_id: int) -> dict:
+        # строка почти всегда уже есть: читаем из пула, создаём через писателя
+        user = await self.find_user(user_id)
+        if user is None:
+            user = await self.create_user(user_id)
+        return user
+
+    async def pool_stats(self) -> dict:
+        stats = self.sync.pool_stats()
+        if self.writer is not None:
+            stats["writer"] = self.writer.stats()
+        return stats
+
+    # эти методы читают только память — в пул потоков их не отправляем
+
+    def is_banned(self, user_id: int) -> bool:
+        return self.sync.is_banned(user_id)
+
+    def ban_stats(self) -> dict:
+        return self.sync.ban_stats()
+
+    async def connect(self):
+        # схема sqlite создаётся в DB.__init__, здесь делать нечего
+        pass
+
+    async def close(self):
+        self._executor.shutdown(wait=True)
+        if self.writer is not None:
+            self.writer.stop()
+        self.sync.close()
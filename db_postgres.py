@@ -0,0 +1,1203 @@
+import json
+import random
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+import asyncpg
+
+from daily_reset import GameClock
+
+
+# ================== СХЕМА ==================
+
+# те же таблицы и индексы, что и в sqlite (migrations.py), в типах PostgreSQL
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        user_id BIGINT PRIMARY KEY,
+        total_wins INTEGER NOT NULL DEFAULT 0,
+        wins_for_gift INTEGER NOT NULL DEFAULT 0,
+        gifts_count INTEGER NOT NULL DEFAULT 0,
+        daily_attempts_used INTEGER NOT NULL DEFAULT 0,
+        last_attempt_date TEXT,
+        purchased_attempts INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_users_top ON users(total_wins DESC, user_id, gifts_count)",
+    """
+    CREATE TABLE IF NOT EXISTS bot_balance (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        stars INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    "INSERT INTO bot_balance (id, stars) VALUES (1, 0) ON CONFLICT DO NOTHING",
+    """
+    CREATE TABLE IF NOT EXISTS payments (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        user_id BIGINT NOT NULL,
+        total_amount INTEGER NOT NULL,
+        currency TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        charge_id TEXT
+    )
+    """,
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_payments_charge_id ON payments(charge_id) WHERE charge_id IS NOT NULL",
+    "CREATE INDEX IF NOT EXISTS idx_payments_user_payload ON payments(user_id, payload, id)",
+    "CREATE INDEX IF NOT EXISTS idx_payments_created_at ON payments(created_at)",
+    """
+    CREATE TABLE IF NOT EXISTS payment_daily (
+        day TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        currency TEXT NOT NULL,
+        payments_count INTEGER NOT NULL DEFAULT 0,
+        total_amount BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, payload, currency)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS withdrawals (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        user_id BIGINT NOT NULL,
+        gift_id TEXT NOT NULL,
+        cost_stars INTEGER NOT NULL,
+        wins_cost INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        idempotency_key TEXT,
+        created_at DOUBLE PRECISION NOT NULL,
+        updated_at DOUBLE PRECISION NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_withdrawals_status ON withdrawals(status, created_at)",
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_withdrawals_idempotency_key
+    ON withdrawals(idempotency_key) WHERE idempotency_key IS NOT NULL
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS bans (
+        user_id BIGINT PRIMARY KEY,
+        reason TEXT,
+        banned_at TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS bans_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version BIGINT NOT NULL DEFAULT 0
+    )
+    """,
+    "INSERT INTO bans_version (id, version) VALUES (1, 0) ON CONFLICT DO NOTHING",
+    """
+    CREATE TABLE IF NOT EXISTS media_cache (
+        key TEXT PRIMARY KEY,
+        file_id TEXT NOT NULL,
+        updated_at TEXT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS scheduled_tasks (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        kind TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        run_at DOUBLE PRECISION NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        locked_until DOUBLE PRECISION,
+        last_error TEXT,
+        created_at TEXT NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_scheduled_tasks_due ON scheduled_tasks(status, run_at)",
+    "CREATE INDEX IF NOT EXISTS idx_scheduled_tasks_lease ON scheduled_tasks(status, locked_until)",
+    """
+    CREATE TABLE IF NOT EXISTS broadcasts (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        admin_chat_id BIGINT NOT NULL,
+        text TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'running',
+        total INTEGER NOT NULL DEFAULT 0,
+        last_user_id BIGINT NOT NULL DEFAULT 0,
+        sent INTEGER NOT NULL DEFAULT 0,
+        blocked INTEGER NOT NULL DEFAULT 0,
+        failed INTEGER NOT NULL DEFAULT 0,
+        skipped INTEGER NOT NULL DEFAULT 0,
+        owner TEXT,
+        lease_until DOUBLE PRECISION NOT NULL DEFAULT 0,
+        created_at TEXT NOT NULL,
+        updated_at TEXT NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_broadcasts_status ON broadcasts(status, id)",
+    """
+    CREATE TABLE IF NOT EXISTS fsm_state (
+        key TEXT PRIMARY KEY,
+        state TEXT,
+        data TEXT NOT NULL DEFAULT '{}',
+        expires_at DOUBLE PRECISION NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_fsm_state_expires ON fsm_state(expires_at)",
+    """
+    CREATE TABLE IF NOT EXISTS promo_codes (
+        code TEXT PRIMARY KEY,
+        reward_wins INTEGER NOT NULL,
+        one_time INTEGER NOT NULL DEFAULT 1
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS promo_used (
+        user_id BIGINT NOT NULL,
+        code TEXT NOT NULL,
+        PRIMARY KEY (user_id, code)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_promo_used_code ON promo_used(code)",
+    """
+    CREATE TABLE IF NOT EXISTS daily_resets (
+        day TEXT PRIMARY KEY,
+        cursor BIGINT NOT NULL DEFAULT 0,
+        users INTEGER NOT NULL DEFAULT 0,
+        started_at DOUBLE PRECISION NOT NULL,
+        updated_at DOUBLE PRECISION NOT NULL,
+        finished_at DOUBLE PRECISION
+    )
+    """,
+]
+
+
+def affected(status: str) -> int:
+    """
+    Число строк из статуса asyncpg ("UPDATE 3", "INSERT 0 5").
+    """
+    return int(status.rsplit(" ", 1)[-1])
+
+
+class Rollback(Exception):
+    """
+    Откатить транзакцию и вернуть result вызывающему.
+    """
+
+    def __init__(self, result):
+        self.result = result
+
+
+# ================== БАЗА ДАННЫХ (PostgreSQL) ==================
+
+
+class PostgresDB:
+    """
+    Хранилище на PostgreSQL с асинхронным пулом asyncpg.
+    Методы и их результаты те же, что у AsyncDB над sqlite, поэтому
+    хендлеры и сервисы не знают, какая база под ними.
+
+    Несколько процессов бота могут работать с одной базой: игра, выводы
+    и промокоды блокируют только свои строки (SELECT ... FOR UPDATE),
+    задачи планировщика разбираются через FOR UPDATE SKIP LOCKED.
+
+        db = PostgresDB("postgresql://bot@localhost/bot")
+        await db.connect()
+    """
+
+    def __init__(
+        self,
+        dsn: str,
+        daily_attempts: int = 15,
+        win_chance: float = 0.27,
+        pool_size: int = 10,
+        clock: GameClock | None = None,
+    ):
+        self.dsn = dsn
+        self.daily_attempts = daily_attempts
+        self.win_chance = win_chance
+        self.clock = clock or GameClock()
+        self.pool_size = pool_size
+        self.pool: asyncpg.Pool | None = None
+
+        self._banned: set[int] = set()
+        self._bans_version = 0
+        self._ban_hits = 0
+        self._ban_misses = 0
+        self._ban_reloads = 0
+
+        # метрики пула (как у ConnectionPool в db.py)
+        self._acquired = 0
+        self._waited = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    async def connect(self):
+        if self.pool is not None:
+            return
+        self.pool = await asyncpg.create_pool(self.dsn, min_size=1, max_size=self.pool_size)
+        async with self.connection() as conn:
+            async with conn.transaction():
+                # схему создаёт один процесс за раз
+                await conn.execute("SELECT pg_advisory_xact_lock(hashtext('bot_schema'))")
+                for statement in SCHEMA:
+                    await conn.execute(statement)
+                if await conn.fetchval("SELECT 1 FROM payment_daily LIMIT 1") is None:
+                    await conn.execute(
+                        """
+                        INSERT INTO payment_daily (day, payload, currency, payments_count, total_amount)
+                        SELECT substr(created_at, 1, 10), payload, currency, COUNT(*), SUM(total_amount)
+                        FROM payments
+                        GROUP BY substr(created_at, 1, 10), payload, currency
+                        """
+                    )
+        await self._load_bans()
+
+    @asynccontextmanager
+    async def connection(self):
+        start = time.perf_counter()
+        async with self.pool.acquire() as conn:
+            waited = time.perf_counter() - start
+            self._acquired += 1
+            self._wait_total += waited
+            if waited > 0.001:
+                self._waited += 1
+            self._wait_max = max(self._wait_max, waited)
+            yield conn
+
+    @asynccontextmanager
+    async def transaction(self):
+        async with self.connection() as conn:
+            async with conn.transaction():
+                yield conn
+
+    async def _in_transaction(self, func, *args):
+        """
+        Выполняет func(conn, *args) в транзакции. Rollback(result) внутри
+        откатывает всё и возвращает result.
+        """
+        try:
+            async with self.transaction() as conn:
+                return await func(conn, *args)
+        except Rollback as e:
+            return e.result
+
+    # ---- служебные методы ----
+
+    async def _get_or_create_user_raw(self, conn, user_id: int, lock: bool = False) -> dict:
+        # сначала чтение: строка почти всегда есть, и просмотр профиля не пишет в WAL
+        sql = "SELECT * FROM users WHERE user_id = $1" + (" FOR UPDATE" if lock else "")
+        row = await conn.fetchrow(sql, user_id)
+        if row is None:
+            await conn.execute(
+                "INSERT INTO users (user_id, last_attempt_date, purchased_attempts) VALUES ($1, NULL, 0) "
+                "ON CONFLICT (user_id) DO NOTHING",
+                user_id,
+            )
+            row = await conn.fetchrow(sql, user_id)
+        return dict(row)
+
+    async def get_user(self, user_id: int) -> dict:
+        async with self.connection() as conn:
+            return await self._get_or_create_user_raw(conn, user_id)
+
+    async def update_user_fields(self, user_id: int, **fields):
+        if not fields:
+            return
+        columns = ", ".join(f"{k} = ${i}" for i, k in enumerate(fields.keys(), start=1))
+        async with self.connection() as conn:
+            await conn.execute(
+                f"UPDATE users SET {columns} WHERE user_id = ${len(fields) + 1}",
+                *fields.values(),
+                user_id,
+            )
+
+    # ---- баланс бота ----
+
+    async def get_bot_stars(self) -> int:
+        async with self.connection() as conn:
+            return await conn.fetchval("SELECT stars FROM bot_balance WHERE id = 1")
+
+    async def add_bot_stars(self, amount: int):
+        async with self.connection() as conn:
+            await conn.execute("UPDATE bot_balance SET stars = stars + $1 WHERE id = 1", amount)
+
+    # ---- платежи ----
+
+    async def _insert_payment(self, conn, user_id, total_amount, currency, payload, charge_id) -> bool:
+        created_at = datetime.utcnow().isoformat()
+        payment_id = await conn.fetchval(
+            """
+            INSERT INTO payments (user_id, total_amount, currency, payload, created_at, charge_id)
+            VALUES ($1, $2, $3, $4, $5, $6)
+            ON CONFLICT (charge_id) WHERE charge_id IS NOT NULL DO NOTHING
+            RETURNING id
+            """,
+            user_id,
+            total_amount,
+            currency,
+            payload,
+            created_at,
+            charge_id,
+        )
+        if payment_id is None:
+            return False
+        await conn.execute(
+            """
+            INSERT INTO payment_daily (day, payload, currency, payments_count, total_amount)
+            VALUES ($1, $2, $3, 1, $4)
+            ON CONFLICT (day, payload, currency) DO UPDATE SET
+                payments_count = payment_daily.payments_count + 1,
+                total_amount = payment_daily.total_amount + excluded.total_amount
+            """,
+            created_at[:10],
+            payload,
+            currency,
+            total_amount,
+        )
+        return True
+
+    async def apply_payment(
+        self,
+        user_id: int,
+        total_amount: int,
+        currency: str,
+        payload: str,
+        charge_id: str | None,
+        attempts: int = 0,
+        bot_stars: int = 0,
+        task: tuple | None = None,
+    ) -> dict:
+        """
+        Один платёж — одна транзакция: пачек, как у SQLiteWriter, здесь нет.
+        """
+        async with self.transaction() as conn:
+            if not await self._insert_payment(conn, user_id, total_amount, currency, payload, charge_id):
+                return {"is_new": False, "user": None, "bot_stars": None}
+
+            user = None
+            if attempts:
+                user = dict(
+                    await conn.fetchrow(
+                        """
+                        INSERT INTO users (user_id, purchased_attempts) VALUES ($1, $2)
+                        ON CONFLICT (user_id) DO UPDATE SET
+                            purchased_attempts = users.purchased_attempts + excluded.purchased_attempts
+                        RETURNING *
+                        """,
+                        user_id,
+                        attempts,
+                    )
+                )
+            stars = None
+            if bot_stars:
+                stars = await conn.fetchval(
+                    "UPDATE bot_balance SET stars = stars + $1 WHERE id = 1 RETURNING stars", bot_stars
+                )
+            if task is not None:
+                await self._insert_task(conn, *task)
+        return {"is_new": True, "user": user, "bot_stars": stars}
+
+    async def get_user_payment_totals(self, user_id: int) -> list[dict]:
+        async with self.connection() as conn:
+            rows = await conn.fetch(
+                """
+                SELECT payload, currency, COUNT(*) AS payments_count, SUM(total_amount) AS total_amount
+                FROM payments
+                WHERE user_id = $1
+                GROUP BY payload, currency
+                ORDER BY total_amount DESC
+                """,
+                user_id,
+            )
+        return [dict(row) for row in rows]
+
+    async def get_period_payment_totals(self, since_day: str, until_day: str) -> list[dict]:
+        async with self.connection() as conn:
+            rows = await conn.fetch(
+                """
+                SELECT payload, currency, SUM(payments_count)::bigint AS payments_count,
+                       SUM(total_amount)::bigint AS total_amount
+                FROM payment_daily
+                WHERE day BETWEEN $1 AND $2
+                GROUP BY payload, currency
+                ORDER BY total_amount DESC
+                """,
+                since_day,
+                until_day,
+            )
+        return [dict(row) for row in rows]
+
+    # ---- игровая логика ----
+
+    async def play_attempt(self, user_id: int) -> dict:
+        """
+        Попытка игры под блокировкой строки пользователя (SELECT ... FOR UPDATE):
+        параллельные нажатия, в том числе из разных процессов, идут по очереди
+        и не тратят одну попытку дважды.
+        """
+        is_win = random.random() < self.win_chance
+        today = self.clock.today()
+
+        async with self.transaction() as conn:
+            user = await self._get_or_create_user_raw(conn, user_id, lock=True)
+
+            used = user["daily_attempts_used"] if user["last_attempt_date"] == today else 0
+            purchased = user["purchased_attempts"]
+            if used < self.daily_attempts:
+                used += 1
+            elif purchased > 0:
+                purchased -= 1
+            else:
+                return {"no_attempts": True, "is_win": None, "attempts_left": 0, "user": user}
+
+            user = dict(
+                await conn.fetchrow(
+                    """
+                    UPDATE users
+                    SET daily_attempts_used = $1,
+                        purchased_attempts = $2,
+                        last_attempt_date = $3,
+                        total_wins = total_wins + $4,
+                        wins_for_gift = wins_for_gift + $4
+                    WHERE user_id = $5
+                    RETURNING *
+                    """,
+                    used,
+                    purchased,
+                    today,
+                    int(is_win),
+                    user_id,
+                )
+            )
+
+        free_left_after = max(0, self.daily_attempts - user["daily_attempts_used"])
+        return {
+            "no_attempts": False,
+            "is_win": is_win,
+            "attempts_left": free_left_after + user["purchased_attempts"],
+            "user": user,
+        }
+
+    async def get_top_winners(self, limit: int = 10, offset: int = 0):
+        async with self.connection() as conn:
+            rows = await conn.fetch(
+                """
+                SELECT user_id, total_wins, gifts_count
+                FROM users
+                WHERE total_wins > 0
+                ORDER BY total_wins DESC, user_id
+                LIMIT $1 OFFSET $2
+                """,
+                limit,
+                offset,
+            )
+        return [dict(row) for row in rows]
+
+    async def get_user_rank(self, user_id: int):
+        async with self.connection() as conn:
+            row = await conn.fetchrow(
+                """
+                SELECT u.total_wins,
+                       (SELECT COUNT(*) FROM users
+                        WHERE total_wins > u.total_wins
+                           OR (total_wins = u.total_wins AND user_id < u.user_id)) + 1 AS rank
+                FROM users u
+                WHERE u.user_id = $1 AND u.total_wins > 0
+                """,
+                user_id,
+            )
+        if row is None:
+            return None
+        return {"rank": row["rank"], "total_wins": row["total_wins"]}
+
+    async def set_attempts_left(self, user_id: int, attempts_left: int):
+        async with self.connection() as conn:
+            await conn.execute(
+                """
+                UPDATE users
+                SET daily_attempts_used = $1,
+                    last_attempt_date = $2
+                WHERE user_id = $3
+                """,
+                self.daily_attempts - attempts_left,
+                self.clock.today(),
+                user_id,
+            )
+
+    async def add_purchased_attempts(self, user_id: int, attempts: int):
+        async with self.connection() as conn:
+            await conn.execute(
+                """
+                INSERT INTO users (user_id, purchased_attempts) VALUES ($1, $2)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    purchased_attempts = users.purchased_attempts + excluded.purchased_attempts
+                """,
+                user_id,
+                attempts,
+            )
+
+    # ---- сброс бесплатных попыток (DailyReset) ----
+
+    async def claim_daily_reset(self, day: str, now: float, lease: float):
+        async with self.transaction() as conn:
+            cursor = await conn.fetchval(
+                """
+                INSERT INTO daily_resets (day, cursor, users, started_at, updated_at) VALUES ($1, 0, 0, $2, $2)
+                ON CONFLICT (day) DO NOTHING
+                RETURNING cursor
+                """,
+                day,
+                now,
+            )
+            if cursor is not None:
+                return cursor
+            row = await conn.fetchrow(
+                "SELECT cursor, finished_at, updated_at FROM daily_resets WHERE day = $1 FOR UPDATE",
+                day,
+            )
+            if row["finished_at"] is not None or row["updated_at"] > now - lease:
+                return None
+            await conn.execute("UPDATE daily_resets SET updated_at = $1 WHERE day = $2", now, day)
+            return row["cursor"]
+
+    async def reset_daily_attempts_batch(self, day: str, after_user_id: int, limit: int) -> tuple:
+        now = time.time()
+        async with self.transaction() as conn:
+            upto = await conn.fetchval(
+                "SELECT MAX(user_id) FROM (SELECT user_id FROM users WHERE user_id > $1 ORDER BY user_id LIMIT $2) AS batch",
+                after_user_id,
+                limit,
+            )
+            if upto is None:
+                await conn.execute(
+                    "UPDATE daily_resets SET finished_at = $1, updated_at = $1 WHERE day = $2",
+                    now,
+                    day,
+                )
+                return None, 0
+
+            updated = affected(
+                await conn.execute(
+                    """
+                    UPDATE users
+                    SET daily_attempts_used = 0,
+                        last_attempt_date = $1
+                    WHERE user_id > $2 AND user_id <= $3
+                      AND daily_attempts_used <> 0
+                      AND last_attempt_date IS DISTINCT FROM $1
+                    """,
+                    day,
+                    after_user_id,
+                    upto,
+                )
+            )
+            await conn.execute(
+                "UPDATE daily_resets SET cursor = $1, users = users + $2, updated_at = $3 WHERE day = $4",
+                upto,
+                updated,
+                now,
+                day,
+            )
+        return upto, updated
+
+    # ---- БАНЫ ----
+
+    async def _load_bans(self):
+        async with self.connection() as conn:
+            # версию — до списка: бан между двумя запросами перечитаем в следующий раз
+            version = await conn.fetchval("SELECT version FROM bans_version WHERE id = 1")
+            rows = await conn.fetch("SELECT user_id FROM bans")
+        self._banned = {row["user_id"] for row in rows}
+        self._bans_version = version
+
+    async def refresh_bans(self) -> bool:
+        """
+        Перечитывает баны, если другой процесс поменял их после последней загрузки.
+        """
+        async with self.connection() as conn:
+            version = await conn.fetchval("SELECT version FROM bans_version WHERE id = 1")
+        if version == self._bans_version:
+            return False
+        await self._load_bans()
+        self._ban_reloads += 1
+        return True
+
+    async def ban_user(self, user_id: int, reason: str = "Без причины"):
+        async with self.transaction() as conn:
+            await conn.execute(
+                """
+                INSERT INTO bans (user_id, reason, banned_at) VALUES ($1, $2, $3)
+                ON CONFLICT (user_id) DO UPDATE SET reason = excluded.reason, banned_at = excluded.banned_at
+                """,
+                user_id,
+                reason,
+                datetime.utcnow().isoformat(),
+            )
+            await conn.execute("UPDATE bans_version SET version = version + 1 WHERE id = 1")
+        self._banned.add(user_id)
+
+    async def unban_user(self, user_id: int):
+        async with self.transaction() as conn:
+            await conn.execute("DELETE FROM bans WHERE user_id = $1", user_id)
+            await conn.execute("UPDATE bans_version SET version = version + 1 WHERE id = 1")
+        self._banned.discard(user_id)
+
+    def is_banned(self, user_id: int) -> bool:
+        if user_id in self._banned:
+            self._ban_hits += 1
+            return True
+        self._ban_misses += 1
+        return False
+
+    def ban_stats(self) -> dict:
+        return {
+            "banned": len(self._banned),
+            "hits": self._ban_hits,
+            "misses": self._ban_misses,
+            "reloads": self._ban_reloads,
+        }
+
+    # ---- служебное ----
+
+    async def pool_stats(self) -> dict:
+        acquired = self._acquired
+        size = self.pool.get_size() if self.pool else 0
+        idle = self.pool.get_idle_size() if self.pool else 0
+        return {
+            "size": self.pool_size,
+            "created": size,
+            "in_use": size - idle,
+            "idle": idle,
+            "acquired": acquired,
+            "waited": self._waited,
+            "wait_avg_ms": self._wait_total / acquired * 1000 if acquired else 0.0,
+            "wait_max_ms": self._wait_max * 1000,
+        }
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    # ---- ВЫВОД ПОДАРКОВ ----
+
+    async def reserve_withdrawal(
+        self, user_id: int, gift_id: str, cost_stars: int, wins_cost: int, key: str | None = None
+    ) -> dict:
+        """
+        Резерв звёзд бота и побед игрока одной транзакцией.
+
+        Общая строка у всех выводов одна — bot_balance. Она блокируется
+        условным UPDATE ... WHERE stars >= $1 (без SELECT ... FOR UPDATE
+        заранее) и держится до commit, то есть на одно обновление users:
+        это единственное место, где выводы идут по одному. Порядок блокировок
+        всегда withdrawals, bot_balance, users — выводы не ловят deadlock.
+        Повтор с тем же key упирается в уникальный индекс ещё до bot_balance
+        и возвращает существующий вывод, а не создаёт второй.
+        """
+
+        async def reserve(conn):
+            now = time.time()
+            withdrawal_id = await conn.fetchval(
+                """
+                INSERT INTO withdrawals
+                    (user_id, gift_id, cost_stars, wins_cost, status, idempotency_key, created_at, updated_at)
+                VALUES ($1, $2, $3, $4, 'reserved', $5, $6, $6)
+                ON CONFLICT (idempotency_key) WHERE idempotency_key IS NOT NULL DO NOTHING
+                RETURNING id
+                """,
+                user_id,
+                gift_id,
+                cost_stars,
+                wins_cost,
+                key,
+                now,
+            )
+            if withdrawal_id is None:
+                existing = await conn.fetchrow(
+                    "SELECT id, status FROM withdrawals WHERE idempotency_key = $1", key
+                )
+                raise Rollback(dict(existing))
+
+            stars = await conn.fetchval(
+                "UPDATE bot_balance SET stars = stars - $1 WHERE id = 1 AND stars >= $1 RETURNING stars",
+                cost_stars,
+            )
+            if stars is None:
+                raise Rollback({"error": "no_stars"})
+
+            if wins_cost:
+                status = await conn.execute(
+                    """
+                    UPDATE users SET wins_for_gift = wins_for_gift - $1
+                    WHERE user_id = $2 AND wins_for_gift >= $1
+                    """,
+                    wins_cost,
+                    user_id,
+                )
+                if not affected(status):
+                    raise Rollback({"error": "no_wins"})
+
+            return {"id": withdrawal_id, "status": "reserved"}
+
+        return await self._in_transaction(reserve)
+
+    async def mark_withdrawal_sending(self, withdrawal_id: int) -> bool:
+        async with self.connection() as conn:
+            return affected(
+                await conn.execute(
+                    "UPDATE withdrawals SET status = 'sending', updated_at = $1 WHERE id = $2 AND status = 'reserved'",
+                    time.time(),
+                    withdrawal_id,
+                )
+            ) == 1
+
+    async def commit_withdrawal(self, withdrawal_id: int):
+        async with self.transaction() as conn:
+            row = await conn.fetchrow(
+                """
+                UPDATE withdrawals SET status = 'sent', updated_at = $1
+                WHERE id = $2 AND status IN ('reserved', 'sending', 'unknown')
+                RETURNING user_id, wins_cost
+                """,
+                time.time(),
+                withdrawal_id,
+            )
+            if row and row["wins_cost"]:
+                await conn.execute(
+                    "UPDATE users SET gifts_count = gifts_count + 1 WHERE user_id = $1", row["user_id"]
+                )
+
+    async def _release_withdrawal(self, conn, withdrawal_id: int, statuses: tuple) -> bool:
+        row = await conn.fetchrow(
+            """
+            UPDATE withdrawals SET status = 'failed', updated_at = $1
+            WHERE id = $2 AND status = ANY($3::text[])
+            RETURNING user_id, cost_stars, wins_cost
+            """,
+            time.time(),
+            withdrawal_id,
+            list(statuses),
+        )
+        if row is None:
+            return False
+        await conn.execute("UPDATE bot_balance SET stars = stars + $1 WHERE id = 1", row["cost_stars"])
+        if row["wins_cost"]:
+            await conn.execute(
+                "UPDATE users SET wins_for_gift = wins_for_gift + $1 WHERE user_id = $2",
+                row["wins_cost"],
+                row["user_id"],
+            )
+        return True
+
+    async def rollback_withdrawal(self, withdrawal_id: int) -> bool:
+        async with self.transaction() as conn:
+            return await self._release_withdrawal(conn, withdrawal_id, ("reserved", "sending", "unknown"))
+
+    async def recover_withdrawals(self, older_than: float) -> dict:
+        async with self.transaction() as conn:
+            stale = await conn.fetch(
+                "SELECT id FROM withdrawals WHERE status = 'reserved' AND updated_at < $1", older_than
+            )
+            released = 0
+            for row in stale:
+                released += await self._release_withdrawal(conn, row["id"], ("reserved",))
+            unknown = affected(
+                await conn.execute(
+                    """
+                    UPDATE withdrawals SET status = 'unknown', updated_at = $1
+                    WHERE status = 'sending' AND updated_at < $2
+                    """,
+                    time.time(),
+                    older_than,
+                )
+            )
+        return {"released": released, "unknown": unknown}
+
+    async def withdrawal_stats(self) -> dict:
+        async with self.connection() as conn:
+            rows = await conn.fetch(
+                """
+                SELECT status, COUNT(*) AS cnt, SUM(cost_stars) AS stars
+                FROM withdrawals
+                WHERE status IN ('reserved', 'sending', 'unknown')
+                GROUP BY status
+                """
+            )
+        stats = {"reserved": 0, "sending": 0, "unknown": 0, "reserved_stars": 0}
+        for row in rows:
+            stats[row["status"]] = row["cnt"]
+            stats["reserved_stars"] += row["stars"] or 0
+        return stats
+
+    # ---- РАССЫЛКИ ----
+
+    async def create_broadcast(
+        self, admin_chat_id: int, text: str, owner: str | None = None, lease_until: float = 0
+    ) -> dict:
+        now = datetime.utcnow().isoformat()
+        async with self.connection() as conn:
+            row = await conn.fetchrow(
+                """
+                INSERT INTO broadcasts (admin_chat_id, text, total, owner, lease_until, created_at, updated_at)
+                VALUES ($1, $2, (SELECT COUNT(*) FROM users), $3, $4, $5, $5)
+                RETURNING *
+                """,
+                admin_chat_id,
+                text,
+                owner,
+                lease_until,
+                now,
+            )
+        return dict(row)
+
+    async def get_broadcasts(self, status: str = "running") -> list[dict]:
+        async with self.connection() as conn:
+            rows = await conn.fetch("SELECT * FROM broadcasts WHERE status = $1 ORDER BY id", status)
+        return [dict(row) for row in rows]
+
+    async def get_broadcast(self, broadcast_id: int):
+        async with self.connection() as conn:
+            row = await conn.fetchrow("SELECT * FROM broadcasts WHERE id = $1", broadcast_id)
+        return dict(row) if row else None
+
+    async def claim_broadcast(self, broadcast_id: int, owner: str, now: float, lease: float) -> bool:
+        async with self.connection() as conn:
+            result = await conn.execute(
+                """
+                UPDATE broadcasts SET owner = $1, lease_until = $2
+                WHERE id = $3 AND status = 'running'
+                  AND (owner IS NULL OR owner = $1 OR lease_until < $4)
+                """,
+                owner,
+                now + lease,
+                broadcast_id,
+                now,
+            )
+        return affected(result) > 0
+
+    async def release_broadcast(self, broadcast_id: int, owner: str):
+        async with self.connection() as conn:
+            await conn.execute(
+                "UPDATE broadcasts SET lease_until = 0 WHERE id = $1 AND owner = $2", broadcast_id, owner
+            )
+
+    async def save_broadcast_progress(
+        self,
+        broadcast_id: int,
+        last_user_id: int,
+        counters: dict,
+        status: str | None = None,
+        owner: str | None = None,
+        lease_until: float = 0,
+    ) -> bool:
+        async with self.connection() as conn:
+            result = await conn.execute(
+                """
+                UPDATE broadcasts
+                SET last_user_id = $1, sent = $2, blocked = $3, failed = $4, skipped = $5,
+                    status = COALESCE($6, status), lease_until = $7, updated_at = $8
+                WHERE id = $9 AND status = 'running' AND owner IS NOT DISTINCT FROM $10
+                """,
+                last_user_id,
+                counters["sent"],
+                counters["blocked"],
+                counters["failed"],
+                counters["skipped"],
+                status,
+                lease_until,
+                datetime.utcnow().isoformat(),
+                broadcast_id,
+                owner,
+            )
+        return affected(result) > 0
+
+    async def set_broadcast_status(self, broadcast_id: int, status: str) -> bool:
+        async with self.connection() as conn:
+            result = await conn.execute(
+                "UPDATE broadcasts SET status = $1, updated_at = $2 WHERE id = $3 AND status = 'running'",
+                status,
+                datetime.utcnow().isoformat(),
+                broadcast_id,
+            )
+        return affected(result) > 0
+
+    async def get_user_ids_after(self, after_user_id: int, limit: int = 500) -> list[int]:
+        async with self.connection() as conn:
+            rows = await conn.fetch(
+                "SELECT user_id FROM users WHERE user_id > $1 ORDER BY user_id LIMIT $2",
+                after_user_id,
+                limit,
+            )
+        return [row["user_id"] for row in rows]
+
+    # ---- МЕДИА ----
+
+    async def get_media_file_id(self, key: str):
+        async with self.connection() as conn:
+            return await conn.fetchval("SELECT file_id FROM media_cache WHERE key = $1", key)
+
+    async def set_media_file_id(self, key: str, file_id: str):
+        async with self.connection() as conn:
+            await conn.execute(
+                """
+                INSERT INTO media_cache (key, file_id, updated_at) VALUES ($1, $2, $3)
+                ON CONFLICT (key) DO UPDATE SET file_id = excluded.file_id, updated_at = excluded.updated_at
+                """,
+                key,
+                file_id,
+                datetime.utcnow().isoformat(),
+            )
+
+    async def delete_media_file_id(self, key: str):
+        async with self.connection() as conn:
+            await conn.execute("DELETE FROM media_cache WHERE key = $1", key)
+
+    # ---- ОТЛОЖЕННЫЕ ЗАДАЧИ ----
+
+    async def _insert_task(self, conn, kind: str, payload: dict, run_at: float) -> int:
+        return await conn.fetchval(
+            "INSERT INTO scheduled_tasks (kind, payload, run_at, created_at) VALUES ($1, $2, $3, $4) RETURNING id",
+            kind,
+            json.dumps(payload),
+            run_at,
+            datetime.utcnow().isoformat(),
+        )
+
+    async def schedule_task(self, kind: str, payload: dict, run_at: float) -> int:
+        async with self.connection() as conn:
+            return await self._insert_task(conn, kind, payload, run_at)
+
+    async def claim_due_tasks(self, now: float, limit: int, lease: float, max_attempts: int) -> list[dict]:
+        """
+        SKIP LOCKED: воркеры разных процессов забирают разные задачи, не ожидая друг друга.
+        Созревшие и брошенные (reclaimed) задачи выбираются отдельно, каждая
+        ветка — по своему индексу.
+        """
+        async with self.transaction() as conn:
+            await conn.execute(
+                """
+                UPDATE scheduled_tasks
+                SET status = 'failed', last_error = 'аренда истекла, попытки исчерпаны'
+                WHERE status = 'running' AND locked_until < $1 AND attempts >= $2
+                """,
+                now,
+                max_attempts,
+            )
+            rows = await conn.fetch(
+                """
+                WITH claimed AS (
+                    (
+                        SELECT id, FALSE AS reclaimed FROM scheduled_tasks
+                        WHERE status = 'pending' AND run_at <= $1
+                        ORDER BY run_at
+                        LIMIT $3
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    UNION ALL
+                    (
+                        SELECT id, TRUE FROM scheduled_tasks
+                        WHERE status = 'running' AND locked_until < $1
+                        ORDER BY locked_until
+                        LIMIT $3
+                        FOR UPDATE SKIP LOCKED
+                    )
+                )
+                UPDATE scheduled_tasks AS t
+                SET status = 'running',
+                    locked_until = $2,
+                    attempts = t.attempts + 1
+                FROM claimed
+                WHERE t.id = claimed.id
+                RETURNING t.id, t.kind, t.payload, t.attempts, claimed.reclaimed
+                """,
+                now,
+                now + lease,
+                limit,
+            )
+        return [
+            {
+                "id": row["id"],
+                "kind": row["kind"],
+                "payload": json.loads(row["payload"]),
+                "attempts": row["attempts"],
+                "reclaimed": row["reclaimed"],
+            }
+            for row in rows
+        ]
+
+    async def complete_task(self, task_id: int, next_task: tuple | None = None):
+        async with self.transaction() as conn:
+            await conn.execute("DELETE FROM scheduled_tasks WHERE id = $1", task_id)
+            if next_task:
+                await self._insert_task(conn, *next_task)
+
+    async def fail_task(self, task_id: int, error: str, retry_at: float | None):
+        async with self.connection() as conn:
+            await conn.execute(
+                """
+                UPDATE scheduled_tasks
+                SET status = CASE WHEN $1::double precision IS NULL THEN 'failed' ELSE 'pending' END,
+                    run_at = COALESCE($1, run_at),
+                    last_error = $2
+                WHERE id = $3
+                """,
+                retry_at,
+                error,
+                task_id,
+            )
+
+    async def next_task_run_at(self):
+        async with self.connection() as conn:
+            return await conn.fetchval("SELECT MIN(run_at) FROM scheduled_tasks WHERE status = 'pending'")
+
+    # ---- СОСТОЯНИЯ ДИАЛОГОВ (FSM) ----
+
+    async def fsm_get(self, key: str, now: float):
+        async with self.connection() as conn:
+            row = await conn.fetchrow(
+                "SELECT state, data FROM fsm_state WHERE key = $1 AND expires_at > $2", key, now
+            )
+        if row is None:
+            return None
+        return row["state"], json.loads(row["data"])
+
+    async def fsm_set_state(self, key: str, state: str | None, expires_at: float):
+        async with self.transaction() as conn:
+            if state is None:
+                await conn.execute("DELETE FROM fsm_state WHERE key = $1 AND data = '{}'", key)
+                await conn.execute("UPDATE fsm_state SET state = NULL WHERE key = $1", key)
+                return
+            await conn.execute(
+                """
+                INSERT INTO fsm_state (key, state, expires_at) VALUES ($1, $2, $3)
+                ON CONFLICT (key) DO UPDATE SET
+                    state = excluded.state,
+                    expires_at = excluded.expires_at,
+                    data = CASE WHEN fsm_state.expires_at > $4 THEN fsm_state.data ELSE '{}' END
+                """,
+                key,
+                state,
+                expires_at,
+                time.time(),
+            )
+
+    async def fsm_set_data(self, key: str, data: dict, expires_at: float):
+        async with self.transaction() as conn:
+            if not data:
+                await conn.execute("DELETE FROM fsm_state WHERE key = $1 AND state IS NULL", key)
+                await conn.execute("UPDATE fsm_state SET data = '{}' WHERE key = $1", key)
+                return
+            await conn.execute(
+                """
+                INSERT INTO fsm_state (key, data, expires_at) VALUES ($1, $2, $3)
+                ON CONFLICT (key) DO UPDATE SET
+                    data = excluded.data,
+                    expires_at = excluded.expires_at,
+                    state = CASE WHEN fsm_state.expires_at > $4 THEN fsm_state.state END
+                """,
+                key,
+                json.dumps(data, ensure_ascii=False),
+                expires_at,
+                time.time(),
+            )
+
+    async def fsm_purge(self, now: float) -> int:
+        async with self.connection() as conn:
+            return affected(await conn.execute("DELETE FROM fsm_state WHERE expires_at <= $1", now))
+
+    # ---- ПРОМОКОДЫ ----
+
+    async def create_promo(self, code: str, reward_wins: int, one_time: int):
+        async with self.connection() as conn:
+            await conn.execute(
+                """
+                INSERT INTO promo_codes (code, reward_wins, one_time) VALUES ($1, $2, $3)
+                ON CONFLICT (code) DO UPDATE SET reward_wins = excluded.reward_wins, one_time = excluded.one_time
+                """,
+                code,
+                reward_wins,
+                one_time,
+            )
+
+    async def _insert_promos(self, conn, promos: list[tuple]) -> int:
+        # одна команда на всю пачку: массивы разворачиваются через unnest
+        codes, rewards, one_times = zip(*promos)
+        return affected(
+            await conn.execute(
+                """
+                INSERT INTO promo_codes (code, reward_wins, one_time)
+                SELECT * FROM unnest($1::text[], $2::int[], $3::int[])
+                ON CONFLICT (code) DO NOTHING
+                """,
+                list(codes),
+                list(rewards),
+                list(one_times),
+            )
+        )
+
+    async def create_promos_batch(self, promos: list[tuple]) -> bool:
+        async def insert(conn):
+            if await self._insert_promos(conn, promos) != len(promos):
+                raise Rollback(False)
+            return True
+
+        return await self._in_transaction(insert)
+
+    async def import_promos_batch(self, promos: list[tuple]) -> int:
+        if not promos:
+            return 0
+        async with self.connection() as conn:
+            return await self._insert_promos(conn, promos)
+
+    async def get_promos_page(self, after_code: str = "", limit: int = 1000) -> list[tuple]:
+        async with self.connection() as conn:
+            rows = await conn.fetch(
+                "SELECT code, reward_wins, one_time FROM promo_codes WHERE code > $1 ORDER BY code LIMIT $2",
+                after_code,
+                limit,
+            )
+        return [tuple(row) for row in rows]
+
+    async def get_promo(self, code: str):
+        async with self.connection() as conn:
+            row = await conn.fetchrow("SELECT reward_wins, one_time FROM promo_codes WHERE code = $1", code)
+        return (row["reward_wins"], row["one_time"]) if row else None
+
+    async def redeem_promo(self, user_id: int, code: str) -> dict:
+        """
+        Строка кода блокируется (FOR UPDATE): вторая активация одноразового
+        кода дождётся первой и увидит, что кода уже нет.
+        """
+
+        async def redeem(conn):
+            promo = await conn.fetchrow(
+                "SELECT reward_wins, one_time FROM promo_codes WHERE code = $1 FOR UPDATE", code
+            )
+            if promo is None:
+                raise Rollback({"error": "not_found"})
+
+            inserted = affected(
+                await conn.execute(
+                    "INSERT INTO promo_used (user_id, code) VALUES ($1, $2) ON CONFLICT DO NOTHING",
+                    user_id,
+                    code,
+                )
+            )
+            if not inserted:
+                raise Rollback({"error": "used"})
+
+            if promo["one_time"]:
+                await conn.execute("DELETE FROM promo_codes WHERE code = $1", code)
+
+            wins = await conn.fetchval(
+                """
+                INSERT INTO users (user_id, wins_for_gift) VALUES ($1, $2)
+                ON CONFLICT (user_id) DO UPDATE SET wins_for_gift = users.wins_for_gift + excluded.wins_for_gift
+                RETURNING wins_for_gift
+                """,
+                user_id,
+                promo["reward_wins"],
+            )
+            return {
+                "reward": promo["reward_wins"],
+                "one_time": promo["one_time"],
+                "wins_for_gift": wins,
+            }
+
+        return await self._in_transaction(redeem)
@@ -0,0 +1,187 @@
+import copy
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+
+# ================== ХРАНИЛИЩА FSM ==================
+
+
+def state_name(state: StateType) -> Optional[str]:
+    return state.state if isinstance(state, State) else state
+
+
+class LRUStorage(BaseStorage):
+    """
+    FSM-хранилище в памяти с ограничением размера и TTL.
+
+    Держит не больше max_keys диалогов: самые давние вытесняются.
+    Запись, которую не трогали ttl секунд, считается пустой.
+    Подходит для одного процесса — после рестарта состояния теряются.
+    """
+
+    def __init__(self, max_keys: int = 10_000, ttl: float = 3600, key_builder: KeyBuilder | None = None):
+        self.max_keys = max_keys
+        self.ttl = ttl
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True)
+
+        # ключ -> [state, data, expires_at]
+        self._records: OrderedDict[str, list] = OrderedDict()
+
+        self.evicted = 0
+        self.expired = 0
+
+    def _get(self, key: StorageKey) -> list | None:
+        name = self.key_builder.build(key)
+        record = self._records.get(name)
+        if record is None:
+            return None
+        if record[2] <= time.monotonic():
+            del self._records[name]
+            self.expired += 1
+            return None
+        return record
+
+    def _put(self, key: StorageKey, state: Optional[str], data: Dict[str, Any]):
+        name = self.key_builder.build(key)
+        if state is None and not data:
+            self._records.pop(name, None)
+            return
+        self._records[name] = [state, data, time.monotonic() + self.ttl]
+        self._records.move_to_end(name)
+        while len(self._records) > self.max_keys:
+            self._records.popitem(last=False)
+            self.evicted += 1
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = self._get(key)
+        self._put(key, state_name(state), record[1] if record else {})
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = self._get(key)
+        return record[0] if record else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        record = self._get(key)
+        self._put(key, record[0] if record else None, copy.deepcopy(data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = self._get(key)
+        return copy.deepcopy(record[1]) if record else {}
+
+    async def close(self) -> None:
+        self._records.clear()
+
+    def stats(self) -> dict:
+        return {
+            "backend": "memory",
+            "keys": len(self._records),
+            "evicted": self.evicted,
+            "expired": self.expired,
+        }
+
+
+class DBStorage(BaseStorage):
+    """
+    FSM-хранилище в таблице fsm_state (sqlite или PostgreSQL — через методы db.fsm_*).
+
+    Состояния переживают рестарт и общие для всех webhook-воркеров.
+    Запись живёт ttl секунд с последнего изменения; истёкшие строки
+    удаляются не чаще раза в purge_interval секунд.
+    Соединения принадлежат DB, поэтому close() их не трогает.
+
+    aiogram читает состояние на каждом апдейте, ещё до антиспама, а у
+    почти всех игроков его нет. Поэтому прочитанное (и "записи нет")
+    держится в памяти cache_ttl секунд, не больше cache_size ключей;
+    свои записи сбрасывают кэш ключа сразу. Изменения из других
+    процессов видны через cache_ttl — при нескольких воркерах без
+    привязки пользователя к воркеру ставьте cache_ttl=0.
+    """
+
+    def __init__(
+        self,
+        db,
+        ttl: float = 3600,
+        purge_interval: float = 600,
+        key_builder: KeyBuilder | None = None,
+        cache_ttl: float = 5.0,
+        cache_size: int = 10_000,
+    ):
+        self.db = db
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True)
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+
+        # ключ -> (запись или None, когда перечитать)
+        self._cache: OrderedDict[str, tuple] = OrderedDict()
+        # растёт после каждой своей записи: чтение, начатое до её конца, в кэш не кладём
+        self._writes = 0
+
+        self._purged_at = 0.0
+        self.purged = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    async def _maybe_purge(self):
+        now = time.time()
+        if now - self._purged_at >= self.purge_interval:
+            self._purged_at = now
+            self.purged += await self.db.fsm_purge(now)
+
+    async def _record(self, name: str):
+        cached = self._cache.get(name)
+        if cached is not None and cached[1] > time.monotonic():
+            self.cache_hits += 1
+            return cached[0]
+
+        self.cache_misses += 1
+        writes = self._writes
+        record = await self.db.fsm_get(name, time.time())
+        if self.cache_ttl > 0 and writes == self._writes:
+            self._cache[name] = (record, time.monotonic() + self.cache_ttl)
+            self._cache.move_to_end(name)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return record
+
+    def _forget(self, name: str):
+        self._writes += 1
+        self._cache.pop(name, None)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        name = self.key_builder.build(key)
+        await self.db.fsm_set_state(name, state_name(state), time.time() + self.ttl)
+        self._forget(name)
+        await self._maybe_purge()
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = await self._record(self.key_builder.build(key))
+        return record[0] if record else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        name = self.key_builder.build(key)
+        await self.db.fsm_set_data(name, data, time.time() + self.ttl)
+        self._forget(name)
+        await self._maybe_purge()
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = await self._record(self.key_builder.build(key))
+        # копия: FSMContext.update_data меняет полученный словарь
+        return copy.deepcopy(record[1]) if record else {}
+
+    async def close(self) -> None:
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        return {
+            "backend": "db",
+            "purged": self.purged,
+            "cached": len(self._cache),
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+        }
@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, LabeledPrice
+
+
+# ================== ССЫЛКИ НА ОПЛАТУ ==================
+
+
+class InvoiceCatalog:
+    """
+    Ссылки на оплату (createInvoiceLink) вместо sendInvoice на каждое нажатие.
+
+    Ссылка не привязана к пользователю — кто заплатил, Telegram сообщит
+    в successful_payment, — поэтому одна ссылка на пакет годится всем.
+    Фиксированные пакеты (add) создаются при старте (prepare) и живут ttl
+    секунд; кнопка с такой ссылкой (button) открывает оплату сразу,
+    без callback и без запросов бота к Telegram. Ссылки на произвольные
+    суммы лежат в LRU на max_custom штук.
+
+    Если ссылку создать не удалось, send шлёт обычный sendInvoice.
+    """
+
+    def __init__(self, ttl: float = 24 * 3600, max_custom: int = 256):
+        self.ttl = ttl
+        self.max_custom = max_custom
+
+        # ключ -> параметры createInvoiceLink / sendInvoice
+        self._packages: dict[str, dict] = {}
+        # ключ -> (ссылка, когда создана)
+        self._links: dict[str, tuple[str, float]] = {}
+        self._custom: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self._locks: dict[str, asyncio.Lock] = {}
+
+        self.created = 0
+        self.hits = 0
+        self.failed = 0
+        self.evicted = 0
+
+    @staticmethod
+    def invoice(title: str, description: str, payload: str, label: str, amount: int) -> dict:
+        """
+        Параметры счёта в Stars (XTR): одна позиция label на amount звёзд.
+        """
+        return {
+            "title": title,
+            "description": description,
+            "payload": payload,
+            "currency": "XTR",
+            "prices": [LabeledPrice(label=label, amount=amount)],
+            "provider_token": "",
+        }
+
+    def add(self, key: str, invoice: dict):
+        self._packages[key] = invoice
+
+    def url(self, key: str) -> str | None:
+        """
+        Свежая ссылка фиксированного пакета или None (тогда кнопка — callback).
+        """
+        cached = self._links.get(key)
+        if cached is not None and time.monotonic() - cached[1] < self.ttl:
+            return cached[0]
+        return None
+
+    def button(self, text: str, key: str, callback_data: str) -> InlineKeyboardButton:
+        url = self.url(key)
+        if url is not None:
+            return InlineKeyboardButton(text=text, url=url)
+        return InlineKeyboardButton(text=text, callback_data=callback_data)
+
+    async def prepare(self, bot: Bot):
+        """
+        Создаёт ссылки всех фиксированных пакетов. Ошибки не мешают старту —
+        такие пакеты останутся callback-кнопками до первого нажатия.
+        """
+        results = await asyncio.gather(
+            *(self.link(bot, key) for key in self._packages), return_exceptions=True
+        )
+        for key, result in zip(self._packages, results):
+            if isinstance(result, Exception):
+                logging.warning("Не удалось создать ссылку на оплату %s: %s", key, result)
+
+    # ---- получение ссылок ----
+
+    async def link(self, bot: Bot, key: str) -> str:
+        url = self.url(key)
+        if url is not None:
+            self.hits += 1
+            return url
+        async with self._locks.setdefault(key, asyncio.Lock()):
+            # пока ждали, ссылку мог создать другой вызов
+            url = self.url(key)
+            if url is None:
+                url = await self._create(bot, self._packages[key])
+                self._links[key] = (url, time.monotonic())
+            else:
+                self.hits += 1
+        return url
+
+    async def custom_link(self, bot: Bot, key: str, invoice: dict) -> str:
+        cached = self._custom.get(key)
+        if cached is not None and time.monotonic() - cached[1] < self.ttl:
+            self.hits += 1
+            self._custom.move_to_end(key)
+            return cached[0]
+        url = await self._create(bot, invoice)
+        self._custom[key] = (url, time.monotonic())
+        self._custom.move_to_end(key)
+        while len(self._custom) > self.max_custom:
+            self._custom.popitem(last=False)
+            self.evicted += 1
+        return url
+
+    async def _create(self, bot: Bot, invoice: dict) -> str:
+        try:
+            url = await bot.create_invoice_link(**invoice)
+        except TelegramAPIError:
+            self.failed += 1
+            raise
+        self.created += 1
+        return url
+
+    # ---- отправка ----
+
+    async def send(self, bot: Bot, chat_id: int, key: str, text: str, invoice: dict | None = None):
+        """
+        Сообщение text с кнопкой оплаты. key из add — фиксированный пакет,
+        иначе нужен invoice, и ссылка на него ложится в LRU.
+        """
+        fixed = key in self._packages
+        params = self._packages[key] if fixed else invoice
+        try:
+            if fixed:
+                url = await self.link(bot, key)
+            else:
+                url = await self.custom_link(bot, key, invoice)
+        except TelegramAPIError as e:
+            logging.warning("Ссылка на оплату %s недоступна, шлём счёт: %s", key, e)
+            await bot.send_invoice(chat_id=chat_id, **params)
+            return
+
+        amount = params["prices"][0].amount
+        await bot.send_message(
+            chat_id,
+            text,
+            reply_markup=InlineKeyboardMarkup(
+                inline_keyboard=[[InlineKeyboardButton(text=f"Оплатить {amount}⭐", url=url)]]
+            ),
+        )
+
+    def stats(self) -> dict:
+        return {
+            "packages": len(self._links),
+            "custom": len(self._custom),
+            "created": self.created,
+            "hits": self.hits,
+            "failed": self.failed,
+            "evicted": self.evicted,
+        }
@@ -0,0 +1,77 @@
+import time
+from typing import Callable
+
+
+# ================== ТОП ПО ПОБЕДАМ ==================
+
+
+class Leaderboard:
+    """
+    Кэш готового текста топа.
+
+    Текст строится один раз и сбрасывается, только когда состав или цифры
+    топа могли измениться: победа игрока из топа, победа, которая дотягивает
+    до последнего места, или подарок у игрока из топа.
+    ttl — страховка на случай изменений из другого процесса.
+    """
+
+    def __init__(self, db, render: Callable[[list], str], size: int = 10, ttl: float = 60):
+        self.db = db
+        self.render = render
+        self.size = size
+        self.ttl = ttl
+
+        self._text: str | None = None
+        self._user_ids: set[int] = set()
+        self._threshold = 0  # победы последнего места в топе
+        self._last_user_id = 0  # и его user_id: при равных победах выше меньший
+        self._full = False  # в топе уже size игроков
+        self._built_at = 0.0
+
+        self.hits = 0
+        self.rebuilds = 0
+
+    def invalidate(self):
+        self._text = None
+
+    async def top_text(self) -> str:
+        if self._text is not None and time.monotonic() - self._built_at < self.ttl:
+            self.hits += 1
+            return self._text
+
+        rows = await self.db.get_top_winners(limit=self.size)
+        self._user_ids = {row["user_id"] for row in rows}
+        self._full = len(rows) >= self.size
+        self._threshold = rows[-1]["total_wins"] if rows else 0
+        self._last_user_id = rows[-1]["user_id"] if rows else 0
+        self._text = self.render(rows)
+        self._built_at = time.monotonic()
+        self.rebuilds += 1
+        return self._text
+
+    def on_win(self, user_id: int, total_wins: int):
+        if self._text is None:
+            return
+        if user_id in self._user_ids or not self._full:
+            self.invalidate()
+        elif total_wins > self._threshold or (
+            total_wins == self._threshold and user_id < self._last_user_id
+        ):
+            self.invalidate()
+
+    def on_gift(self, user_id: int):
+        if user_id in self._user_ids:
+            self.invalidate()
+
+    async def page(self, page: int, per_page: int | None = None) -> list:
+        """
+        Страница топа, page начинается с 1.
+        """
+        per_page = per_page or self.size
+        return await self.db.get_top_winners(limit=per_page, offset=(page - 1) * per_page)
+
+    async def rank(self, user_id: int):
+        return await self.db.get_user_rank(user_id)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "rebuilds": self.rebuilds}
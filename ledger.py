@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta
+
+
+# ================== ЖУРНАЛ ПЛАТЕЖЕЙ ==================
+
+
+class PaymentLedger:
+    """
+    Журнал платежей.
+
+    apply() применяет успешный платёж одной транзакцией базы: запись
+    в журнале, купленные попытки, звёзды бота и отложенная задача либо
+    записываются все вместе, либо не записывается ничего. Повтор того же
+    telegram_payment_charge_id ничего не начисляет второй раз.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+        self.recorded = 0
+        self.duplicates = 0
+
+    async def apply(
+        self,
+        user_id: int,
+        total_amount: int,
+        currency: str,
+        payload: str,
+        charge_id: str | None = None,
+        attempts: int = 0,
+        bot_stars: int = 0,
+        task: tuple | None = None,
+    ) -> dict:
+        """
+        {"is_new": False, ...} — платёж уже был применён раньше.
+        Иначе user — строка пользователя после начисления попыток (если они были),
+        bot_stars — баланс бота после начисления (если оно было).
+        """
+        result = await self.db.apply_payment(
+            user_id, total_amount, currency, payload, charge_id, attempts, bot_stars, task
+        )
+        if result["is_new"]:
+            self.recorded += 1
+        else:
+            self.duplicates += 1
+        return result
+
+    # ---- отчёты ----
+
+    async def user_totals(self, user_id: int) -> list[dict]:
+        return await self.db.get_user_payment_totals(user_id)
+
+    async def period_totals(self, days: int) -> list[dict]:
+        """
+        Суммы за последние days дней, включая сегодня (по UTC).
+        """
+        until = datetime.utcnow().date()
+        since = until - timedelta(days=max(1, days) - 1)
+        return await self.db.get_period_payment_totals(since.isoformat(), until.isoformat())
+
+    def stats(self) -> dict:
+        return {
+            "recorded": self.recorded,
+            "duplicates": self.duplicates,
+        }
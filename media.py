@@ -0,0 +1,146 @@
+import asyncio
+import logging
+from pathlib import Path
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, Message
+
+
+# ================== КЭШ МЕДИА ==================
+
+# вид медиа -> (метод Bot, имя аргумента с файлом)
+SEND_METHODS = {
+    "photo": ("send_photo", "photo"),
+    "sticker": ("send_sticker", "sticker"),
+    "animation": ("send_animation", "animation"),
+    "document": ("send_document", "document"),
+}
+
+# ответы Telegram, после которых file_id больше не годится; остальные
+# BadRequest (подпись, клавиатура, чат) к файлу отношения не имеют
+STALE_FILE_ERRORS = (
+    "wrong file identifier",
+    "wrong remote file identifier",
+    "file reference expired",
+    "file_reference_expired",
+    "wrong padding",
+    "can't use file of type",
+)
+
+
+def is_stale_file_id(error: TelegramBadRequest) -> bool:
+    text = error.message.lower()
+    return any(marker in text for marker in STALE_FILE_ERRORS)
+
+
+def extract_file_id(kind: str, message: Message) -> str | None:
+    if kind == "photo":
+        return message.photo[-1].file_id if message.photo else None
+    media = getattr(message, kind, None)
+    return media.file_id if media else None
+
+
+class MediaCache:
+    """
+    Загружает каждый файл в Telegram один раз и дальше шлёт по file_id.
+
+    file_id хранится в памяти и в таблице media_cache, поэтому переживает
+    рестарт. В ключ кэша входят размер и время изменения файла: заменили
+    картинку на диске — загрузим новую, а не пошлём старый file_id.
+    Если Telegram отверг сам file_id (STALE_FILE_ERRORS) — забываем его и
+    загружаем файл заново; прочие ошибки пробрасываются.
+
+        await media.send(bot, chat_id, "photo", "cat", "cat.jpg", caption="...")
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._file_ids: dict[str, str] = {}
+        self._locks: dict[str, asyncio.Lock] = {}
+        # key -> последний ключ кэша с версией файла, чтобы убрать прежний
+        self._versions: dict[str, str] = {}
+        self.uploads = 0
+        self.reused = 0
+        self.stale = 0
+
+    async def _get_file_id(self, key: str) -> str | None:
+        file_id = self._file_ids.get(key)
+        if file_id is None:
+            file_id = await self.db.get_media_file_id(key)
+            if file_id:
+                self._file_ids[key] = file_id
+        return file_id
+
+    async def _forget(self, key: str):
+        self._file_ids.pop(key, None)
+        await self.db.delete_media_file_id(key)
+
+    async def _cache_key(self, key: str, path: str) -> str:
+        try:
+            stat = Path(path).stat()
+        except FileNotFoundError:
+            raise FileNotFoundError(path) from None
+        cache_key = f"{key}:{stat.st_size}:{stat.st_mtime_ns}"
+        previous = self._versions.get(key)
+        if previous != cache_key:
+            self._versions[key] = cache_key
+            if previous is not None:
+                # файл поменялся на ходу — старый file_id больше не нужен
+                await self._forget(previous)
+        return cache_key
+
+    async def send(
+        self,
+        bot: Bot,
+        chat_id: int,
+        kind: str,
+        key: str,
+        path: str,
+        **kwargs,
+    ) -> Message:
+        """
+        Отправляет медиа kind ("photo", "sticker", ...) из файла path.
+        key — имя в кэше. Если файла нет — FileNotFoundError.
+        """
+        method_name, arg = SEND_METHODS[kind]
+        send = getattr(bot, method_name)
+        key = await self._cache_key(key, path)
+
+        file_id = await self._get_file_id(key)
+        if file_id:
+            try:
+                message = await send(chat_id=chat_id, **{arg: file_id}, **kwargs)
+                self.reused += 1
+                return message
+            except TelegramBadRequest as e:
+                if not is_stale_file_id(e):
+                    raise
+                logging.warning("file_id для %s устарел, загружаем заново: %s", key, e)
+                self.stale += 1
+                await self._forget(key)
+
+        # один аплоад на ключ, даже если победили сразу несколько игроков
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            file_id = self._file_ids.get(key)
+            if file_id:
+                self.reused += 1
+                return await send(chat_id=chat_id, **{arg: file_id}, **kwargs)
+
+            message = await send(chat_id=chat_id, **{arg: FSInputFile(path)}, **kwargs)
+            self.uploads += 1
+
+            file_id = extract_file_id(kind, message)
+            if file_id:
+                self._file_ids[key] = file_id
+                await self.db.set_media_file_id(key, file_id)
+            return message
+
+    def stats(self) -> dict:
+        return {
+            "cached": len(self._file_ids),
+            "uploads": self.uploads,
+            "reused": self.reused,
+            "stale": self.stale,
+        }
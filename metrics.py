@@ -0,0 +1,195 @@
+import bisect
+import contextvars
+import time
+from collections import deque
+from typing import Callable
+
+from aiohttp import web
+
+
+# ================== МЕТРИКИ ==================
+
+# секунды: от 1 мс до 5 с
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# штуки: SQL-запросов на апдейт
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+# счётчики текущего апдейта: None — вне апдейта (фоновые задачи),
+# False — апдейт не попал в выборку, dict — попал
+update_stats: contextvars.ContextVar = contextvars.ContextVar("update_stats", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последний — +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape_label(value)}"' for key, value in labels) + "}"
+
+
+class Metrics:
+    """
+    Метрики процесса в формате Prometheus.
+
+    Гистограммы и счётчики пишутся только из event loop (без блокировок).
+    Коллекторы — функции stats() сервисов: их числовые поля отдаются
+    как gauge bot_<имя>_<поле> при каждом запросе /metrics.
+    Медленные вызовы базы (дольше slow_ms) сохраняются вместе с SQL —
+    последние slow_samples штук, отдаются на /metrics/slow.
+    """
+
+    def __init__(self, prefix: str = "bot", slow_ms: float = 100, slow_samples: int = 50):
+        self.prefix = prefix
+        self.slow_ms = slow_ms
+
+        self._histograms: dict[str, dict[tuple, Histogram]] = {}
+        self._buckets: dict[str, tuple] = {}
+        self._counters: dict[str, dict[tuple, float]] = {}
+        self._help: dict[str, str] = {}
+        self._collectors: list[tuple[str, Callable[[], dict]]] = []
+        self.slow = deque(maxlen=slow_samples)
+
+        self.histogram("handler_seconds", "Время хендлера")
+        self.histogram("callback_seconds", "Время обработки callback-кнопки")
+        self.counter("handler_errors_total", "Исключения в хендлерах")
+        self.histogram("update_db_queries", "SQL-запросов на апдейт", COUNT_BUCKETS)
+        self.histogram("update_db_seconds", "Время в базе на апдейт")
+        self.histogram("db_call_seconds", "Время метода базы")
+        self.counter("db_queries_total", "SQL-запросов по методам базы")
+
+    def histogram(self, name: str, help_text: str, buckets: tuple = LATENCY_BUCKETS):
+        self._histograms.setdefault(name, {})
+        self._buckets[name] = buckets
+        self._help[name] = help_text
+
+    def counter(self, name: str, help_text: str):
+        self._counters.setdefault(name, {})
+        self._help[name] = help_text
+
+    def observe(self, name: str, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        series = self._histograms[name]
+        hist = series.get(key)
+        if hist is None:
+            hist = series[key] = Histogram(self._buckets[name])
+        hist.observe(value)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        series = self._counters[name]
+        series[key] = series.get(key, 0) + value
+
+    def collect(self, name: str, stats: Callable[[], dict]):
+        self._collectors.append((name, stats))
+
+    def db_call(self, method: str, seconds: float, statements: list[str]):
+        """
+        Вызов метода базы: в метрики метода, в счётчики текущего апдейта
+        и, если он долгий, в образцы медленных вызовов.
+        """
+        self.observe("db_call_seconds", seconds, method=method)
+        self.inc("db_queries_total", len(statements), method=method)
+        if seconds * 1000 >= self.slow_ms:
+            self.slow_call(method, seconds, statements)
+        stats = update_stats.get()
+        if stats:
+            stats["queries"] += len(statements)
+            stats["db_seconds"] += seconds
+
+    def slow_call(self, method: str, seconds: float, statements: list[str]):
+        self.slow.append(
+            {
+                "at": time.time(),
+                "method": method,
+                "ms": round(seconds * 1000, 2),
+                "statements": [" ".join(sql.split())[:300] for sql in statements[:10]],
+            }
+        )
+
+    # ---- вывод ----
+
+    def render(self) -> str:
+        lines = []
+        for name, series in self._histograms.items():
+            full = f"{self.prefix}_{name}"
+            lines.append(f"# HELP {full} {self._help[name]}")
+            lines.append(f"# TYPE {full} histogram")
+            for key, hist in series.items():
+                cumulative = 0
+                for bound, count in zip(self._buckets[name] + ("+Inf",), hist.counts):
+                    cumulative += count
+                    lines.append(f"{full}_bucket{format_labels(key + (('le', bound),))} {cumulative}")
+                lines.append(f"{full}_sum{format_labels(key)} {hist.sum}")
+                lines.append(f"{full}_count{format_labels(key)} {hist.count}")
+
+        for name, series in self._counters.items():
+            full = f"{self.prefix}_{name}"
+            lines.append(f"# HELP {full} {self._help[name]}")
+            lines.append(f"# TYPE {full} counter")
+            for key, value in series.items():
+                lines.append(f"{full}{format_labels(key)} {value}")
+
+        for name, stats in self._collectors:
+            for field, value in stats().items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                full = f"{self.prefix}_{name}_{field}"
+                lines.append(f"# TYPE {full} gauge")
+                lines.append(f"{full} {value}")
+        return "\n".join(lines) + "\n"
+
+
+# ================== HTTP ДЛЯ PROMETHEUS ==================
+
+
+class MetricsServer:
+    """
+    Отдельный aiohttp-сервер: GET /metrics (текстовый формат Prometheus)
+    и GET /metrics/slow (медленные вызовы базы, JSON). Слушать стоит
+    только локальный адрес — наружу метрики не нужны.
+    """
+
+    def __init__(self, metrics: Metrics, host: str = "127.0.0.1", port: int = 0):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self._runner: web.AppRunner | None = None
+
+    def build_app(self) -> web.Application:
+        async def metrics_handler(request: web.Request) -> web.Response:
+            return web.Response(text=self.metrics.render(), content_type="text/plain", charset="utf-8")
+
+        async def slow_handler(request: web.Request) -> web.Response:
+            return web.json_response(list(self.metrics.slow))
+
+        app = web.Application()
+        app.router.add_get("/metrics", metrics_handler)
+        app.router.add_get("/metrics/slow", slow_handler)
+        return app
+
+    async def start(self):
+        if self._runner is not None or not self.port:
+            return
+        self._runner = web.AppRunner(self.build_app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
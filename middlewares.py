@@ -0,0 +1,260 @@
+import asyncio
+import logging
+import random
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message, PreCheckoutQuery, TelegramObject
+
+from metrics import Metrics, update_stats
+
+
+# ================== БАНЫ ==================
+
+
+class BanMiddleware(BaseMiddleware):
+    """
+    Outer-middleware: отсекает забаненных до фильтров и хендлеров,
+    чтобы каждый хендлер не проверял бан сам.
+
+    is_banned — синхронная проверка по кэшу в памяти (DB.is_banned).
+    Сообщения об успешной оплате пропускаем всегда: деньги уже списаны.
+    Оплату по общей ссылке забаненному не подтверждаем (pre_checkout_query).
+    """
+
+    def __init__(self, is_banned: Callable[[int], bool]):
+        self.is_banned = is_banned
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None or not self.is_banned(user.id):
+            return await handler(event, data)
+
+        if isinstance(event, CallbackQuery):
+            await event.answer("Ты забанен 🚫", show_alert=True)
+            return None
+
+        if isinstance(event, Message):
+            if event.successful_payment:
+                return await handler(event, data)
+            await event.answer("🚫 Ты забанен и не можешь пользоваться этим ботом.")
+            return None
+
+        if isinstance(event, PreCheckoutQuery):
+            await event.answer(ok=False, error_message="Ты забанен 🚫")
+            return None
+
+        return None
+
+
+class BanRefresher:
+    """
+    Сверяет кэш банов процесса с базой раз в interval секунд (db.refresh_bans).
+
+    /ban и /unban сразу меняют кэш своего процесса, а в других процессах
+    на той же базе начинают действовать не позже чем через interval секунд.
+    Пока баны не меняются, это один запрос к однострочной таблице за интервал.
+    """
+
+    def __init__(self, db, interval: float = 2.0):
+        self.db = db
+        self.interval = interval
+
+        self._task: asyncio.Task | None = None
+
+        self.errors = 0
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.db.refresh_bans()
+            except Exception:
+                self.errors += 1
+                logging.exception("Не удалось сверить баны с базой")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> dict:
+        return {"interval": self.interval, "errors": self.errors}
+
+
+# ================== АНТИСПАМ КНОПОК ==================
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Outer-middleware для callback-кнопок: у каждого пользователя свой
+    token bucket (rate нажатий в секунду, всплеск до burst).
+
+    Лишние нажатия и нажатия, пока предыдущее ещё обрабатывается,
+    сразу гасятся дешёвым callback.answer — без базы и без сообщений.
+    Состояние — OrderedDict на max_users записей: самые давние вытесняются,
+    записи старше ttl выкидываются при обходе.
+
+    callback_data — какие кнопки ограничивать (None — все).
+    """
+
+    def __init__(
+        self,
+        rate: float = 1.0,
+        burst: int = 3,
+        callback_data: set[str] | None = None,
+        max_users: int = 10_000,
+        ttl: float = 60.0,
+        text: str = "Не так быстро 🐾",
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.callback_data = callback_data
+        self.max_users = max_users
+        self.ttl = ttl
+        self.text = text
+
+        # user_id -> [токены, время обновления, нажатие в обработке]
+        self._state: OrderedDict[int, list] = OrderedDict()
+
+        self.passed = 0
+        self.throttled = 0
+        self.coalesced = 0
+        self.evicted = 0
+
+    def _expire(self, now: float):
+        while self._state:
+            user_id, state = next(iter(self._state.items()))
+            if len(self._state) <= self.max_users and (now - state[1] < self.ttl or state[2]):
+                break
+            self._state.popitem(last=False)
+            self.evicted += 1
+
+    def _take(self, user_id: int, now: float) -> str:
+        """
+        "ok" — пропускаем, "busy" — прошлое нажатие ещё в работе, "limit" — превышен лимит.
+        """
+        state = self._state.get(user_id)
+        if state is None:
+            state = self._state[user_id] = [float(self.burst), now, False]
+        else:
+            self._state.move_to_end(user_id)
+            state[0] = min(float(self.burst), state[0] + (now - state[1]) * self.rate)
+            state[1] = now
+
+        if state[2]:
+            return "busy"
+        if state[0] < 1:
+            return "limit"
+        state[0] -= 1
+        state[2] = True
+        return "ok"
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not isinstance(event, CallbackQuery):
+            return await handler(event, data)
+        if self.callback_data is not None and event.data not in self.callback_data:
+            return await handler(event, data)
+
+        user_id = event.from_user.id
+        now = time.monotonic()
+        verdict = self._take(user_id, now)
+        self._expire(now)
+
+        if verdict != "ok":
+            if verdict == "busy":
+                self.coalesced += 1
+            else:
+                self.throttled += 1
+            await event.answer(self.text)
+            return None
+
+        self.passed += 1
+        try:
+            return await handler(event, data)
+        finally:
+            state = self._state.get(user_id)
+            if state is not None:
+                state[2] = False
+
+    def stats(self) -> dict:
+        return {
+            "tracked": len(self._state),
+            "passed": self.passed,
+            "throttled": self.throttled,
+            "coalesced": self.coalesced,
+            "evicted": self.evicted,
+        }
+
+
+# ================== ЗАМЕРЫ ==================
+
+
+def callback_label(data: str | None) -> str:
+    """
+    callback_data без параметров ("top_page:3" -> "top_page"), чтобы меток было конечное число.
+    """
+    return (data or "").split(":", 1)[0][:32]
+
+
+class InstrumentationMiddleware(BaseMiddleware):
+    """
+    Inner-middleware (вызывается уже для выбранного хендлера): время
+    хендлера и callback-кнопки, а также сколько SQL и сколько времени
+    в базе ушло на апдейт (считает AsyncDB через update_stats).
+
+    В выборку попадает доля sample_rate апдейтов; для остальных
+    база не замеряется вовсе.
+    """
+
+    def __init__(self, metrics: Metrics, sample_rate: float = 1.0):
+        self.metrics = metrics
+        self.sample_rate = sample_rate
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            token = update_stats.set(False)
+            try:
+                return await handler(event, data)
+            finally:
+                update_stats.reset(token)
+
+        name = data["handler"].callback.__name__
+        stats = {"queries": 0, "db_seconds": 0.0}
+        token = update_stats.set(stats)
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            self.metrics.inc("handler_errors_total", handler=name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            update_stats.reset(token)
+            self.metrics.observe("handler_seconds", elapsed, handler=name)
+            if isinstance(event, CallbackQuery):
+                self.metrics.observe("callback_seconds", elapsed, data=callback_label(event.data))
+            self.metrics.observe("update_db_queries", stats["queries"])
+            self.metrics.observe("update_db_seconds", stats["db_seconds"])
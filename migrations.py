@@ -0,0 +1,430 @@
+import json
+import logging
+import sqlite3
+import time
+from datetime import datetime
+
+
+# ================== МИГРАЦИИ СХЕМЫ (sqlite) ==================
+#
+# Каждая миграция выполняется один раз и записывается в schema_version.
+# Обычная миграция — функция step(conn), целиком в одной транзакции.
+# Пакетная (@batched) — step(conn, state) -> bool: за вызов обрабатывает
+# одну пачку строк и возвращает True, когда всё готово. Каждая пачка —
+# своя короткая транзакция, прогресс (state) сохраняется вместе с ней,
+# поэтому большие таблицы не блокируются надолго, а прерванная миграция
+# продолжается с того же места.
+#
+# Все шаги идемпотентны: старая база без schema_version проходит их заново
+# и ничего не ломается.
+
+
+def batched(step):
+    step.batched = True
+    return step
+
+
+def has_column(conn: sqlite3.Connection, table: str, column: str) -> bool:
+    return any(row[1] == column for row in conn.execute(f"PRAGMA table_info({table})"))
+
+
+def m001_base(conn: sqlite3.Connection):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            total_wins INTEGER NOT NULL DEFAULT 0,
+            wins_for_gift INTEGER NOT NULL DEFAULT 0,
+            gifts_count INTEGER NOT NULL DEFAULT 0,
+            daily_attempts_used INTEGER NOT NULL DEFAULT 0,
+            last_attempt_date TEXT
+        )
+        """
+    )
+    # баланс бота (учёт, сколько звёзд есть у бота на подарки)
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS bot_balance (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            stars INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+    conn.execute("INSERT OR IGNORE INTO bot_balance (id, stars) VALUES (1, 0)")
+    # история пополнений/покупок/возвратов
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS payments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            total_amount INTEGER NOT NULL,
+            currency TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS bans (
+            user_id INTEGER PRIMARY KEY,
+            reason TEXT,
+            banned_at TEXT
+        )
+        """
+    )
+    # счётчик изменений банов: процессы сверяют его и перечитывают свой кэш банов
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS bans_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+    conn.execute("INSERT OR IGNORE INTO bans_version (id, version) VALUES (1, 0)")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS promo_codes (
+            code TEXT PRIMARY KEY,
+            reward_wins INTEGER NOT NULL,
+            one_time INTEGER NOT NULL DEFAULT 1
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS promo_used (
+            user_id INTEGER NOT NULL,
+            code TEXT NOT NULL,
+            PRIMARY KEY(user_id, code)
+        )
+        """
+    )
+
+
+def m002_users_purchased_attempts(conn: sqlite3.Connection):
+    if not has_column(conn, "users", "purchased_attempts"):
+        conn.execute("ALTER TABLE users ADD COLUMN purchased_attempts INTEGER NOT NULL DEFAULT 0")
+
+
+def m003_payments_charge_id(conn: sqlite3.Connection):
+    # telegram_payment_charge_id: повторная доставка того же платежа не создаст вторую запись
+    if not has_column(conn, "payments", "charge_id"):
+        conn.execute("ALTER TABLE payments ADD COLUMN charge_id TEXT")
+    conn.execute(
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_payments_charge_id
+        ON payments(charge_id) WHERE charge_id IS NOT NULL
+        """
+    )
+
+
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_payments_user_payload ON payments(user_id, payload, id)",
+    "CREATE INDEX IF NOT EXISTS idx_payments_created_at ON payments(created_at)",
+    # топ: при равных победах выше тот, у кого меньше user_id; индекс отдаёт топ
+    # уже в этом порядке (без временного B-дерева) и считает место без полного скана
+    "CREATE INDEX IF NOT EXISTS idx_users_top ON users(total_wins DESC, user_id, gifts_count)",
+    # активации конкретного кода (первичный ключ начинается с user_id и тут не помогает)
+    "CREATE INDEX IF NOT EXISTS idx_promo_used_code ON promo_used(code)",
+]
+
+
+@batched
+def m004_indexes(conn: sqlite3.Connection, state: dict) -> bool:
+    """
+    По индексу за транзакцию: построение индекса держит блокировку записи,
+    и на большой базе запись ждёт одно построение, а не все сразу.
+    """
+    done = state.get("done", 0)
+    conn.execute(INDEXES[done])
+    state["done"] = done + 1
+    return state["done"] >= len(INDEXES)
+
+
+def m005_payment_daily(conn: sqlite3.Connection):
+    # суммы платежей по дням — для отчётов за период без скана payments
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS payment_daily (
+            day TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            currency TEXT NOT NULL,
+            payments_count INTEGER NOT NULL DEFAULT 0,
+            total_amount INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, payload, currency)
+        )
+        """
+    )
+
+
+@batched
+def m006_payment_daily_backfill(conn: sqlite3.Connection, state: dict, batch_size: int = 5000) -> bool:
+    """
+    Суммы по платежам, записанным до появления payment_daily.
+    Платежи с id > end_id уже пишутся новым кодом вместе с суммами.
+    """
+    if "end_id" not in state:
+        if conn.execute("SELECT 1 FROM payment_daily LIMIT 1").fetchone() is not None:
+            return True  # суммы уже собраны (база после старого _init_db)
+        state["cursor"] = 0
+        state["end_id"] = conn.execute("SELECT COALESCE(MAX(id), 0) FROM payments").fetchone()[0]
+
+    upper = min(state["cursor"] + batch_size, state["end_id"])
+    conn.execute(
+        """
+        INSERT INTO payment_daily (day, payload, currency, payments_count, total_amount)
+        SELECT substr(created_at, 1, 10), payload, currency, COUNT(*), SUM(total_amount)
+        FROM payments
+        WHERE id > ? AND id <= ?
+        GROUP BY substr(created_at, 1, 10), payload, currency
+        ON CONFLICT(day, payload, currency) DO UPDATE SET
+            payments_count = payments_count + excluded.payments_count,
+            total_amount = total_amount + excluded.total_amount
+        """,
+        (state["cursor"], upper),
+    )
+    state["cursor"] = upper
+    return upper >= state["end_id"]
+
+
+def m007_media_cache(conn: sqlite3.Connection):
+    # file_id загруженных в Telegram файлов (фото кота, стикеры и т.п.)
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS media_cache (
+            key TEXT PRIMARY KEY,
+            file_id TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+        """
+    )
+
+
+def m008_scheduled_tasks(conn: sqlite3.Connection):
+    # отложенные задачи (результат кубика и т.п.), переживают рестарт
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS scheduled_tasks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            run_at REAL NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            locked_until REAL,
+            last_error TEXT,
+            created_at TEXT NOT NULL
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_scheduled_tasks_due ON scheduled_tasks(status, run_at)")
+    # задачи упавших процессов: claim_due_tasks ищет их по истёкшей аренде
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_scheduled_tasks_lease ON scheduled_tasks(status, locked_until)"
+    )
+
+
+def m009_withdrawals(conn: sqlite3.Connection):
+    # выводы подарков: звёзды бота и победы игрока резервируются до отправки
+    # reserved -> sending -> sent | failed (резерв возвращён) | unknown (упали во время отправки)
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS withdrawals (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            gift_id TEXT NOT NULL,
+            cost_stars INTEGER NOT NULL,
+            wins_cost INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            idempotency_key TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_withdrawals_status ON withdrawals(status, created_at)")
+    # ключ вывода (например, id отложенной задачи): повтор той же задачи
+    # находит уже созданный вывод, а не резервирует и шлёт подарок второй раз
+    conn.execute(
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_withdrawals_idempotency_key
+        ON withdrawals(idempotency_key) WHERE idempotency_key IS NOT NULL
+        """
+    )
+
+
+def m010_broadcasts(conn: sqlite3.Connection):
+    # рассылки: прогресс сохраняется, чтобы после рестарта продолжить с места остановки
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_chat_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            total INTEGER NOT NULL DEFAULT 0,
+            last_user_id INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            skipped INTEGER NOT NULL DEFAULT 0,
+            owner TEXT,
+            lease_until REAL NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+        """
+    )
+    # watch() раз в полминуты ищет running-рассылки — без скана всей истории рассылок
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_broadcasts_status ON broadcasts(status, id)")
+
+
+def m011_fsm_state(conn: sqlite3.Connection):
+    # состояния диалогов (aiogram FSM), общие для всех воркеров
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS fsm_state (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL DEFAULT '{}',
+            expires_at REAL NOT NULL
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_fsm_state_expires ON fsm_state(expires_at)")
+
+
+def m012_daily_resets(conn: sqlite3.Connection):
+    # сброс бесплатных попыток по суткам: кто ведёт и докуда дошёл
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS daily_resets (
+            day TEXT PRIMARY KEY,
+            cursor INTEGER NOT NULL DEFAULT 0,
+            users INTEGER NOT NULL DEFAULT 0,
+            started_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            finished_at REAL
+        )
+        """
+    )
+
+
+# порядок менять нельзя, новые миграции — только в конец
+MIGRATIONS = [
+    (1, "базовые таблицы", m001_base),
+    (2, "users.purchased_attempts", m002_users_purchased_attempts),
+    (3, "payments.charge_id", m003_payments_charge_id),
+    (4, "индексы payments, топа, promo_used", m004_indexes),
+    (5, "payment_daily", m005_payment_daily),
+    (6, "payment_daily: суммы по старым платежам", m006_payment_daily_backfill),
+    (7, "media_cache", m007_media_cache),
+    (8, "scheduled_tasks", m008_scheduled_tasks),
+    (9, "withdrawals", m009_withdrawals),
+    (10, "broadcasts", m010_broadcasts),
+    (11, "fsm_state", m011_fsm_state),
+    (12, "daily_resets", m012_daily_resets),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def _ensure_tables(conn: sqlite3.Connection):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TEXT NOT NULL,
+            duration_ms REAL NOT NULL
+        )
+        """
+    )
+    # прогресс пакетных миграций
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_migration_state (
+            version INTEGER PRIMARY KEY,
+            state TEXT NOT NULL
+        )
+        """
+    )
+
+
+def _is_applied(conn: sqlite3.Connection, version: int) -> bool:
+    return conn.execute("SELECT 1 FROM schema_version WHERE version = ?", (version,)).fetchone() is not None
+
+
+def _mark_applied(conn: sqlite3.Connection, version: int, name: str, started: float):
+    conn.execute(
+        "INSERT INTO schema_version (version, name, applied_at, duration_ms) VALUES (?, ?, ?, ?)",
+        (version, name, datetime.utcnow().isoformat(), (time.perf_counter() - started) * 1000),
+    )
+    conn.execute("DELETE FROM schema_migration_state WHERE version = ?", (version,))
+
+
+def _apply(pool, version: int, name: str, step, pause: float) -> dict | None:
+    """
+    Применяет одну миграцию. None — она уже была применена раньше.
+    """
+    started = time.perf_counter()
+    batches = 0
+    max_batch_ms = 0.0
+
+    while True:
+        with pool.connection() as conn:
+            # BEGIN IMMEDIATE: несколько процессов, стартующих одновременно,
+            # применяют миграции по очереди и перепроверяют версию под блокировкой
+            conn.execute("BEGIN IMMEDIATE")
+            batch_started = time.perf_counter()
+            if _is_applied(conn, version):
+                return None
+
+            if not getattr(step, "batched", False):
+                step(conn)
+                _mark_applied(conn, version, name, started)
+                return {"version": version, "name": name, "batches": 1}
+
+            row = conn.execute(
+                "SELECT state FROM schema_migration_state WHERE version = ?", (version,)
+            ).fetchone()
+            state = json.loads(row[0]) if row else {}
+            finished = step(conn, state)
+            batches += 1
+            max_batch_ms = max(max_batch_ms, (time.perf_counter() - batch_started) * 1000)
+            if finished:
+                _mark_applied(conn, version, name, started)
+                return {"version": version, "name": name, "batches": batches, "max_batch_ms": max_batch_ms}
+            conn.execute(
+                "INSERT OR REPLACE INTO schema_migration_state (version, state) VALUES (?, ?)",
+                (version, json.dumps(state)),
+            )
+        # между пачками отпускаем блокировку, чтобы бот успел записать своё
+        time.sleep(pause)
+
+
+def migrate(pool, migrations=MIGRATIONS, pause: float = 0.01) -> list[dict]:
+    """
+    Доводит схему до последней версии. Возвращает применённые миграции.
+    """
+    with pool.connection() as conn:
+        _ensure_tables(conn)
+        applied = {row[0] for row in conn.execute("SELECT version FROM schema_version")}
+
+    done = []
+    for version, name, step in migrations:
+        if version in applied:
+            continue
+        result = _apply(pool, version, name, step, pause)
+        if result is not None:
+            logging.info("Миграция %s (%s) применена: %s", version, name, result)
+            done.append(result)
+    return done
+
+
+def schema_version(pool) -> int:
+    with pool.connection() as conn:
+        row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
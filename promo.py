@@ -0,0 +1,293 @@
+import argparse
+import asyncio
+import csv
+import io
+import itertools
+import json
+import os
+import secrets
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Iterable, Iterator
+
+
+# ================== ПРОМОКОДЫ ==================
+
+# без похожих символов (0/O, 1/I/L), чтобы код не путали при вводе
+CODE_ALPHABET = "23456789ABCDEFGHJKMNPQRSTUVWXYZ"
+
+# форматы файлов с кодами: csv (code,reward_wins,one_time) и json (JSON Lines)
+FILE_FORMATS = ("csv", "json")
+CSV_HEADER = ("code", "reward_wins", "one_time")
+
+
+def format_promos(promos: Iterable[tuple], fmt: str, header: bool = True) -> Iterator[str]:
+    """
+    Построчно выводит коды (code, reward_wins, one_time) в формате fmt.
+    """
+    if fmt == "csv":
+        buf = io.StringIO()
+        writer = csv.writer(buf, lineterminator="\n")
+        rows = itertools.chain([CSV_HEADER], promos) if header else promos
+        for row in rows:
+            writer.writerow(row)
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    else:
+        for code, reward_wins, one_time in promos:
+            yield json.dumps({"code": code, "reward_wins": reward_wins, "one_time": one_time}) + "\n"
+
+
+def parse_promos(lines: Iterable[str], fmt: str, errors: list[int]) -> Iterator[tuple]:
+    """
+    Построчно читает коды. Номера битых строк складываются в errors.
+    """
+    if fmt == "csv":
+        records = csv.reader(lines)
+    else:
+        records = (line for line in lines if line.strip())
+
+    for lineno, record in enumerate(records, start=1):
+        try:
+            if fmt == "csv":
+                if not record or list(record) == list(CSV_HEADER):
+                    continue
+                code, reward_wins, one_time = record[0], record[1], record[2] if len(record) > 2 else 1
+            else:
+                item = json.loads(record)
+                code, reward_wins, one_time = item["code"], item["reward_wins"], item.get("one_time", 1)
+            code = PromoService.normalize(code)
+            if not code:
+                raise ValueError("пустой код")
+            yield code, int(reward_wins), 1 if int(one_time) else 0
+        except (ValueError, KeyError, IndexError, TypeError):
+            errors.append(lineno)
+
+
+class PromoService:
+    """
+    Промокоды: кэш проверенных кодов в памяти + атомарная активация в базе.
+
+    Код сверяется с базой одним чтением по ключу (db.get_promo), ответ —
+    и "такого кода нет" тоже — держится в памяти ttl секунд, не больше
+    max_codes кодов (давние вытесняются). Неверные и уже погашенные
+    одноразовые коды отсекаются до транзакции активации, поэтому всплеск
+    активаций после рассылки не упирается в блокировки sqlite. Код,
+    созданный в другом процессе, виден не позже чем через ttl.
+    Сама активация — одна транзакция (db.redeem_promo).
+
+        result = await promos.redeem(user_id, "CATS2024")
+    """
+
+    def __init__(self, db, ttl: float = 60, max_codes: int = 10_000):
+        self.db = db
+        self.ttl = ttl
+        self.max_codes = max_codes
+
+        # код -> ((reward_wins, one_time) или None, когда проверен)
+        self._codes: OrderedDict[str, tuple[tuple | None, float]] = OrderedDict()
+
+        self.redeemed = 0
+        self.rejected = 0
+        self.cache_rejects = 0
+        self.lookups = 0
+
+    async def _lookup(self, code: str) -> tuple | None:
+        cached = self._codes.get(code)
+        if cached is not None and time.monotonic() - cached[1] < self.ttl:
+            self._codes.move_to_end(code)
+            return cached[0]
+        self.lookups += 1
+        promo = await self.db.get_promo(code)
+        self._remember(code, promo)
+        return promo
+
+    def _remember(self, code: str, promo: tuple | None):
+        self._codes[code] = (promo, time.monotonic())
+        self._codes.move_to_end(code)
+        while len(self._codes) > self.max_codes:
+            self._codes.popitem(last=False)
+
+    def _forget(self, codes: Iterable[str]):
+        # новые коды: ответ "нет такого кода" из кэша больше не верен
+        for code in codes:
+            self._codes.pop(code, None)
+
+    @staticmethod
+    def normalize(code: str) -> str:
+        return code.strip().upper()
+
+    async def create(self, code: str, reward_wins: int, one_time: int):
+        code = self.normalize(code)
+        await self.db.create_promo(code, reward_wins, one_time)
+        self._remember(code, (reward_wins, one_time))
+
+    async def generate(
+        self,
+        count: int,
+        reward_wins: int,
+        one_time: int = 1,
+        prefix: str = "",
+        length: int = 8,
+    ) -> list[str]:
+        """
+        Создаёт count новых уникальных кодов одной пачкой (одна транзакция).
+        При коллизии с существующим кодом пачка генерируется заново.
+        """
+        prefix = self.normalize(prefix)
+
+        while True:
+            codes: set[str] = set()
+            while len(codes) < count:
+                codes.add(prefix + "".join(secrets.choice(CODE_ALPHABET) for _ in range(length)))
+
+            # редкая коллизия с существующим кодом откатывает пачку — пробуем другие коды
+            if await self.db.create_promos_batch([(code, reward_wins, one_time) for code in codes]):
+                break
+
+        self._forget(codes)
+        return list(codes)
+
+    async def import_lines(self, lines: Iterable[str], fmt: str, batch_size: int = 1000) -> dict:
+        """
+        Потоково импортирует коды пачками по batch_size (одна транзакция на пачку).
+        Существующие коды пропускаются.
+        """
+        start = time.perf_counter()
+        errors: list[int] = []
+        total = imported = 0
+        batch: list[tuple] = []
+
+        async def flush():
+            nonlocal imported
+            imported += await self.db.import_promos_batch(batch)
+            self._forget(code for code, _, _ in batch)
+            batch.clear()
+
+        for promo in parse_promos(lines, fmt, errors):
+            batch.append(promo)
+            total += 1
+            if len(batch) >= batch_size:
+                await flush()
+        if batch:
+            await flush()
+
+        seconds = time.perf_counter() - start
+        return {
+            "imported": imported,
+            "skipped": total - imported,
+            "invalid": errors,
+            "seconds": seconds,
+            "rate": total / seconds if seconds else 0.0,
+        }
+
+    async def export_lines(self, fmt: str, page_size: int = 1000) -> AsyncIterator[str]:
+        """
+        Потоково выгружает все активные коды, страницами по page_size.
+        """
+        after = ""
+        while True:
+            page = await self.db.get_promos_page(after, page_size)
+            if not page:
+                break
+            # заголовок csv — только в начале файла
+            for line in format_promos(page, fmt, header=not after):
+                yield line
+            after = page[-1][0]
+
+    async def redeem(self, user_id: int, code: str) -> dict:
+        """
+        Возвращает {"reward", "one_time", "wins_for_gift"} или
+        {"error": "not_found" | "used"}.
+        """
+        code = self.normalize(code)
+        if await self._lookup(code) is None:
+            self.rejected += 1
+            self.cache_rejects += 1
+            return {"error": "not_found"}
+
+        result = await self.db.redeem_promo(user_id, code)
+        if "error" in result:
+            self.rejected += 1
+            if result["error"] == "not_found":
+                self._remember(code, None)
+            return result
+
+        if result["one_time"]:
+            self._remember(code, None)
+        self.redeemed += 1
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "cached": len(self._codes),
+            "redeemed": self.redeemed,
+            "rejected": self.rejected,
+            "cache_rejects": self.cache_rejects,
+            "lookups": self.lookups,
+        }
+
+
+# ================== CLI ==================
+
+
+async def _cli(args):
+    from backend import create_backend
+
+    db = create_backend(os.getenv("DATABASE_URL"), args.db)
+    await db.connect()
+    promos = PromoService(db)
+    try:
+        if args.command == "generate":
+            start = time.perf_counter()
+            codes = await promos.generate(args.count, args.reward, args.one_time, prefix=args.prefix)
+            seconds = time.perf_counter() - start
+            with open(args.out, "w", encoding="utf-8", newline="") as f:
+                for line in format_promos(((code, args.reward, args.one_time) for code in codes), args.format):
+                    f.write(line)
+            print(f"Создано кодов: {len(codes)} за {seconds:.2f} с -> {args.out}")
+
+        elif args.command == "import":
+            with open(args.file, encoding="utf-8-sig", newline="") as f:
+                result = await promos.import_lines(f, args.format)
+            print(
+                f"Импортировано: {result['imported']}, пропущено (уже были): {result['skipped']}, "
+                f"битых строк: {len(result['invalid'])}, {result['rate']:.0f} кодов/с"
+            )
+
+        elif args.command == "export":
+            count = 0
+            with open(args.out, "w", encoding="utf-8", newline="") as f:
+                async for line in promos.export_lines(args.format):
+                    f.write(line)
+                    count += 1
+            print(f"Выгружено строк: {count} -> {args.out}")
+    finally:
+        await db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Промокоды: генерация, импорт и экспорт")
+    parser.add_argument("--db", default=os.getenv("DB_PATH") or "bot.db")
+    parser.add_argument("--format", choices=FILE_FORMATS, default="csv")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    gen = sub.add_parser("generate", help="создать N уникальных кодов")
+    gen.add_argument("count", type=int)
+    gen.add_argument("--reward", type=int, required=True, help="побед за код")
+    gen.add_argument("--one-time", type=int, choices=(0, 1), default=1)
+    gen.add_argument("--prefix", default="")
+    gen.add_argument("--out", default="promo_codes.csv")
+
+    imp = sub.add_parser("import", help="загрузить коды из файла")
+    imp.add_argument("file")
+
+    exp = sub.add_parser("export", help="выгрузить активные коды в файл")
+    exp.add_argument("--out", default="promo_codes.csv")
+
+    asyncio.run(_cli(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
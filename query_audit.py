@@ -0,0 +1,198 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+
+# ================== АУДИТ SQL ==================
+
+# планы смотрим только у запросов к данным; PRAGMA, BEGIN, CREATE и т.п. пропускаем
+EXPLAINED = ("SELECT", "INSERT", "UPDATE", "DELETE", "REPLACE", "WITH")
+
+
+def normalize_sql(sql: str) -> str:
+    return " ".join(sql.split())
+
+
+def param_shape(parameters) -> str:
+    """
+    Форма параметров без значений: (int, str) или {:user_id int}.
+    Значения в отчёт и лог не попадают — там id пользователей и платежей.
+    """
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f":{key} {type(value).__name__}" for key, value in sorted(parameters.items())) + "}"
+    return "(" + ", ".join(type(value).__name__ for value in parameters) + ")"
+
+
+def plan_flags(plan: list[str]) -> list[str]:
+    """
+    Проблемные шаги плана: полный скан таблицы и временное B-дерево
+    (сортировка или DISTINCT/GROUP BY без подходящего индекса).
+    Скан по индексу (SCAN ... USING INDEX) — обычный ORDER BY ... LIMIT, его не отмечаем.
+    """
+    flags = []
+    for detail in plan:
+        if detail.startswith("SCAN ") and " USING " not in detail and detail != "SCAN CONSTANT ROW":
+            flags.append(detail)
+        elif detail.startswith("USE TEMP B-TREE"):
+            flags.append(detail)
+    return flags
+
+
+class AuditedConnection(sqlite3.Connection):
+    """
+    sqlite-соединение, которое передаёт каждый execute/executemany аудитору.
+    Без аудитора работает как обычное.
+    """
+
+    auditor: "QueryAuditor | None" = None
+
+    def execute(self, sql, parameters=(), /):
+        if self.auditor is None:
+            return super().execute(sql, parameters)
+        return self.auditor.run(self, super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters, /):
+        if self.auditor is None:
+            return super().executemany(sql, seq_of_parameters)
+        return self.auditor.run(self, super().executemany, sql, list(seq_of_parameters), many=True)
+
+
+class QueryAuditor:
+    """
+    Режим профилирования: собирает каждый различный SQL, который выполнил бот.
+
+    Для каждого запроса при первом выполнении снимается EXPLAIN QUERY PLAN
+    (на том же соединении, с теми же параметрами), копятся число вызовов,
+    время execute и формы параметров. Execute, дольше slow_ms, пишется
+    в лог с формой параметров. Для SELECT время execute — до первой строки:
+    сортировка и скан попадают в него, чтение остальных строк — нет.
+
+    report() — отчёт для JSON, compare_reports() находит проблемные планы,
+    которых не было в прошлом отчёте.
+    """
+
+    def __init__(self, slow_ms: float = 50):
+        self.slow_ms = slow_ms
+
+        self._lock = threading.Lock()
+        # нормализованный SQL -> статистика
+        self._statements: dict[str, dict] = {}
+        self.slow = 0
+
+    def run(self, conn: sqlite3.Connection, execute, sql: str, parameters, many: bool = False):
+        # у executemany план и форма — по первому набору параметров
+        sample = (parameters[0] if parameters else ()) if many else parameters
+        key = normalize_sql(sql)
+        with self._lock:
+            entry = self._statements.get(key)
+        if entry is None:
+            entry = self._new_entry(conn, key, sql, sample)
+
+        start = time.perf_counter()
+        try:
+            return execute(sql, parameters)
+        finally:
+            ms = (time.perf_counter() - start) * 1000
+            shape = param_shape(sample)
+            if many:
+                shape += f" x{len(parameters)}"
+            with self._lock:
+                entry["calls"] += 1
+                entry["total_ms"] += ms
+                entry["max_ms"] = max(entry["max_ms"], ms)
+                if shape not in entry["shapes"]:
+                    entry["shapes"].append(shape)
+                if ms >= self.slow_ms:
+                    entry["slow"] += 1
+                    self.slow += 1
+            if ms >= self.slow_ms:
+                logging.warning("Медленный SQL: %.1f мс, параметры %s: %s", ms, shape, key[:300])
+
+    def _new_entry(self, conn: sqlite3.Connection, key: str, sql: str, sample) -> dict:
+        plan: list[str] = []
+        if key.split(" ", 1)[0].upper() in EXPLAINED:
+            try:
+                # мимо аудитора, чтобы сам EXPLAIN не попал в отчёт
+                rows = sqlite3.Connection.execute(conn, "EXPLAIN QUERY PLAN " + sql, sample).fetchall()
+                plan = [row[3] for row in rows]
+            except sqlite3.Error as e:
+                plan = [f"EXPLAIN не удался: {e}"]
+
+        entry = {
+            "sql": key,
+            "calls": 0,
+            "total_ms": 0.0,
+            "max_ms": 0.0,
+            "slow": 0,
+            "shapes": [],
+            "plan": plan,
+            "flags": plan_flags(plan),
+        }
+        with self._lock:
+            # другой поток мог успеть первым — берём его запись
+            return self._statements.setdefault(key, entry)
+
+    # ---- отчёт ----
+
+    def report(self) -> dict:
+        with self._lock:
+            statements = [dict(entry, shapes=list(entry["shapes"])) for entry in self._statements.values()]
+        statements.sort(key=lambda entry: entry["total_ms"], reverse=True)
+        return {
+            "meta": {
+                "created_at": datetime.now().isoformat(timespec="seconds"),
+                "slow_ms": self.slow_ms,
+            },
+            "statements": statements,
+        }
+
+    def save(self, path: str) -> dict:
+        report = self.report()
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        return report
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "statements": len(self._statements),
+                "flagged": sum(1 for entry in self._statements.values() if entry["flags"]),
+                "slow": self.slow,
+            }
+
+
+def format_report(report: dict, limit: int = 20) -> str:
+    """
+    Текстовая сводка: сначала запросы с проблемными планами, потом самые долгие.
+    """
+    statements = report["statements"]
+    flagged = [entry for entry in statements if entry["flags"]]
+    lines = [f"SQL: {len(statements)} различных запросов, с проблемными планами: {len(flagged)}"]
+    for entry in flagged:
+        lines.append(f"  ! {entry['sql'][:200]}")
+        lines.append(f"      {'; '.join(entry['flags'])} — {entry['calls']} раз, {entry['total_ms']:.1f} мс")
+    lines.append("Самые долгие:")
+    for entry in statements[:limit]:
+        avg = entry["total_ms"] / entry["calls"] if entry["calls"] else 0.0
+        lines.append(
+            f"  {entry['total_ms']:8.1f} мс  {entry['calls']:6} раз  среднее {avg:.3f}  "
+            f"макс {entry['max_ms']:.2f}  {entry['sql'][:120]}"
+        )
+    return "\n".join(lines)
+
+
+def compare_reports(current: dict, baseline: dict) -> list[str]:
+    """
+    Проблемные шаги планов, которых нет в baseline для того же SQL
+    (новый запрос со сканом тоже сюда попадает).
+    """
+    known = {entry["sql"]: set(entry["flags"]) for entry in baseline.get("statements", [])}
+    problems = []
+    for entry in current["statements"]:
+        new = [flag for flag in entry["flags"] if flag not in known.get(entry["sql"], set())]
+        if new:
+            problems.append(f"{'; '.join(new)}: {entry['sql'][:200]}")
+    return problems
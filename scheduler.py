@@ -0,0 +1,215 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable
+
+from aiogram import Bot
+
+
+# ================== ОТЛОЖЕННЫЕ ЗАДАЧИ ==================
+
+TaskHandler = Callable[[Bot, dict, int], Awaitable[Any]]
+
+
+class PermanentTaskError(Exception):
+    """
+    Задачу не повторять: повтор не поможет или задвоит побочный эффект
+    (например, сообщение могло уйти, а ответ Telegram потерялся).
+    """
+
+
+class TaskScheduler:
+    """
+    Планировщик отложенных задач поверх таблицы scheduled_tasks.
+
+    Задача сначала пишется в базу, потом выполняется, поэтому рестарт её
+    не теряет (выполнение "хотя бы один раз"). Хендлер получает payload и
+    id задачи — он не меняется между повторами и годится как ключ
+    идемпотентности. Хендлер может вернуть следующий шаг (kind, payload,
+    delay) — он ставится в той же транзакции, в которой удаляется текущая
+    задача. PermanentTaskError из хендлера не повторяется.
+
+    Если процесс упал посреди задачи, она вернётся после lease. Хендлер с
+    once=True в этом случае не перезапускается (его побочный эффект мог
+    уже случиться), а задача помечается failed.
+
+        @scheduler.handler("dice_result")
+        async def dice_result(bot, payload, task_id): ...
+
+        await scheduler.schedule("dice_result", {"user_id": 1}, delay=4)
+    """
+
+    def __init__(
+        self,
+        db,
+        poll_interval: float = 1.0,
+        batch_size: int = 50,
+        concurrency: int = 20,
+        lease: float = 60.0,
+        max_attempts: int = 5,
+        complete_attempts: int = 3,
+    ):
+        self.db = db
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.complete_attempts = complete_attempts
+
+        self._handlers: dict[str, TaskHandler] = {}
+        self._once: set[str] = set()
+        self._sem = asyncio.Semaphore(concurrency)
+        self._wake = asyncio.Event()
+        self._running: set[asyncio.Task] = set()
+        self._loop_task: asyncio.Task | None = None
+
+        self.scheduled = 0
+        self.done = 0
+        self.failed = 0
+        self.loop_errors = 0
+
+    def handler(self, kind: str, once: bool = False):
+        def register(func: TaskHandler) -> TaskHandler:
+            self._handlers[kind] = func
+            if once:
+                self._once.add(kind)
+            return func
+
+        return register
+
+    async def schedule(self, kind: str, payload: dict, delay: float = 0) -> int:
+        task_id = await self.db.schedule_task(kind, payload, time.time() + delay)
+        self.scheduled += 1
+        self._wake.set()
+        return task_id
+
+    def task(self, kind: str, payload: dict, delay: float = 0) -> tuple:
+        """
+        Задача для записи в чужой транзакции (например, вместе с платежом
+        в db.apply_payment). После commit нужно вызвать scheduled_elsewhere().
+        """
+        return kind, payload, time.time() + delay
+
+    def scheduled_elsewhere(self):
+        self.scheduled += 1
+        self._wake.set()
+
+    async def start(self, bot: Bot):
+        if self._loop_task is None:
+            self._loop_task = asyncio.create_task(self._run(bot))
+
+    async def stop(self):
+        """
+        Останавливает цикл и дожидается уже начатых задач.
+        Незабранные задачи остаются в базе до следующего запуска.
+        """
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            try:
+                await self._loop_task
+            except asyncio.CancelledError:
+                pass
+            self._loop_task = None
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+    async def _run(self, bot: Bot):
+        errors = 0
+        while True:
+            try:
+                await self._poll(bot)
+                errors = 0
+            except Exception:
+                # база недоступна — цикл не должен умирать молча, ждём и пробуем снова
+                errors += 1
+                self.loop_errors += 1
+                logging.exception("Ошибка в цикле отложенных задач")
+                await asyncio.sleep(min(self.poll_interval * 2**errors, 60))
+
+    async def _poll(self, bot: Bot):
+        tasks = await self.db.claim_due_tasks(time.time(), self.batch_size, self.lease, self.max_attempts)
+
+        for task in tasks:
+            await self._sem.acquire()
+            job = asyncio.create_task(self._execute(bot, task))
+            self._running.add(job)
+            job.add_done_callback(self._running.discard)
+
+        if len(tasks) >= self.batch_size:
+            return  # очередь не разобрана — берём следующую пачку сразу
+
+        timeout = self.poll_interval
+        next_run_at = await self.db.next_task_run_at()
+        if next_run_at is not None:
+            timeout = min(timeout, max(0.0, next_run_at - time.time()))
+
+        self._wake.clear()
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _execute(self, bot: Bot, task: dict):
+        try:
+            try:
+                handler = self._handlers.get(task["kind"])
+                if handler is None:
+                    raise PermanentTaskError(f"нет обработчика для задачи {task['kind']}")
+                if task["reclaimed"] and task["kind"] in self._once:
+                    raise PermanentTaskError("процесс упал во время выполнения, повтор мог бы задвоить результат")
+                next_step = await handler(bot, task["payload"], task["id"])
+            except Exception as e:
+                await self._fail(task, e)
+            else:
+                await self._complete(task, next_step)
+        finally:
+            self._sem.release()
+
+    async def _fail(self, task: dict, error: Exception):
+        logging.error("Отложенная задача %s (%s) упала", task["id"], task["kind"], exc_info=error)
+        retry_at = None
+        if not isinstance(error, PermanentTaskError) and task["attempts"] < self.max_attempts:
+            retry_at = time.time() + 2 ** task["attempts"]
+        else:
+            self.failed += 1
+        try:
+            await self.db.fail_task(task["id"], repr(error), retry_at)
+        except Exception:
+            # не записали — задача вернётся после lease
+            logging.exception("Не удалось записать ошибку задачи %s", task["id"])
+
+    async def _complete(self, task: dict, next_step):
+        """
+        Хендлер уже отработал — при ошибке базы повторяем только запись
+        результата, а не хендлер с его побочными эффектами.
+        """
+        next_task = None
+        if next_step:
+            kind, payload, delay = next_step
+            next_task = (kind, payload, time.time() + delay)
+
+        for attempt in range(1, self.complete_attempts + 1):
+            try:
+                await self.db.complete_task(task["id"], next_task)
+                break
+            except Exception:
+                logging.exception("Не удалось завершить задачу %s (попытка %s)", task["id"], attempt)
+                if attempt == self.complete_attempts:
+                    # задача вернётся после lease: once-задача станет failed,
+                    # остальные выполнятся ещё раз
+                    return
+                await asyncio.sleep(0.5 * attempt)
+
+        self.done += 1
+        if next_task:
+            self.scheduled += 1
+            self._wake.set()
+
+    def stats(self) -> dict:
+        return {
+            "scheduled": self.scheduled,
+            "done": self.done,
+            "failed": self.failed,
+            "running": len(self._running),
+            "loop_errors": self.loop_errors,
+        }
@@ -0,0 +1,57 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+# модули бота лежат в корне репозитория, без пакета
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from daily_reset import GameClock  # noqa: E402
+from db import DB, AsyncDB  # noqa: E402
+from query_audit import QueryAuditor  # noqa: E402
+
+
+@pytest.fixture
+def db_path(tmp_path) -> str:
+    return str(tmp_path / "bot.db")
+
+
+@pytest.fixture
+def clock() -> GameClock:
+    return GameClock()
+
+
+@pytest.fixture
+def sync_db(db_path, clock):
+    db = DB(db_path, pool_size=8, clock=clock)
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def adb(sync_db):
+    """
+    AsyncDB с единственным писателем, как в боте. Цикл событий
+    не нужен до первого вызова — тест запускает свой через asyncio.run.
+    """
+    db = AsyncDB(sync_db, max_workers=8)
+    yield db
+    asyncio.run(db.close())
+
+
+@pytest.fixture
+def auditor(sync_db) -> QueryAuditor:
+    """
+    Планы всех SQL, которые тест выполнит через sync_db (и adb поверх него).
+    """
+    auditor = QueryAuditor()
+    sync_db.pool.enable_audit(auditor)
+    return auditor
+
+
+def flagged(auditor: QueryAuditor) -> list[str]:
+    """
+    Запросы с полным сканом или временным B-деревом.
+    """
+    return [entry["sql"] for entry in auditor.report()["statements"] if entry["flags"]]
@@ -0,0 +1,92 @@
+import asyncio
+from types import SimpleNamespace
+
+from broadcast import Broadcaster
+from conftest import flagged
+
+
+class ChatBot:
+    """
+    send_message без сети: запоминает получателей.
+    """
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        self.sent.append(chat_id)
+        return SimpleNamespace(chat=SimpleNamespace(id=chat_id), message_id=len(self.sent))
+
+    async def edit_message_text(self, text, chat_id, message_id):
+        pass
+
+
+def add_users(sync_db, count: int):
+    with sync_db.pool.connection() as conn:
+        conn.executemany("INSERT INTO users (user_id) VALUES (?)", [(i,) for i in range(1, count + 1)])
+
+
+def test_running_broadcast_is_resumed_by_one_process(adb, sync_db):
+    add_users(sync_db, 30)
+    broadcast_id = sync_db.create_broadcast(0, "hi")["id"]
+    first = Broadcaster(adb, adb.is_banned, rate=1000, page_size=10)
+    second = Broadcaster(adb, adb.is_banned, rate=1000, page_size=10)
+    bot = ChatBot()
+
+    async def scenario():
+        await asyncio.gather(first.resume(bot), second.resume(bot))
+        await asyncio.gather(*first._tasks.values(), *second._tasks.values())
+
+    asyncio.run(scenario())
+
+    recipients = [chat_id for chat_id in bot.sent if chat_id != 0]
+    assert sorted(recipients) == list(range(1, 31))
+    assert sync_db.get_broadcast(broadcast_id)["status"] == "done"
+
+
+def test_lease_of_dead_process_expires(sync_db):
+    broadcast_id = sync_db.create_broadcast(0, "hi", owner="dead", lease_until=1000.0)["id"]
+
+    assert sync_db.claim_broadcast(broadcast_id, "alive", now=999.0, lease=60) is False
+    assert sync_db.claim_broadcast(broadcast_id, "alive", now=1001.0, lease=60) is True
+    # прежний владелец больше не может писать прогресс
+    counters = {"sent": 1, "blocked": 0, "failed": 0, "skipped": 0}
+    assert sync_db.save_broadcast_progress(broadcast_id, 5, counters, owner="dead", lease_until=2000.0) is False
+    assert sync_db.save_broadcast_progress(broadcast_id, 5, counters, owner="alive", lease_until=2000.0) is True
+
+    sync_db.release_broadcast(broadcast_id, "alive")
+    assert sync_db.claim_broadcast(broadcast_id, "next", now=1002.0, lease=60) is True
+
+
+def test_running_broadcasts_are_found_by_index(sync_db, auditor):
+    for _ in range(5):
+        sync_db.create_broadcast(0, "hi")
+
+    assert len(sync_db.get_broadcasts("running")) == 5
+    assert flagged(auditor) == []
+
+
+def test_crashed_broadcast_is_marked_failed(adb, sync_db, monkeypatch):
+    add_users(sync_db, 30)
+    broadcaster = Broadcaster(adb, adb.is_banned, rate=1000, page_size=10)
+    bot = ChatBot()
+    get_user_ids_after = adb.get_user_ids_after
+
+    async def broken_after_first_page(after_user_id, limit=500):
+        if after_user_id:
+            raise OSError("disk I/O error")
+        return await get_user_ids_after(after_user_id, limit)
+
+    monkeypatch.setattr(adb, "get_user_ids_after", broken_after_first_page)
+
+    async def scenario():
+        broadcast = await broadcaster.start(bot, 0, "hi")
+        await asyncio.gather(*broadcaster._tasks.values())
+        return broadcast["id"]
+
+    broadcast_id = asyncio.run(scenario())
+
+    row = sync_db.get_broadcast(broadcast_id)
+    assert (row["status"], row["last_user_id"], row["sent"]) == ("failed", 10, 10)
+    assert broadcaster.stats()["failures"] == 1
+    assert broadcaster.stats()["broadcasts"] == {}
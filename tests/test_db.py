@@ -0,0 +1,388 @@
+import asyncio
+import sqlite3
+import time
+from datetime import date, timedelta
+
+from conftest import flagged
+from daily_reset import DailyReset
+from user_cache import UserCache
+
+
+def yesterday(clock) -> str:
+    return (date.fromisoformat(clock.today()) - timedelta(days=1)).isoformat()
+
+
+# ---- асинхронная обёртка ----
+
+
+def test_async_db_calls_storage_methods(adb, sync_db):
+    async def scenario():
+        await adb.add_bot_stars(5)
+        return await adb.get_user(1), await adb.get_bot_stars()
+
+    user, stars = asyncio.run(scenario())
+
+    assert user["user_id"] == 1 and user["daily_attempts_used"] == 0
+    assert stars == 5
+    assert sync_db.get_bot_stars() == 5
+
+
+def test_pool_reuses_connections(adb, sync_db):
+    async def scenario():
+        return await asyncio.gather(*(adb.get_user(user_id) for user_id in range(50)))
+
+    asyncio.run(scenario())
+    stats = sync_db.pool_stats()
+
+    assert stats["acquired"] >= 50
+    assert stats["created"] <= 8
+    assert stats["in_use"] == 0
+
+
+# ---- игра ----
+
+
+def test_parallel_plays_spend_each_attempt_once(adb, sync_db):
+    user_id = 1
+    purchased = 10
+    sync_db.add_purchased_attempts(user_id, purchased)
+    available = sync_db.daily_attempts + purchased
+
+    async def scenario():
+        return await asyncio.gather(*(adb.play_attempt(user_id) for _ in range(available + 10)))
+
+    results = asyncio.run(scenario())
+    played = [r for r in results if not r["no_attempts"]]
+    user = sync_db.get_user(user_id)
+
+    assert len(played) == available
+    assert user["daily_attempts_used"] == sync_db.daily_attempts
+    assert user["purchased_attempts"] == 0
+    assert user["total_wins"] == sum(1 for r in played if r["is_win"])
+    assert user["wins_for_gift"] == user["total_wins"]
+
+
+def test_play_restores_free_attempts_on_new_day(sync_db, clock):
+    sync_db.get_user(1)
+    sync_db.update_user_fields(1, daily_attempts_used=sync_db.daily_attempts, last_attempt_date=yesterday(clock))
+
+    result = sync_db.play_attempt(1)
+
+    assert not result["no_attempts"]
+    assert result["user"]["daily_attempts_used"] == 1
+    assert result["user"]["last_attempt_date"] == clock.today()
+
+
+def test_play_without_attempts_changes_nothing(sync_db, clock):
+    sync_db.get_user(1)
+    sync_db.update_user_fields(1, daily_attempts_used=sync_db.daily_attempts, last_attempt_date=clock.today())
+
+    result = sync_db.play_attempt(1)
+
+    assert result["no_attempts"]
+    assert result["user"]["daily_attempts_used"] == sync_db.daily_attempts
+    assert result["user"]["total_wins"] == 0
+
+
+# ---- кэш пользователей ----
+
+
+def test_user_cache_shows_new_day_without_writing(adb, sync_db, clock):
+    sync_db.get_user(1)
+    sync_db.update_user_fields(1, daily_attempts_used=5, last_attempt_date=yesterday(clock))
+    cache = UserCache(adb, clock)
+
+    async def scenario():
+        return await cache.get(1), await cache.get(1)
+
+    first, second = asyncio.run(scenario())
+
+    assert first["daily_attempts_used"] == 0 and second == first
+    assert sync_db.get_user(1)["daily_attempts_used"] == 5
+    assert cache.stats()["hits"] == 1
+
+
+# ---- платежи ----
+
+
+def test_repeated_charge_id_is_applied_once(sync_db):
+    first = sync_db.apply_payment(1, 10, "XTR", "buy_attempts:10", "charge", attempts=10, bot_stars=10)
+    again = sync_db.apply_payment(1, 10, "XTR", "buy_attempts:10", "charge", attempts=10, bot_stars=10)
+
+    assert first["is_new"] and first["user"]["purchased_attempts"] == 10
+    assert again == {"is_new": False, "user": None, "bot_stars": None}
+    assert sync_db.get_bot_stars() == 10
+    assert sync_db.get_user(1)["purchased_attempts"] == 10
+
+
+# ---- выводы подарков ----
+
+
+def test_withdrawal_reserve_and_rollback(sync_db):
+    sync_db.add_bot_stars(20)
+    sync_db.get_user(1)
+    sync_db.update_user_fields(1, wins_for_gift=50)
+
+    reservation = sync_db.reserve_withdrawal(1, "gift", 15, 50)
+    assert "id" in reservation
+    assert sync_db.get_bot_stars() == 5
+    assert sync_db.get_user(1)["wins_for_gift"] == 0
+    assert sync_db.withdrawal_stats()["reserved_stars"] == 15
+
+    assert sync_db.reserve_withdrawal(1, "gift", 15, 0) == {"error": "no_stars"}
+
+    assert sync_db.rollback_withdrawal(reservation["id"]) is True
+    assert sync_db.get_bot_stars() == 20
+    assert sync_db.get_user(1)["wins_for_gift"] == 50
+    # повторный откат ничего не возвращает второй раз
+    assert sync_db.rollback_withdrawal(reservation["id"]) is False
+    assert sync_db.get_bot_stars() == 20
+
+
+def test_withdrawal_without_wins_keeps_stars(sync_db):
+    sync_db.add_bot_stars(20)
+    sync_db.get_user(1)
+
+    assert sync_db.reserve_withdrawal(1, "gift", 15, 50) == {"error": "no_wins"}
+    assert sync_db.get_bot_stars() == 20
+
+
+def test_parallel_reserves_never_overdraw(adb, sync_db):
+    sync_db.add_bot_stars(40)
+
+    async def scenario():
+        return await asyncio.gather(*(adb.reserve_withdrawal(user_id, "gift", 15, 0) for user_id in range(1, 6)))
+
+    results = asyncio.run(scenario())
+
+    assert sum("id" in r for r in results) == 2
+    assert sync_db.get_bot_stars() == 10
+
+
+def test_commit_withdrawal_counts_gift(sync_db):
+    sync_db.add_bot_stars(15)
+    sync_db.get_user(1)
+    sync_db.update_user_fields(1, wins_for_gift=50)
+    withdrawal_id = sync_db.reserve_withdrawal(1, "gift", 15, 50)["id"]
+
+    sync_db.mark_withdrawal_sending(withdrawal_id)
+    sync_db.commit_withdrawal(withdrawal_id)
+
+    assert sync_db.get_user(1)["gifts_count"] == 1
+    assert sync_db.rollback_withdrawal(withdrawal_id) is False
+    assert sync_db.get_bot_stars() == 0
+
+
+def test_recover_releases_reserved_and_flags_sending(sync_db):
+    sync_db.add_bot_stars(30)
+    reserved = sync_db.reserve_withdrawal(1, "gift", 15, 0)["id"]
+    sending = sync_db.reserve_withdrawal(2, "gift", 15, 0)["id"]
+    sync_db.mark_withdrawal_sending(sending)
+
+    assert sync_db.recover_withdrawals(time.time() + 1) == {"released": 1, "unknown": 1}
+    assert sync_db.get_bot_stars() == 15
+    stats = sync_db.withdrawal_stats()
+    assert stats["unknown"] == 1 and stats["reserved_stars"] == 15
+    assert reserved != sending
+
+
+def test_withdrawal_with_known_key_returns_existing_row(sync_db):
+    sync_db.add_bot_stars(30)
+
+    first = sync_db.reserve_withdrawal(1, "gift", 15, 0, key="task:1")
+    again = sync_db.reserve_withdrawal(1, "gift", 15, 0, key="task:1")
+    assert first == again == {"id": first["id"], "status": "reserved"}
+    assert sync_db.get_bot_stars() == 15
+
+    assert sync_db.mark_withdrawal_sending(first["id"]) is True
+    assert sync_db.mark_withdrawal_sending(first["id"]) is False
+    sync_db.commit_withdrawal(first["id"])
+    assert sync_db.reserve_withdrawal(1, "gift", 15, 0, key="task:1") == {"id": first["id"], "status": "sent"}
+    # ключ помнится и когда звёзд на новый вывод уже не хватает
+    sync_db.reserve_withdrawal(2, "gift", 15, 0)
+    assert sync_db.reserve_withdrawal(1, "gift", 15, 0, key="task:1")["status"] == "sent"
+    assert sync_db.get_bot_stars() == 0
+
+
+# ---- отложенные задачи ----
+
+
+def test_parallel_claims_hand_out_each_task_once(adb, sync_db):
+    now = time.time()
+    for i in range(20):
+        sync_db.schedule_task("job", {"n": i}, now - 1)
+    sync_db.schedule_task("job", {"n": "later"}, now + 3600)
+
+    async def scenario():
+        return await asyncio.gather(*(adb.claim_due_tasks(now, 10, 60, 5) for _ in range(5)))
+
+    claimed = [task for batch in asyncio.run(scenario()) for task in batch]
+    ids = [task["id"] for task in claimed]
+
+    assert len(ids) == 20
+    assert len(set(ids)) == 20
+    assert all(task["attempts"] == 1 and not task["reclaimed"] for task in claimed)
+    assert sync_db.claim_due_tasks(now, 10, 60, 5) == []
+
+
+def test_claimed_task_returns_after_lease(sync_db):
+    now = time.time()
+    task_id = sync_db.schedule_task("job", {}, now - 1)
+    sync_db.claim_due_tasks(now, 10, 30, 5)
+
+    assert sync_db.claim_due_tasks(now + 10, 10, 30, 5) == []
+    again = sync_db.claim_due_tasks(now + 31, 10, 30, 5)
+    assert [(task["id"], task["attempts"], task["reclaimed"]) for task in again] == [(task_id, 2, True)]
+
+
+def test_expired_task_stops_after_max_attempts(sync_db):
+    now = time.time()
+    task_id = sync_db.schedule_task("job", {}, now - 1)
+    for attempt in range(3):
+        assert len(sync_db.claim_due_tasks(now + attempt * 31, 10, 30, 3)) == 1
+
+    # третий воркер тоже не дожил до конца аренды — задача больше не выдаётся
+    assert sync_db.claim_due_tasks(now + 100, 10, 30, 3) == []
+    with sync_db.pool.connection() as conn:
+        row = conn.execute("SELECT status, attempts FROM scheduled_tasks WHERE id = ?", (task_id,)).fetchone()
+    assert (row["status"], row["attempts"]) == ("failed", 3)
+
+
+def test_claim_uses_indexes(sync_db, auditor):
+    now = time.time()
+    for i in range(5):
+        sync_db.schedule_task("job", {"n": i}, now - 1)
+    sync_db.claim_due_tasks(now, 2, 30, 5)
+    sync_db.claim_due_tasks(now + 31, 10, 30, 5)
+
+    assert flagged(auditor) == []
+
+
+def test_complete_task_schedules_next_step(sync_db):
+    now = time.time()
+    task_id = sync_db.schedule_task("first", {}, now - 1)
+    sync_db.claim_due_tasks(now, 10, 60, 5)
+
+    sync_db.complete_task(task_id, ("second", {"x": 1}, now - 1))
+
+    [task] = sync_db.claim_due_tasks(now, 10, 60, 5)
+    assert (task["kind"], task["payload"]) == ("second", {"x": 1})
+
+
+# ---- сброс бесплатных попыток ----
+
+
+def test_daily_reset_clears_everyone_once(adb, sync_db, clock):
+    played = yesterday(clock)
+    with sync_db.pool.connection() as conn:
+        conn.executemany(
+            "INSERT INTO users (user_id, daily_attempts_used, last_attempt_date) VALUES (?, ?, ?)",
+            [(i, 7 if i % 3 == 0 else 0, played if i % 3 == 0 else None) for i in range(1, 301)],
+        )
+    job = DailyReset(adb, clock, batch_size=50)
+
+    async def scenario():
+        return await job.run_once(), await job.run_once()
+
+    first, again = asyncio.run(scenario())
+
+    assert first["users"] == 100
+    assert again is None
+    with sync_db.pool.connection() as conn:
+        left = conn.execute(
+            "SELECT COUNT(*) FROM users WHERE daily_attempts_used != 0 AND last_attempt_date IS NOT ?",
+            (clock.today(),),
+        ).fetchone()[0]
+    assert left == 0
+
+
+# ---- единственный писатель ----
+
+
+def test_group_commit_isolates_failed_command(adb, sync_db):
+    async def scenario():
+        calls = []
+        for i in range(30):
+            calls.append(adb.add_bot_stars(1))
+            calls.append(adb.apply_payment(i, 1, "XTR", "test", f"charge-{i}"))
+            calls.append(adb.update_user_fields(i, no_such_column=1))
+        return await asyncio.gather(*calls, return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    errors = [r for r in results if isinstance(r, Exception)]
+
+    assert len(errors) == 30
+    assert all(isinstance(e, sqlite3.OperationalError) for e in errors)
+    assert sync_db.get_bot_stars() == 30
+    with sync_db.pool.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM payments WHERE payload = 'test'").fetchone()[0] == 30
+    assert adb.writer.stats()["batches"] < len(results)
+
+
+def test_rejected_reserve_rolls_back_only_itself(adb, sync_db):
+    sync_db.add_bot_stars(100)
+
+    async def scenario():
+        calls = []
+        for i in range(10):
+            calls.append(adb.add_bot_stars(1))
+            # побед нет: резерв откатывает уже списанные звёзды
+            calls.append(adb.reserve_withdrawal(i, "gift", 50, 5))
+        return await asyncio.gather(*calls)
+
+    results = asyncio.run(scenario())
+
+    assert results[1::2] == [{"error": "no_wins"}] * 10
+    assert sync_db.get_bot_stars() == 110
+    assert adb.writer.stats()["batches"] < len(results)
+
+
+# ---- баны ----
+
+
+def test_bans_from_another_process_are_picked_up(sync_db, db_path, clock):
+    from db import DB
+
+    other = DB(db_path, clock=clock)
+    try:
+        assert sync_db.refresh_bans() is False
+
+        other.ban_user(7, "spam")
+        assert other.is_banned(7)
+        assert not sync_db.is_banned(7)
+        assert sync_db.refresh_bans() is True
+        assert sync_db.is_banned(7)
+
+        other.unban_user(7)
+        assert sync_db.refresh_bans() is True
+        assert not sync_db.is_banned(7)
+        assert sync_db.refresh_bans() is False
+        assert sync_db.ban_stats()["reloads"] == 2
+    finally:
+        other.close()
+
+
+# ---- топ ----
+
+
+def test_top_pages_and_rank_agree_on_ties(sync_db):
+    with sync_db.pool.connection() as conn:
+        conn.executemany(
+            "INSERT INTO users (user_id, total_wins) VALUES (?, ?)",
+            [(user_id, 5 if user_id % 2 else 3) for user_id in range(40, 0, -1)],
+        )
+
+    pages = [sync_db.get_top_winners(limit=7, offset=offset) for offset in range(0, 42, 7)]
+    order = [row["user_id"] for page in pages for row in page]
+
+    assert order == sorted(range(1, 41, 2)) + sorted(range(2, 41, 2))
+    assert [sync_db.get_user_rank(user_id)["rank"] for user_id in order] == list(range(1, 41))
+    with sync_db.pool.connection() as conn:
+        plan = " ".join(
+            row["detail"]
+            for row in conn.execute(
+                "EXPLAIN QUERY PLAN SELECT user_id, total_wins, gifts_count FROM users "
+                "WHERE total_wins > 0 ORDER BY total_wins DESC, user_id LIMIT 10 OFFSET 0"
+            )
+        )
+    assert "idx_users_top" in plan and "TEMP B-TREE" not in plan
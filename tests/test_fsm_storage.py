@@ -0,0 +1,65 @@
+import asyncio
+
+from aiogram.fsm.storage.base import StorageKey
+
+from fsm_storage import DBStorage
+
+KEY = StorageKey(bot_id=42, chat_id=1, user_id=1)
+
+
+class CountingDB:
+    """
+    Обёртка над AsyncDB, считает чтения fsm_get.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.reads = 0
+
+    async def fsm_get(self, key, now):
+        self.reads += 1
+        return await self.db.fsm_get(key, now)
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+
+def test_missing_state_is_read_once(adb):
+    db = CountingDB(adb)
+    storage = DBStorage(db, cache_ttl=60)
+
+    async def scenario():
+        return [await storage.get_state(KEY) for _ in range(5)]
+
+    assert asyncio.run(scenario()) == [None] * 5
+    assert db.reads == 1
+    assert storage.stats()["cache_hits"] == 4
+
+
+def test_own_writes_are_seen_immediately(adb):
+    db = CountingDB(adb)
+    storage = DBStorage(db, cache_ttl=60)
+
+    async def scenario():
+        await storage.get_state(KEY)
+        await storage.set_state(KEY, "Promo:code")
+        state = await storage.get_state(KEY)
+        await storage.set_data(KEY, {"step": 1})
+        data = await storage.get_data(KEY)
+        data["step"] = 2  # как FSMContext.update_data — кэш не должен поменяться
+        return state, await storage.get_data(KEY)
+
+    assert asyncio.run(scenario()) == ("Promo:code", {"step": 1})
+    assert db.reads == 3
+
+
+def test_zero_cache_ttl_reads_every_time(adb):
+    db = CountingDB(adb)
+    storage = DBStorage(db, cache_ttl=0)
+
+    async def scenario():
+        for _ in range(3):
+            await storage.get_state(KEY)
+
+    asyncio.run(scenario())
+    assert db.reads == 3
@@ -0,0 +1,83 @@
+import asyncio
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import CreateInvoiceLink
+
+from invoices import InvoiceCatalog
+
+
+class InvoiceBot:
+    """
+    Telegram без сети: ссылки нумеруются, отправленное запоминается.
+    """
+
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.links = 0
+        self.messages = []
+        self.invoices = []
+
+    async def create_invoice_link(self, **invoice):
+        if self.fail:
+            raise TelegramBadRequest(CreateInvoiceLink(**invoice), "test")
+        await asyncio.sleep(0)
+        self.links += 1
+        return f"https://t.me/$link-{self.links}"
+
+    async def send_message(self, chat_id, text, reply_markup=None):
+        self.messages.append((chat_id, reply_markup.inline_keyboard[0][0].url))
+
+    async def send_invoice(self, chat_id, **invoice):
+        self.invoices.append((chat_id, invoice["payload"]))
+
+
+def catalog(**kwargs) -> InvoiceCatalog:
+    invoices = InvoiceCatalog(**kwargs)
+    invoices.add("buy_20", InvoiceCatalog.invoice("20 попыток", "test", "buy_attempts:20", "20", 20))
+    return invoices
+
+
+def test_package_link_is_created_once_and_shared():
+    invoices = catalog()
+    bot = InvoiceBot()
+
+    async def scenario():
+        await invoices.prepare(bot)
+        return await asyncio.gather(*(invoices.link(bot, "buy_20") for _ in range(10)))
+
+    links = asyncio.run(scenario())
+
+    assert bot.links == 1 and set(links) == {"https://t.me/$link-1"}
+    assert invoices.button("Купить", "buy_20", "buy_20").url == "https://t.me/$link-1"
+    assert invoices.stats()["hits"] == 10
+
+
+def test_failed_link_falls_back_to_invoice():
+    invoices = catalog()
+    bot = InvoiceBot(fail=True)
+
+    async def scenario():
+        await invoices.prepare(bot)  # не падает: пакет остаётся callback-кнопкой
+        await invoices.send(bot, 1, "buy_20", "Оплата")
+
+    asyncio.run(scenario())
+
+    assert invoices.button("Купить", "buy_20", "buy_20").callback_data == "buy_20"
+    assert bot.invoices == [(1, "buy_attempts:20")] and bot.messages == []
+    assert invoices.stats()["failed"] == 2
+
+
+def test_custom_links_are_bounded():
+    invoices = catalog(max_custom=2)
+    bot = InvoiceBot()
+
+    async def scenario():
+        for amount in (5, 6, 5, 7, 6):
+            invoice = InvoiceCatalog.invoice("Попытки", "test", f"buy_attempts:{amount}", str(amount), amount)
+            await invoices.send(bot, 1, f"buy:{amount}", "Оплата", invoice)
+
+    asyncio.run(scenario())
+
+    # повторный 5 — из LRU, 6 вытеснен суммой 7 и создан заново
+    assert bot.links == 4
+    assert invoices.stats()["custom"] == 2 and invoices.stats()["evicted"] == 2
@@ -0,0 +1,59 @@
+import asyncio
+import os
+from types import SimpleNamespace
+
+import pytest
+from aiogram.types import FSInputFile
+
+from media import MediaCache
+
+
+class FakeBot:
+    """
+    send_photo без сети: аплоад получает новый file_id, file_id шлётся как есть.
+    """
+
+    def __init__(self):
+        self.uploads = 0
+        self.sent = []
+
+    async def send_photo(self, chat_id, photo, **kwargs):
+        if isinstance(photo, FSInputFile):
+            self.uploads += 1
+            photo = f"file-{self.uploads}"
+        self.sent.append(photo)
+        return SimpleNamespace(photo=[SimpleNamespace(file_id=photo)])
+
+
+def test_changed_file_is_uploaded_again(adb, sync_db, tmp_path):
+    path = tmp_path / "cat.jpg"
+    path.write_bytes(b"old cat")
+    media = MediaCache(adb)
+    bot = FakeBot()
+
+    async def send():
+        await media.send(bot, 1, "photo", "cat", str(path))
+
+    asyncio.run(send())
+    asyncio.run(send())
+    assert bot.sent == ["file-1", "file-1"]
+
+    path.write_bytes(b"a brand new cat")
+    os.utime(path, ns=(0, path.stat().st_mtime_ns + 1_000_000))
+    asyncio.run(send())
+
+    assert bot.sent == ["file-1", "file-1", "file-2"]
+    assert media.stats()["uploads"] == 2
+    # в базе остался только file_id новой версии
+    with sync_db.pool.connection() as conn:
+        assert [row["file_id"] for row in conn.execute("SELECT file_id FROM media_cache")] == ["file-2"]
+
+
+def test_missing_file_is_reported(adb, tmp_path):
+    media = MediaCache(adb)
+
+    async def send():
+        await media.send(FakeBot(), 1, "photo", "cat", str(tmp_path / "nope.jpg"))
+
+    with pytest.raises(FileNotFoundError):
+        asyncio.run(send())
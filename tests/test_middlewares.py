@@ -0,0 +1,130 @@
+import asyncio
+
+from aiogram.types import CallbackQuery, PreCheckoutQuery, User
+
+from middlewares import BanMiddleware, ThrottlingMiddleware
+
+
+class FakeCallback(CallbackQuery):
+    """
+    Нажатие кнопки без бота: answer() только запоминает текст.
+    """
+
+    async def answer(self, text=None, **kwargs):
+        ANSWERS.append(text)
+
+
+class FakePreCheckout(PreCheckoutQuery):
+    async def answer(self, ok, error_message=None, **kwargs):
+        ANSWERS.append((ok, error_message))
+
+
+ANSWERS: list = []
+
+
+def press(user_id: int = 1, data: str = "play") -> FakeCallback:
+    return FakeCallback(
+        id="1",
+        from_user=User(id=user_id, is_bot=False, first_name="test"),
+        chat_instance="test",
+        data=data,
+    )
+
+
+def test_burst_passes_then_presses_are_throttled():
+    throttle = ThrottlingMiddleware(rate=1, burst=3, callback_data={"play"})
+    now = 100.0
+
+    verdicts = []
+    for _ in range(5):
+        verdicts.append(throttle._take(1, now))
+        throttle._state[1][2] = False  # нажатие обработано
+
+    assert verdicts == ["ok", "ok", "ok", "limit", "limit"]
+    # за секунду набегает один токен
+    assert throttle._take(1, now + 1) == "ok"
+    throttle._state[1][2] = False
+    assert throttle._take(1, now + 1) == "limit"
+    # чужой бакет не тронут
+    assert throttle._take(2, now) == "ok"
+
+
+def test_throttled_press_never_reaches_handler():
+    ANSWERS.clear()
+    throttle = ThrottlingMiddleware(rate=0.001, burst=2, callback_data={"play"})
+    handled = []
+
+    async def handler(event, data):
+        handled.append(event.data)
+
+    async def scenario():
+        for _ in range(5):
+            await throttle(handler, press(), {})
+        await throttle(handler, press(data="profile"), {})
+
+    asyncio.run(scenario())
+
+    assert handled == ["play", "play", "profile"]
+    assert ANSWERS == [throttle.text] * 3
+    assert throttle.stats()["throttled"] == 3
+
+
+def test_press_during_handler_is_coalesced():
+    ANSWERS.clear()
+    throttle = ThrottlingMiddleware(rate=100, burst=10, callback_data={"play"})
+    release = asyncio.Event()
+    handled = []
+
+    async def handler(event, data):
+        handled.append(event.data)
+        await release.wait()
+
+    async def scenario():
+        first = asyncio.create_task(throttle(handler, press(), {}))
+        await asyncio.sleep(0)
+        await throttle(handler, press(), {})
+        release.set()
+        await first
+        await throttle(handler, press(), {})
+
+    asyncio.run(scenario())
+
+    assert handled == ["play", "play"]
+    assert throttle.stats()["coalesced"] == 1
+
+
+def test_idle_users_are_evicted():
+    throttle = ThrottlingMiddleware(rate=1, burst=1, max_users=2, ttl=10)
+    for user_id in range(5):
+        throttle._take(user_id, 0.0)
+        throttle._state[user_id][2] = False
+        throttle._expire(0.0)
+
+    assert len(throttle._state) == 2
+    throttle._expire(100.0)
+    assert len(throttle._state) == 0
+
+
+def test_banned_user_cannot_pay_by_shared_link():
+    ANSWERS.clear()
+    bans = BanMiddleware(lambda user_id: user_id == 7)
+    handled = []
+
+    async def handler(event, data):
+        handled.append(event.from_user.id)
+
+    def checkout(user_id: int) -> FakePreCheckout:
+        user = User(id=user_id, is_bot=False, first_name="test")
+        return FakePreCheckout(
+            id="1", from_user=user, currency="XTR", total_amount=20, invoice_payload="buy_attempts:20"
+        )
+
+    async def scenario():
+        for user_id in (7, 8):
+            event = checkout(user_id)
+            await bans(handler, event, {"event_from_user": event.from_user})
+
+    asyncio.run(scenario())
+
+    assert handled == [8]
+    assert ANSWERS == [(False, "Ты забанен 🚫")]
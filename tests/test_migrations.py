@@ -0,0 +1,81 @@
+import sqlite3
+
+from db import ConnectionPool
+from migrations import LATEST_VERSION, migrate, schema_version
+
+
+def legacy_db(path: str, payments: int):
+    """
+    База в формате до миграций: users и payments без новых колонок и индексов.
+    """
+    conn = sqlite3.connect(path)
+    conn.execute(
+        """
+        CREATE TABLE users (
+            user_id INTEGER PRIMARY KEY,
+            total_wins INTEGER NOT NULL DEFAULT 0,
+            wins_for_gift INTEGER NOT NULL DEFAULT 0,
+            gifts_count INTEGER NOT NULL DEFAULT 0,
+            daily_attempts_used INTEGER NOT NULL DEFAULT 0,
+            last_attempt_date TEXT
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE payments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            total_amount INTEGER NOT NULL,
+            currency TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        )
+        """
+    )
+    conn.executemany(
+        "INSERT INTO payments (user_id, total_amount, currency, payload, created_at) VALUES (?, ?, 'XTR', ?, ?)",
+        (
+            (i % 100, 10 + i % 7, ("topup", "buy_attempts_10", "dice_game")[i % 3], f"2024-01-{1 + i % 28:02d}T12:00:00")
+            for i in range(payments)
+        ),
+    )
+    conn.commit()
+    conn.close()
+
+
+def test_legacy_database_is_migrated_once(db_path):
+    legacy_db(db_path, 12_000)
+    pool = ConnectionPool(db_path, size=2)
+    try:
+        applied = migrate(pool, pause=0)
+
+        assert [m["version"] for m in applied] == list(range(1, LATEST_VERSION + 1))
+        assert schema_version(pool) == LATEST_VERSION
+        # заполнение сумм шло несколькими короткими транзакциями
+        assert next(m for m in applied if m["version"] == 6)["batches"] > 1
+        with pool.connection() as conn:
+            daily = conn.execute("SELECT SUM(payments_count), SUM(total_amount) FROM payment_daily").fetchone()
+            raw = conn.execute("SELECT COUNT(*), SUM(total_amount) FROM payments").fetchone()
+        assert tuple(daily) == tuple(raw)
+
+        assert migrate(pool, pause=0) == []
+    finally:
+        pool.close()
+
+
+def test_fresh_database_has_every_index(db_path):
+    pool = ConnectionPool(db_path, size=2)
+    try:
+        migrate(pool, pause=0)
+        with pool.connection() as conn:
+            indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    finally:
+        pool.close()
+
+    assert {
+        "idx_users_top",
+        "idx_scheduled_tasks_lease",
+        "idx_withdrawals_idempotency_key",
+        "idx_broadcasts_status",
+    } <= indexes
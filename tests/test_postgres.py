@@ -0,0 +1,127 @@
+"""
+Те же гарантии, что в test_db.py, на PostgreSQL под конкурентной нагрузкой.
+
+Нужны asyncpg и отдельная (пустая или тестовая) база — таблицы очищаются
+перед каждым тестом:
+
+    TEST_DATABASE_URL=postgresql://bot@localhost/bot_test python -m pytest tests/test_postgres.py
+"""
+
+import asyncio
+import os
+import time
+
+import pytest
+
+pytest.importorskip("asyncpg")
+
+from db_postgres import PostgresDB  # noqa: E402
+
+DSN = os.getenv("TEST_DATABASE_URL")
+
+pytestmark = pytest.mark.skipif(not DSN, reason="TEST_DATABASE_URL не задан")
+
+TABLES = (
+    "users",
+    "payments",
+    "payment_daily",
+    "withdrawals",
+    "bans",
+    "media_cache",
+    "scheduled_tasks",
+    "broadcasts",
+    "fsm_state",
+    "promo_codes",
+    "promo_used",
+    "daily_resets",
+)
+
+
+def run(scenario):
+    """
+    Пул asyncpg привязан к циклу событий — база живёт внутри одного asyncio.run.
+    """
+
+    async def main():
+        db = PostgresDB(DSN, pool_size=10)
+        await db.connect()
+        try:
+            async with db.connection() as conn:
+                await conn.execute(f"TRUNCATE {', '.join(TABLES)} RESTART IDENTITY")
+                await conn.execute("UPDATE bot_balance SET stars = 0")
+            return await scenario(db)
+        finally:
+            await db.close()
+
+    return asyncio.run(main())
+
+
+def test_parallel_plays_spend_each_attempt_once():
+    async def scenario(db):
+        await db.add_purchased_attempts(1, 10)
+        available = db.daily_attempts + 10
+        results = await asyncio.gather(*(db.play_attempt(1) for _ in range(available + 10)))
+        return available, results, await db.get_user(1)
+
+    available, results, user = run(scenario)
+    played = [r for r in results if not r["no_attempts"]]
+
+    assert len(played) == available
+    assert user["purchased_attempts"] == 0
+    assert user["total_wins"] == sum(1 for r in played if r["is_win"])
+
+
+def test_parallel_first_reads_create_one_user():
+    async def scenario(db):
+        users = await asyncio.gather(*(db.get_user(7) for _ in range(10)))
+        async with db.connection() as conn:
+            return users, await conn.fetchval("SELECT COUNT(*) FROM users WHERE user_id = 7")
+
+    users, count = run(scenario)
+
+    assert count == 1
+    assert all(user == users[0] for user in users)
+
+
+def test_one_time_promo_is_redeemed_once():
+    async def scenario(db):
+        await db.create_promo("CATS", 5, 1)
+        results = await asyncio.gather(*(db.redeem_promo(user_id, "CATS") for user_id in range(1, 21)))
+        return results, await db.get_promo("CATS")
+
+    results, promo = run(scenario)
+
+    assert sum("error" not in r for r in results) == 1
+    assert {r["error"] for r in results if "error" in r} == {"not_found"}
+    assert promo is None
+
+
+def test_parallel_reserves_never_overdraw():
+    async def scenario(db):
+        await db.add_bot_stars(40)
+        results = await asyncio.gather(
+            *(db.reserve_withdrawal(user_id, "gift", 15, 0) for user_id in range(1, 11))
+        )
+        # повторы одной задачи с одним ключом создают один вывод
+        keyed = await asyncio.gather(*(db.reserve_withdrawal(1, "gift", 5, 0, key="task:1") for _ in range(5)))
+        return results, keyed, await db.get_bot_stars()
+
+    results, keyed, stars = run(scenario)
+
+    assert sum("id" in r for r in results) == 2
+    assert len({r["id"] for r in keyed}) == 1
+    assert stars == 40 - 2 * 15 - 5
+
+
+def test_parallel_claims_hand_out_each_task_once():
+    async def scenario(db):
+        now = time.time()
+        for i in range(50):
+            await db.schedule_task("job", {"n": i}, now - 1)
+        batches = await asyncio.gather(*(db.claim_due_tasks(now, 10, 60, 5) for _ in range(10)))
+        return [task["id"] for batch in batches for task in batch]
+
+    ids = run(scenario)
+
+    assert len(ids) == 50
+    assert len(set(ids)) == 50
@@ -0,0 +1,86 @@
+import asyncio
+
+from conftest import flagged
+from promo import PromoService, parse_promos
+
+
+def test_one_time_code_is_redeemed_once(adb, sync_db):
+    promos = PromoService(adb)
+
+    async def scenario():
+        await promos.create("cats", 5, 1)
+        return await asyncio.gather(*(promos.redeem(user_id, "CATS") for user_id in range(1, 11)))
+
+    results = asyncio.run(scenario())
+    winners = [user_id for user_id, result in enumerate(results, start=1) if "reward" in result]
+
+    assert len(winners) == 1
+    assert sync_db.get_user(winners[0])["wins_for_gift"] == 5
+    assert promos.stats()["redeemed"] == 1 and promos.stats()["rejected"] == 9
+
+
+def test_reusable_code_is_redeemed_once_per_user(adb):
+    promos = PromoService(adb)
+
+    async def scenario():
+        await promos.create("CATS", 2, 0)
+        return [await promos.redeem(user_id, "cats ") for user_id in (1, 1, 2)]
+
+    first, again, other = asyncio.run(scenario())
+
+    assert first["reward"] == 2 and other["reward"] == 2
+    assert again == {"error": "used"}
+
+
+def test_code_from_another_process_is_found_in_db(adb):
+    here = PromoService(adb, ttl=3600)
+    elsewhere = PromoService(adb, ttl=3600)
+
+    async def scenario():
+        # "нет такого кода" уже в кэше, когда код появился
+        assert await here.redeem(1, "NOPE") == {"error": "not_found"}
+        await elsewhere.create("FRESH", 3, 0)
+        return await here.redeem(1, " fresh ")
+
+    result = asyncio.run(scenario())
+
+    assert result["reward"] == 3
+    assert here.stats()["lookups"] == 2
+    assert here.stats()["cache_rejects"] == 1
+
+
+def test_lookups_are_cached_and_bounded(adb, auditor):
+    promos = PromoService(adb, max_codes=3)
+
+    async def scenario():
+        await promos.generate(50, 1, one_time=0)
+        for code in ["A", "B", "A", "C", "D", "A", "B"]:
+            await promos.redeem(1, code)
+
+    asyncio.run(scenario())
+
+    # повторный A — из кэша, B вытеснен кодом D и перечитан
+    assert promos.stats()["lookups"] == 5
+    assert promos.stats()["cached"] == 3
+    assert flagged(auditor) == []
+
+
+def test_import_skips_existing_codes_and_export_round_trips(adb):
+    promos = PromoService(adb)
+    lines = ["code,reward_wins,one_time\n", "aaa,1,1\n", "BBB,2,0\n", "broken\n", "CCC,x,1\n"]
+
+    async def scenario():
+        # "нет такого кода" в кэше не должно пережить импорт
+        assert await promos.redeem(1, "AAA") == {"error": "not_found"}
+        await promos.create("BBB", 2, 0)
+        result = await promos.import_lines(lines, "csv", batch_size=1)
+        exported = [line async for line in promos.export_lines("json", page_size=1)]
+        return result, exported, await promos.redeem(1, "AAA")
+
+    result, exported, redeemed = asyncio.run(scenario())
+
+    assert (result["imported"], result["skipped"], result["invalid"]) == (1, 1, [4, 5])
+    errors = []
+    assert list(parse_promos(exported, "json", errors)) == [("AAA", 1, 1), ("BBB", 2, 0)]
+    assert errors == []
+    assert redeemed["reward"] == 1
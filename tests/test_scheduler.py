@@ -0,0 +1,132 @@
+import asyncio
+import time
+
+from scheduler import PermanentTaskError, TaskScheduler
+
+
+def run_due(scheduler: TaskScheduler, db, now: float | None = None):
+    """
+    Один проход планировщика без его цикла: забрать и выполнить задачи.
+    """
+
+    async def scenario():
+        tasks = await db.claim_due_tasks(now or time.time(), 10, 60, scheduler.max_attempts)
+        for task in tasks:
+            await scheduler._sem.acquire()
+            await scheduler._execute(None, task)
+        return tasks
+
+    return asyncio.run(scenario())
+
+
+def task_row(sync_db, task_id: int):
+    with sync_db.pool.connection() as conn:
+        return conn.execute("SELECT * FROM scheduled_tasks WHERE id = ?", (task_id,)).fetchone()
+
+
+def test_handler_gets_task_id_and_failure_is_retried(adb, sync_db):
+    scheduler = TaskScheduler(adb)
+    seen = []
+
+    @scheduler.handler("flaky")
+    async def flaky(bot, payload, task_id):
+        seen.append(task_id)
+        raise RuntimeError("boom")
+
+    task_id = sync_db.schedule_task("flaky", {}, time.time() - 1)
+    run_due(scheduler, adb)
+
+    row = task_row(sync_db, task_id)
+    assert seen == [task_id]
+    assert row["status"] == "pending" and row["run_at"] > time.time()
+    assert scheduler.stats()["failed"] == 0
+
+
+def test_permanent_error_is_not_retried(adb, sync_db):
+    scheduler = TaskScheduler(adb)
+
+    @scheduler.handler("send")
+    async def send(bot, payload, task_id):
+        raise PermanentTaskError("message may have been delivered")
+
+    task_id = sync_db.schedule_task("send", {}, time.time() - 1)
+    run_due(scheduler, adb)
+
+    assert task_row(sync_db, task_id)["status"] == "failed"
+    assert scheduler.stats()["failed"] == 1
+
+
+def test_failed_completion_does_not_rerun_handler(adb, sync_db, monkeypatch):
+    scheduler = TaskScheduler(adb)
+    calls = []
+    complete_task = adb.complete_task
+    failures = [OSError("disk hiccup")]
+
+    async def flaky_complete(task_id, next_task=None):
+        if failures:
+            raise failures.pop()
+        return await complete_task(task_id, next_task)
+
+    monkeypatch.setattr(adb, "complete_task", flaky_complete)
+
+    @scheduler.handler("gift")
+    async def gift(bot, payload, task_id):
+        calls.append(task_id)
+
+    task_id = sync_db.schedule_task("gift", {}, time.time() - 1)
+    run_due(scheduler, adb)
+
+    # повторилась только запись результата, хендлер отработал один раз
+    assert calls == [task_id]
+    assert task_row(sync_db, task_id) is None
+    assert scheduler.stats()["done"] == 1
+
+
+def test_once_task_is_not_rerun_after_crash(adb, sync_db):
+    scheduler = TaskScheduler(adb)
+    calls = []
+
+    @scheduler.handler("dice", once=True)
+    async def dice(bot, payload, task_id):
+        calls.append(task_id)
+
+    task_id = sync_db.schedule_task("dice", {}, time.time() - 1)
+    # воркер забрал задачу и упал, не записав результат
+    sync_db.claim_due_tasks(time.time(), 10, 60, 5)
+    run_due(scheduler, adb, now=time.time() + 61)
+
+    assert calls == []
+    assert task_row(sync_db, task_id)["status"] == "failed"
+    assert scheduler.stats()["failed"] == 1
+
+
+def test_loop_survives_database_errors(adb, sync_db, monkeypatch):
+    scheduler = TaskScheduler(adb, poll_interval=0.01)
+    done = []
+    next_task_run_at = adb.next_task_run_at
+    failures = [OSError("database is locked")] * 2
+
+    async def flaky_next_run_at():
+        if failures:
+            raise failures.pop()
+        return await next_task_run_at()
+
+    monkeypatch.setattr(adb, "next_task_run_at", flaky_next_run_at)
+
+    @scheduler.handler("job")
+    async def job(bot, payload, task_id):
+        done.append(payload["n"])
+
+    async def scenario():
+        await scheduler.start(None)
+        await scheduler.schedule("job", {"n": 1}, delay=0.05)
+        for _ in range(100):
+            if done:
+                break
+            await asyncio.sleep(0.02)
+        await scheduler.stop()
+
+    asyncio.run(scenario())
+
+    assert done == [1]
+    assert scheduler.stats()["loop_errors"] == 2
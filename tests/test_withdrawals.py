@@ -0,0 +1,53 @@
+import asyncio
+
+from aiogram.exceptions import TelegramBadRequest, TelegramNetworkError
+from aiogram.methods import SendGift
+
+from withdrawals import WithdrawalEngine
+
+
+class GiftBot:
+    def __init__(self, error=None):
+        self.gifts = []
+        self.error = error
+
+    async def send_gift(self, gift_id, user_id, text):
+        if self.error:
+            raise self.error(SendGift(gift_id=gift_id, user_id=user_id), "test")
+        self.gifts.append((gift_id, user_id))
+
+
+def test_repeated_task_sends_gift_once(adb, sync_db):
+    sync_db.add_bot_stars(30)
+    engine = WithdrawalEngine(adb)
+    bot = GiftBot()
+
+    async def scenario():
+        return [await engine.withdraw(bot, 1, "bear", 15, 0, "🎁", key="task:7") for _ in range(3)]
+
+    assert asyncio.run(scenario()) == ["ok", "ok", "ok"]
+    assert bot.gifts == [("bear", 1)]
+    assert sync_db.get_bot_stars() == 15
+    assert engine.stats()["repeated"] == 2
+
+
+def test_network_error_keeps_reserve_for_recover(adb, sync_db):
+    sync_db.add_bot_stars(15)
+    engine = WithdrawalEngine(adb)
+
+    result = asyncio.run(engine.withdraw(GiftBot(TelegramNetworkError), 1, "bear", 15, 0, "🎁"))
+
+    # подарок мог уйти: звёзды не возвращаем, вывод ждёт recover()
+    assert result == "unknown"
+    assert sync_db.get_bot_stars() == 0
+    assert sync_db.withdrawal_stats()["sending"] == 1
+
+
+def test_rejected_gift_is_rolled_back(adb, sync_db):
+    sync_db.add_bot_stars(15)
+    engine = WithdrawalEngine(adb)
+
+    result = asyncio.run(engine.withdraw(GiftBot(TelegramBadRequest), 1, "bear", 15, 0, "🎁"))
+
+    assert result == "failed"
+    assert sync_db.get_bot_stars() == 15
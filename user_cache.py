@@ -0,0 +1,83 @@
+import time
+from collections import OrderedDict
+
+from daily_reset import GameClock
+
+
+# ================== КЭШ ПОЛЬЗОВАТЕЛЕЙ ==================
+
+
+class UserCache:
+    """
+    Строки users в памяти процесса — для экранов (старт, профиль, меню вывода).
+
+    Держит не больше max_users записей (давние вытесняются), запись старше
+    ttl секунд перечитывается из базы — страховка от изменений в другом процессе.
+
+    Если last_attempt_date не сегодня, бесплатные попытки показываются
+    целиком — без записи в базу: её обнуляет DailyReset, а play_attempt
+    сам сверяет дату.
+
+    Победы, попытки и баланс в кэше не меняются: их пишет только база
+    (play_attempt, выводы, платежи, промокоды). После таких операций запись
+    обновляется строкой из базы (put) или сбрасывается (invalidate).
+    Решения о деньгах по кэшу не принимаются — резервы проверяются в базе.
+    """
+
+    def __init__(self, db, clock: GameClock, max_users: int = 10_000, ttl: float = 30):
+        self.db = db
+        self.clock = clock
+        self.max_users = max_users
+        self.ttl = ttl
+
+        # user_id -> (строка, когда прочитана)
+        self._rows: OrderedDict[int, tuple[dict, float]] = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    # ---- чтение ----
+
+    async def get(self, user_id: int) -> dict:
+        now = time.monotonic()
+        cached = self._rows.get(user_id)
+        if cached is not None and now - cached[1] < self.ttl:
+            self.hits += 1
+            self._rows.move_to_end(user_id)
+            row = dict(cached[0])
+        else:
+            self.misses += 1
+            row = await self.db.get_user(user_id)
+            self._store(dict(row), now)
+
+        if row["last_attempt_date"] != self.clock.today():
+            row["daily_attempts_used"] = 0
+        return row
+
+    def put(self, row: dict):
+        """
+        Свежая строка из базы (например, после play_attempt).
+        """
+        self._store(dict(row), time.monotonic())
+
+    def invalidate(self, user_id: int):
+        self._rows.pop(user_id, None)
+
+    def _store(self, row: dict, now: float):
+        user_id = row["user_id"]
+        self._rows[user_id] = (row, now)
+        self._rows.move_to_end(user_id)
+        while len(self._rows) > self.max_users:
+            self._rows.popitem(last=False)
+            self.evicted += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._rows),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evicted": self.evicted,
+        }
@@ -1,6 +1,12 @@
 import sqlite3
+import sys
 
-conn = sqlite3.connect("bot.db")
+from query_audit import AuditedConnection, QueryAuditor, format_report
+
+conn = sqlite3.connect("bot.db", factory=AuditedConnection)
+# python view_db.py --audit — в конце ещё планы этих запросов
+if "--audit" in sys.argv:
+    conn.auditor = QueryAuditor()
 conn.row_factory = sqlite3.Row
 
 cur = conn.execute("SELECT * FROM users LIMIT 20")
@@ -18,4 +24,8 @@ cur = conn.execute("SELECT * FROM payments ORDER BY id DESC LIMIT 10")
 for row in cur:
     print(dict(row))
 
+if conn.auditor is not None:
+    print()
+    print(format_report(conn.auditor.report()))
+
 conn.close()
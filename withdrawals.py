@@ -0,0 +1,101 @@
+import logging
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramNetworkError, TelegramServerError
+
+
+# ================== ВЫВОД ПОДАРКОВ ==================
+
+
+class WithdrawalEngine:
+    """
+    Вывод подарков через резерв.
+
+    1. Одной транзакцией резервируем звёзды бота и победы игрока
+       (баланс не уйдёт в минус, победы не спишутся дважды).
+    2. Шлём подарок — без транзакций и глобальных локов, так что
+       разные выводы идут параллельно.
+    3. Успех — фиксируем списание, ошибка Telegram — возвращаем резерв.
+       Сетевая ошибка или 5xx — исход неизвестен (подарок мог уйти):
+       резерв не трогаем, вывод остаётся в sending до recover().
+
+    С ключом key (например, id отложенной задачи) повтор того же вывода
+    не резервирует и не шлёт подарок заново, а отдаёт исход первой попытки.
+    recover() при старте разбирает выводы, зависшие после падения.
+    """
+
+    def __init__(self, db, stale_after: float = 60):
+        self.db = db
+        self.stale_after = stale_after
+
+        self.sent = 0
+        self.rolled_back = 0
+        self.rejected = 0
+        self.repeated = 0
+        self.unknown = 0
+
+    async def withdraw(
+        self,
+        bot: Bot,
+        user_id: int,
+        gift_id: str,
+        cost_stars: int,
+        wins_cost: int,
+        text: str,
+        key: str | None = None,
+    ) -> str:
+        """
+        Возвращает "ok", "no_stars", "no_wins", "failed" или "unknown"
+        (подарок, возможно, ушёл — резерв держится до recover() и админа).
+        """
+        reservation = await self.db.reserve_withdrawal(user_id, gift_id, cost_stars, wins_cost, key)
+        if "error" in reservation:
+            self.rejected += 1
+            return reservation["error"]
+
+        withdrawal_id = reservation["id"]
+        if reservation["status"] != "reserved":
+            # повтор с тем же ключом: вывод уже шёл, второй раз не шлём
+            self.repeated += 1
+            return {"sent": "ok", "failed": "failed"}.get(reservation["status"], "unknown")
+
+        if not await self.db.mark_withdrawal_sending(withdrawal_id):
+            # резерв уже забрал другой повтор (или recover() его вернул)
+            self.repeated += 1
+            return "unknown"
+        try:
+            await bot.send_gift(gift_id=gift_id, user_id=user_id, text=text)
+        except (TelegramNetworkError, TelegramServerError) as e:
+            # запрос мог дойти до Telegram — возврат резерва подарил бы бесплатно
+            logging.warning("Исход отправки подарка неизвестен (вывод %s): %s", withdrawal_id, e)
+            self.unknown += 1
+            return "unknown"
+        except TelegramAPIError as e:
+            logging.exception("Ошибка при отправке подарка (вывод %s): %s", withdrawal_id, e)
+            await self.db.rollback_withdrawal(withdrawal_id)
+            self.rolled_back += 1
+            return "failed"
+
+        await self.db.commit_withdrawal(withdrawal_id)
+        self.sent += 1
+        return "ok"
+
+    async def recover(self) -> dict:
+        result = await self.db.recover_withdrawals(time.time() - self.stale_after)
+        if result["released"] or result["unknown"]:
+            logging.warning(
+                "Восстановление выводов: возвращено резервов %s, неизвестный исход у %s (нужна проверка админом)",
+                result["released"],
+                result["unknown"],
+            )
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "sent": self.sent,
+            "rolled_back": self.rolled_back,
+            "rejected": self.rejected,
+            "repeated": self.repeated,
+            "unknown": self.unknown,
+        }